@@ -12,9 +12,11 @@ import mimetypes
 from enum import Enum
 import re
 from dateutil.parser import parse as dateparse
-import pdfplumber
-from pdfminer.high_level import extract_pages
-from pdfminer.layout import LTTextBoxHorizontal,  LAParams
+from beancount_importers_india.utils.pdf import PdfSession, get_pdf_session, map_pages
+from beancount_importers_india.utils.cache import cached
+from beancount_importers_india.utils import transactions
+from beancount_importers_india.utils import dates
+from beancount_importers_india.utils import amounts
 
 class Column(Enum):
     DATE = 'DATE'
@@ -22,11 +24,6 @@ class Column(Enum):
     AMOUNT = 'AMOUNT (Rs.)'
     CASHBACK= 'CASHBACK EARNED' # optional. available in Flipkart Axis Bank Credit Card statement but not in Axis Neo
 
-def is_debit(text:str)->bool:
-    if 'Dr' in text: return True
-    if 'Cr' in text: return False
-    raise ValueError(f'Cannot determine if the transaction is a debit or credit: {text}')
-
 def extract_headers(elements:list, header_line)->dict[Column, dict]:
     """Extract headers from a list of elements that are within the header block"""
     elements = [e for e in elements if header_line['chars'][0]['y0'] >= e.y0 and header_line['chars'][0]['y1'] <= e.y1]
@@ -39,17 +36,15 @@ def extract_headers(elements:list, header_line)->dict[Column, dict]:
             pass
     return headers
 
-def extract_transactions_from_page(pdf_path:str, password:str, page_number:int=0)->pd.DataFrame:
+def extract_transactions_from_page(session:PdfSession, page_number:int=0)->pd.DataFrame:
     # We are looking for a table with the following headers.
     # we first detect the position of these headers
     header_pattern = r'MERCHANT CATEGORY'
     footer_pattern = r'End of Statement'
-    # for page in pdfplumber.open(pdf_path).pages:
-    page = pdfplumber.open(pdf_path, password=password).pages[page_number]
-    text_lines = page.extract_text_lines()
+    text_lines = session.text_lines(page_number)
     header = [line for line in text_lines if re.search(header_pattern, line['text'].strip())]
     if not header:
-        print(f"Skipping page {page.page_number}. No headers found. File: {pdf_path}")
+        print(f"Skipping page {page_number+1}. No headers found. File: {session.path}")
         return pd.DataFrame(columns=[c for c in Column])
     header = header[0]
     footer = [line for line in text_lines if re.search(footer_pattern, line['text'].strip())]
@@ -59,7 +54,7 @@ def extract_transactions_from_page(pdf_path:str, password:str, page_number:int=0
         return pd.DataFrame(columns=['DATE'])
     
     # get all text lines between the header and footer
-    text_lines = [e for page_ in extract_pages(pdf_path, password=password, laparams=LAParams(line_margin=0), page_numbers=[page_number]) for e in page_ if isinstance(e, LTTextBoxHorizontal)]
+    text_lines = session.layout_boxes(page_number)
     headers_map = extract_headers(text_lines, header)
     
     text_lines = [e for e in text_lines if e.y1 < header['chars'][0]['y0'] and (footer is None or e.y0 > footer['chars'][0]['y1'])]
@@ -98,8 +93,9 @@ def extract_transactions_from_page(pdf_path:str, password:str, page_number:int=0
     rows = [row for row in rows if row] # remove empty rows
     for row in rows:
         for k, v in row.items(): # clean up the rows
-            row[k] = v.strip('--') if k != Column.DATE else dateparse(v, dayfirst=True, fuzzy=True).date()
+            row[k] = v.strip('--')
     df = pd.DataFrame(rows)
+    df[Column.DATE] = dates.parse_dates(df[Column.DATE], dayfirst=True, fuzzy=True)
     
     # return df in consistent order
     cols = [Column.DATE, Column.PARTICULARS, Column.AMOUNT]
@@ -123,56 +119,34 @@ class AxisCreditCardEmailImporter(importer.ImporterProtocol):
         if mimetypes.guess_type(f.name)[0] != 'application/pdf': return False
         # grepping the account number from the file should return 0
         try:
-            page = pdfplumber.open(f.name, password=self.password).pages[0]
-            text = page.extract_text()
+            text = get_pdf_session(f, self.password).text(0)
             if not f'******{self.last_4}' in text: return False
             if not self.name_in_file in text: return False
             return True
         except:
             return False
     
+    @cached
     def extract(self, f, existing_entries=None):
-        entries = []
-        
-        num_pages = len(pdfplumber.open(f.name, password=self.password).pages)
-        df = pd.concat([extract_transactions_from_page(f.name, self.password, i) for i in range(num_pages)], ignore_index=True)
-
-        for index, row in df.iterrows():
-            trans_date = row[Column.DATE]
-            trans_desc = row[Column.PARTICULARS]
-            is_debit_ = is_debit(row[Column.AMOUNT])
-            trans_amt  = (-1 if is_debit_ else 1)*D(row[Column.AMOUNT].rstrip('CcDdr'))
-            cashback_amt  = (1 if is_debit_ else -1)*D(row[Column.CASHBACK].rstrip('CcDdr')) if Column.CASHBACK in df.columns else None
-
-            meta = data.new_metadata(f.name, index)
-
-            posting_meta = {}
-            posting_meta['document'] = Path(f.name).name
-
-            txn = data.Transaction(
-                meta=meta,
-                date=trans_date,
-                flag=flags.FLAG_OKAY,
-                payee=None,
-                narration = trans_desc,
-                tags=set(),
-                links=set(),
-                postings=[],
-            )
-
-            txn.postings.append(
-                data.Posting(self.account, amount.Amount(trans_amt,
-                    'INR'), None, None, None, posting_meta)
-            )
-            if cashback_amt is not None and cashback_amt != 0:
-                txn.postings.append(
-                    data.Posting(self.cashback_account, amount.Amount(cashback_amt,
-                        'INR'), None, None, None, {})
-                )
-
-            entries.append(txn)
-
-        return entries
+        df = pd.concat(map_pages(extract_transactions_from_page, get_pdf_session(f, self.password)), ignore_index=True)
+        if df.empty:
+            return []
+
+        # every amount is marked as a debit (Dr) or a credit (Cr)
+        numbers = amounts.parse_amounts(df[Column.AMOUNT], require_marker=True)
+        rows = pd.DataFrame({
+            transactions.DATE: df[Column.DATE],
+            transactions.NARRATION: df[Column.PARTICULARS],
+            transactions.AMOUNT: numbers,
+        })
+        extra_postings = []
+        if Column.CASHBACK in df.columns:
+            # cashback is earned on debits and reversed on credits
+            cashback = amounts.parse_amounts(df[Column.CASHBACK], empty=amounts.ZERO).map(abs)
+            rows['cashback'] = cashback.where(numbers < 0, -cashback)
+            extra_postings.append((self.cashback_account, 'cashback'))
+
+        return transactions.build_transactions(rows, f.name, self.account, extra_postings=extra_postings)
 
 if __name__ == "__main__":
     import os
@@ -11,6 +11,10 @@ from dateutil.parser import parse
 import os
 import loguru
 import docx2txt
+from beancount_importers_india.utils.cache import cached
+from beancount_importers_india.utils import transactions
+from beancount_importers_india.utils import dates
+from beancount_importers_india.utils import amounts
 
 
 def table2df(table):
@@ -42,50 +46,33 @@ class Importer(importer.ImporterProtocol):
         if str(self.account_number) in docx2txt.process(f.name):
             return True
 
+    @cached
     def extract(self, f:_FileMemo, existing_entries=None):
         doc = docx.Document(f.name)
         # Get all tables
         tables = [table2df(table) for table in doc.tables]
         # Get table with date in headers somewhere
         table = [table for table in tables if ('date' in "".join(table.columns).lower())][0]
-        entries:List[data.Transaction] = []
-
-        for index, row in table.iterrows():
-            try:
-                trans_date = parse(row['Value Date'], dayfirst=True).date()
-            except:
-                loguru.logger.info(f"Skipping non-date line:\n{row}")
-                continue
-            trans_desc = row['Narration'].strip()
-            is_debit = bool(row['Withdrawl'].strip()) # non-zero string in withdrawl
-            trans_amt  = -1*D(row["Withdrawl"].strip().rstrip('Dr')) if is_debit else D(row['Deposit'].strip().strip('Cr'))
-            # if not trans_amt in [1,-1]: continue
-
-
-            meta = data.new_metadata(f.name, index)
-            posting_meta = {}
-            if trans_desc: posting_meta["transaction_ref"] = trans_desc
-            cheque_num = row.get('Chq. No.', "").strip()
-            if cheque_num: posting_meta['Cheque_number'] = cheque_num
-
-            txn = data.Transaction(
-                meta=meta,
-                date=trans_date,
-                flag=flags.FLAG_OKAY,
-                payee=None,
-                narration = trans_desc,
-                tags=set(),
-                links=set(),
-                postings=[],
-            )
-
-            txn.postings.append(
-                data.Posting(self.account, amount.Amount(trans_amt,
-                    'INR'), None, None, None, posting_meta)
-            )
-
-            entries.append(txn)
-        
+
+        value_dates = dates.parse_dates(table['Value Date'], dayfirst=True, errors='coerce')
+        if value_dates.isna().any():
+            loguru.logger.info(f"Skipping non-date lines:\n{table[value_dates.isna()]}")
+        table = table[value_dates.notna()]
+
+        narrations = table['Narration'].str.strip()
+        rows = pd.DataFrame({
+            transactions.DATE: value_dates[value_dates.notna()],
+            transactions.NARRATION: narrations,
+            transactions.AMOUNT: amounts.debit_credit_amounts(table['Withdrawl'], table['Deposit']),
+            'transaction_ref': narrations,
+            'Cheque_number': table['Chq. No.'].str.strip() if 'Chq. No.' in table.columns else "",
+        })
+        entries:List[data.Transaction] = transactions.build_transactions(
+            rows, f.name, self.account,
+            posting_meta_columns={'transaction_ref': 'transaction_ref', 'Cheque_number': 'Cheque_number'},
+            document=None,
+        )
+
         # reverse the entries if they are in assending order
         if entries and entries[0].date > entries[-1].date:
             entries = list(reversed(entries))
@@ -16,7 +16,9 @@ import mimetypes
 import datetime
 from typing import Tuple
 from beancount_importers_india.utils.bse import BSEClient
+from beancount_importers_india.utils.pdf import get_pdf_session, map_pages, PdfSession
 from logging import getLogger
+from beancount_importers_india.utils.cache import cached, default_cache
 
 logger = getLogger('GROWW_contract_note')
 
@@ -28,6 +30,15 @@ TRADE_NO = 'Trade no.'
 ISIN = 'ISIN' # International Securities Identification Number, We define this column to store the ISIN of the stock extracted from the description
 TRADE_DATE = 'Trade Date'
 TOTAL = 'Net Total (Before Levies) (Rs)'
+TABLE_BACKENDS = ('lattice', 'pdfplumber')
+# printed at the top of the first page of every note. exports can bundle several notes in one pdf
+CONTRACT_NOTE_NO_RE = re.compile(r'Contract\s*Note\s*(?:No|Number)\.?\s*:?\s*([A-Z0-9][\w/-]*)', re.IGNORECASE)
+
+
+def contract_note_number(session:PdfSession, page_number:int) -> str | None:
+    """Number of the contract note starting on the page, if one does"""
+    match = CONTRACT_NOTE_NO_RE.search(session.text(page_number) or '')
+    return match.group(1) if match else None
 
 
 class GrowwContractNoteImporter(importer.ImporterProtocol):
@@ -38,7 +49,8 @@ class GrowwContractNoteImporter(importer.ImporterProtocol):
         holding_account="Assets:Stocks:Groww",
         brokerage_account="Expenses:Investments:Stocks:Groww:Brokerage",
         capital_gains_account="Income:Groww:CapitalGains",
-        buyback_account="Assets:Savings"
+        buyback_account="Assets:Savings",
+        table_backend='lattice',
         ):
         """ Import the trades from the Groww Contract Note
         Downloads the ticker data from the BSE website and uses it to map the ISIN to the ticker
@@ -51,6 +63,9 @@ class GrowwContractNoteImporter(importer.ImporterProtocol):
         buyback_account: account (usually savings) where buyback amount is credited.
             This is used to balance the contract note if it contains a single buyback transaction.
             For multiple transactions that aren't balanced, they are marked with !Warning flag and need to be fixed manually
+        table_backend: 'lattice' reads the tables with camelot's lattice flavor, which rasterizes every page.
+            'pdfplumber' rebuilds them from the ruling lines and chars of the pages, an order of magnitude faster.
+            Notes whose pdfplumber tables don't pass the sanity checks of extract fall back to lattice.
 
         See https://github.com/redstreet/beancount_reds_plugins/tree/main/beancount_reds_plugins/capital_gains_classifier#readme on how to use the capital gains account for tax purposes
         This importer maps the gains to the capital gains account and the above plugin then changes them to STCG and LTCG based on the duration of the holding
@@ -63,8 +78,10 @@ class GrowwContractNoteImporter(importer.ImporterProtocol):
         self.capital_gains_account = capital_gains_account
         self.buyback_account = buyback_account
         self.password = password
+        assert table_backend in TABLE_BACKENDS, f"table_backend must be one of {TABLE_BACKENDS}"
+        self.table_backend = table_backend
         self.bse_client = BSEClient()
-        self.cache = {} # cache tables instead of re-extracting
+        self.cache = default_cache() # on-disk cache shared across runs and importers
 
     def file_account(self, file):
         return self.wallet
@@ -88,16 +105,7 @@ class GrowwContractNoteImporter(importer.ImporterProtocol):
         if mimetypes.guess_type(f.name)[0] != 'application/pdf': return False
         # grepping the account number from the file should return 0
         try:
-            return all(
-            [
-                not subprocess.call(
-                    f"pdf2txt.py -P {self.password} '{f.name}' | grep '{line}' > /dev/null",
-                    shell=True,
-                    stderr=open(os.devnull, "w"),
-                )
-                for line in self.strings_to_match
-            ]
-        )
+            return get_pdf_session(f, self.password).contains(self.strings_to_match)
         except:
             return False
     
@@ -129,8 +137,10 @@ class GrowwContractNoteImporter(importer.ImporterProtocol):
     
     def set_header(self, df:pd.DataFrame)->pd.DataFrame:
         # Set the first row as the header
-        df.columns = [c.replace('\n','').strip() for c in df.iloc[0]]
+        # tables are shared by the pdf session, so the header is set on a copy
+        columns = [c.replace('\n','').strip() for c in df.iloc[0]]
         df = df.drop(index=[0])
+        df.columns = columns
         return df
 
     def extract_transactions(self, dfs:list[pd.DataFrame])->pd.DataFrame:
@@ -160,17 +170,87 @@ class GrowwContractNoteImporter(importer.ImporterProtocol):
                 return payable, abs(payable-actual_value)
         raise ValueError(f"Could not find the table with the net amount of the equities. Total number of tables found: {len(dfs)} and tables with 4 columns {len([t for t in dfs if t.shape[1]==4])}")
     
+    def check_trades(self, df:pd.DataFrame):
+        # cost*quantity = total
+        assert (df[COST].map(D)*df[QUANTITY].map(D)).sum() == -df[TOTAL].map(D).sum(), f"Sum of individual trades does not match the total in the contract note. Sum of individual trades: {(df[COST].map(D)*df[QUANTITY].map(D)).sum()} Total: {df[TOTAL].map(D).sum()}"
+
+    def tables_are_valid(self, tables) -> bool:
+        """True if extract can read the trade date, the trades and the net amount from the tables"""
+        dfs = [t.df for t in tables]
+        try:
+            self.extract_trade_date(tables[0].df)
+            self.extract_equity_net_price_and_brokerage(dfs)
+            self.extract_dp_charges(dfs)
+            self.check_trades(self.extract_transactions(dfs))
+            return True
+        except Exception as e:
+            logger.debug(f"Tables failed the sanity checks: {e!r}")
+            return False
+
     def extract_tables(self, f):
+        session = get_pdf_session(f, self.password)
+        if self.table_backend == 'pdfplumber':
+            tables = session.ruled_tables()
+            if tables and self.tables_are_valid(tables):
+                return tables
+            logger.warning(f"Falling back to camelot lattice for the tables of {f.name}")
         # line scale helps detect small lines in lattice mode. removing it messes up the table detection
-        tables = camelot.read_pdf(f.name, pages='all', flavor='lattice', password=self.password, line_scale=50)
+        # lattice mode rasterizes every page, so the tables are shared by file_date and extract, and across runs
+        tables = session.tables(pages='all', cache=self.cache, flavor='lattice', line_scale=50)
         return tables
         
+    def has_trade_date(self, tables) -> bool:
+        try:
+            self.extract_trade_date(tables[0].df)
+            return True
+        except Exception:
+            return False
+
+    def split_notes(self, f, tables) -> list[list]:
+        """The tables of each contract note in the pdf, in page order.
+        A note runs from the page its number is printed on until the next note's. Pages are read in parallel.
+        A part without a trade date of its own (eg. a note number repeated on a continuation page) goes with the
+        previous note, and if any note then fails the sanity checks the whole pdf is taken as a single note.
+        """
+        starts, current = [], None
+        for page, number in enumerate(map_pages(contract_note_number, get_pdf_session(f, self.password)), start=1):
+            # notes may repeat their number on every page
+            if number and number != current:
+                starts.append(page)
+                current = number
+        if len(starts) <= 1:
+            return [tables]
+        # pages before the first note number belong to the first note
+        starts[0] = 1
+        notes = [[] for _ in starts]
+        for table in tables:
+            notes[sum(start <= table.page for start in starts)-1].append(table)
+        merged = []
+        for note in notes:
+            if not note:
+                continue
+            if merged and not self.has_trade_date(note):
+                merged[-1].extend(note)
+            else:
+                merged.append(note)
+        if not all(self.tables_are_valid(note) for note in merged):
+            logger.warning(f"Could not split {f.name} into valid contract notes, reading it as a single note")
+            return [tables]
+        return merged
+
+    @cached
     def extract(self, f, existing_entries=None):
         # TODO: generate commodity directives,and check if existing directives in existing_entries before adding them
-        entries = []
         # tables = camelot.read_pdf(f.name, pages='all', flavor='lattice', password=self.password, line_scale=50)
-        tables = self.extract_tables(f)
+        entries = []
+        # tables of all the notes are read in one pass sharded across processes, then each note is booked on its own
+        for tables in self.split_notes(f, self.extract_tables(f)):
+            entries.extend(self.extract_note(f, tables))
+        return entries
 
+    def extract_note(self, f, tables) -> list:
+        """Entries of a single contract note from its tables"""
+        entries = []
         date = self.extract_trade_date(tables[0].df) # first table contains the trade date
         equity_net_cost, brokerage = self.extract_equity_net_price_and_brokerage([t.df for t in tables]) # last table contains the net cost of the equities
         dp_charges = self.extract_dp_charges([t.df for t in tables])
@@ -179,8 +259,7 @@ class GrowwContractNoteImporter(importer.ImporterProtocol):
         txn_meta['document'] = Path(f.name).name
 
         # Sanity Check
-        # cost*quantity = total
-        assert (df[COST].map(D)*df[QUANTITY].map(D)).sum() == -df[TOTAL].map(D).sum(), f"Sum of individual trades does not match the total in the contract note. Sum of individual trades: {(df[COST].map(D)*df[QUANTITY].map(D)).sum()} Total: {df[TOTAL].map(D).sum()}"
+        self.check_trades(df)
 
         # Sum of individual trades and brokerage should match the net cost of the contract note.
         # false could mean that the contract note contains buyback trades.
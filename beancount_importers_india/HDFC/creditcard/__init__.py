@@ -2,7 +2,6 @@ import sys
 import numpy as np
 from pathlib import Path
 from typing import Optional
-import pdfplumber
 from beancount.core.number import D
 from beancount.ingest import importer
 from beancount.core import amount
@@ -19,6 +18,11 @@ import re
 import mimetypes
 import datetime
 from typing import Tuple
+from beancount_importers_india.utils.pdf import get_pdf_session
+from beancount_importers_india.utils.cache import cached
+from beancount_importers_india.utils import transactions
+from beancount_importers_india.utils import dates
+from beancount_importers_india.utils import amounts
 
 
 # Copied from the pdf
@@ -26,12 +30,6 @@ DATE = "Date"
 NARRATION = "Transaction Description"
 AMOUNT = "Amount (in Rs.)"
 
-def row_to_amount(row):
-    if row[AMOUNT].strip().endswith("Cr"):
-        return D(row[AMOUNT].replace("Cr", "").strip())
-    else:
-        return -1 * D(row[AMOUNT].replace("Dr", "").strip())
-
 def isempty(value):
     if isinstance(value, float) and np.isnan(value):
         return True
@@ -62,14 +60,8 @@ def add_card_name_column(df:pd.DataFrame, card_names:Optional[list[str]]):
     df["Card Holder"] = names
 
 def drop_non_date_rows(df:pd.DataFrame):
-    def tryDate(string):
-        try:
-            print(string)
-            return parse(string, dayfirst=True, fuzzy=True).date()
-        except:
-            return ""
-    df[DATE] = df[DATE].apply(tryDate)
-    return df.drop(df[~((df[DATE]!="") & (df[AMOUNT].str.match(r'\d+([.,]\d+)*')))].index)
+    df[DATE] = dates.parse_dates(df[DATE], dayfirst=True, fuzzy=True, errors='coerce')
+    return df.drop(df[~(df[DATE].notna() & (df[AMOUNT].str.match(r'\d+([.,]\d+)*')))].index)
     
 
 
@@ -90,8 +82,7 @@ class HDFCCreditCardEmailStatementImporter(importer.ImporterProtocol):
             return False
         # grepping the account number from the file should return 0
         try:
-            page = pdfplumber.open(f.name, password=self.password).pages[0]
-            text = page.extract_text()
+            text = get_pdf_session(f, self.password).text(0)
             for line in self.lines_to_grep:
                 if not line in text:
                     return False
@@ -101,7 +92,7 @@ class HDFCCreditCardEmailStatementImporter(importer.ImporterProtocol):
 
     def parse_opening_balance(self, f) -> data.Balance:
         result = subprocess.run(
-            f"pdf2txt.py -M 1000 -L 1000 -P {self.password} '{f.name}' "
+            f"pdf2txt.py -M 1000 -L 1000 '{get_pdf_session(f, self.password).decrypted_path}' "
             "| awk '/Opening Balance/ {print $5, $6}'",
             shell=True,
             stdout=subprocess.PIPE,
@@ -121,7 +112,7 @@ class HDFCCreditCardEmailStatementImporter(importer.ImporterProtocol):
 
     def parse_closing_balance(self, f) -> data.Balance:
         result = subprocess.run(
-            f"pdf2txt.py -M 1000 -L 1000 -P {self.password} '{f.name}' "
+            f"pdf2txt.py -M 1000 -L 1000 '{get_pdf_session(f, self.password).decrypted_path}' "
             "| awk '/Closing Balance/ {print $5, $6}'",
             shell=True,
             stdout=subprocess.PIPE,
@@ -137,17 +128,15 @@ class HDFCCreditCardEmailStatementImporter(importer.ImporterProtocol):
             diff_amount=None,
         )
 
+    @cached
     def extract(self, f, existing_entries=None):
-        entries = []
         parse_amount = lambda val: (
             float(val.replace(",", "")) if isinstance(val, str) else val
         )
-        tables = camelot.read_pdf(
-            f.name,
+        tables = get_pdf_session(f, self.password).tables(
             pages="all",
             flavor="stream",
             row_tol=10,
-            password=self.password,
             columns=["100,435,512" for i in range(100)]
         )
         filtered_tables = []
@@ -163,44 +152,18 @@ class HDFCCreditCardEmailStatementImporter(importer.ImporterProtocol):
         tab = pd.concat(filtered_tables, ignore_index=True)
 
         new_table = drop_non_date_rows(tab)
-        # new_table.to_csv("/tmp/hdfc_tables.csv")
-        for index, row in new_table.iterrows():
-            trans_date = row[DATE]
-            trans_desc = re.sub(r'(\r)?\n',' ', row[NARRATION])
-            trans_amt = row_to_amount(row)
-            card_holder = row['Card Holder'] if 'Card Holder' in new_table.columns and isinstance(row['Card Holder'], str) else None
-            # if not trans_amt in [1,-1]: continue
-
-            meta = data.new_metadata(f.name, index)
-            posting_meta = {}
-            if card_holder:
-                posting_meta["card_holder"] = card_holder
-
-            txn = data.Transaction(
-                meta=meta,
-                date=trans_date,
-                flag=flags.FLAG_OKAY,
-                payee=None,
-                narration=trans_desc,
-                tags=set(),
-                links=set(),
-                postings=[],
-            )
-
-            txn.postings.append(
-                data.Posting(
-                    self.account,
-                    amount.Amount(trans_amt, "INR"),
-                    None,
-                    None,
-                    None,
-                    posting_meta,
-                )
-            )
-
-            entries.append(txn)
-
-        return entries
+        rows = pd.DataFrame({
+            transactions.DATE: new_table[DATE],
+            transactions.NARRATION: new_table[NARRATION].str.replace(r'(\r)?\n', ' ', regex=True),
+            transactions.AMOUNT: amounts.parse_amounts(new_table[AMOUNT], default_sign=-1),
+        })
+        if 'Card Holder' in new_table.columns:
+            rows['card_holder'] = new_table['Card Holder']
+            posting_meta_columns = {'card_holder': 'card_holder'}
+        else:
+            posting_meta_columns = None
+
+        return transactions.build_transactions(rows, f.name, self.account, posting_meta_columns=posting_meta_columns, document=None)
 
 
 if __name__ == "__main__":
@@ -17,6 +17,11 @@ import re
 import mimetypes
 import datetime
 from typing import Tuple
+from beancount_importers_india.utils.pdf import get_pdf_session
+from beancount_importers_india.utils.cache import cached
+from beancount_importers_india.utils import transactions
+from beancount_importers_india.utils import dates
+from beancount_importers_india.utils import amounts
 
 HDFC_EMAIL_PDF_COLUMN_BOUNDRIES = [108, 276, 360, 444]
 
@@ -38,24 +43,15 @@ class HDFCEmailStatementImporter(importer.ImporterProtocol):
         if mimetypes.guess_type(f.name)[0] != "application/pdf":
             return False
         # grepping the account number from the file should return 0
-        lines_to_check = [self.account_number, self.name_in_file]
+        lines_to_check = [str(self.account_number), self.name_in_file]
         try:
-            return all(
-                [
-                    not subprocess.call(
-                        f"pdf2txt.py -P {self.password} '{f.name}' | grep '{line}' > /dev/null",
-                        shell=True,
-                        stderr=open(os.devnull, "w"),
-                    )
-                    for line in lines_to_check
-                ]
-            )
+            return get_pdf_session(f, self.password).contains(lines_to_check)
         except:
             return False
 
     def parse_opening_balance(self, f) -> data.Balance:
         result = subprocess.run(
-            f"pdf2txt.py -M 1000 -L 1000 -P {self.password} '{f.name}' "
+            f"pdf2txt.py -M 1000 -L 1000 '{get_pdf_session(f, self.password).decrypted_path}' "
             "| awk '/Opening Balance/ {print $5, $6}'",
             shell=True,
             stdout=subprocess.PIPE,
@@ -75,7 +71,7 @@ class HDFCEmailStatementImporter(importer.ImporterProtocol):
 
     def parse_closing_balance(self, f) -> data.Balance:
         result = subprocess.run(
-            f"pdf2txt.py -M 1000 -L 1000 -P {self.password} '{f.name}' "
+            f"pdf2txt.py -M 1000 -L 1000 '{get_pdf_session(f, self.password).decrypted_path}' "
             "| awk '/Closing Balance/ {print $5, $6}'",
             shell=True,
             stdout=subprocess.PIPE,
@@ -91,18 +87,16 @@ class HDFCEmailStatementImporter(importer.ImporterProtocol):
             diff_amount=None,
         )
 
+    @cached
     def extract(self, f, existing_entries=None):
-        entries = []
         parse_amount = lambda val: (
             float(val.replace(",", "")) if isinstance(val, str) else val
         )
-        tables = camelot.read_pdf(
-            f.name,
+        tables = get_pdf_session(f, self.password).tables(
             pages="all",
             flavor="stream",
             column_tol=10,
             row_tol=5,
-            password=self.password,
         )
         filtered_tables = []
         column_names = [
@@ -124,59 +118,25 @@ class HDFCEmailStatementImporter(importer.ImporterProtocol):
             tab = pd.concat(filtered_tables, ignore_index=True)
         # If topmost description is extracted as 0th table
         except:
-            tab = pd.concat(tables[1:], ignore_index=True)
-
-        # merge multiline description rows
-        new_table_rows = []
-        for index, row in tab.iterrows():
-            date = row["Txn Date"]
-            if (
-                (isinstance(date, float) and np.isnan(date))
-                or (isinstance(date, str) and date.strip() == "")
-            ) and isinstance(row["Narration"], str):
-                new_table_rows[-1]["Narration"] += row["Narration"]
-            elif isinstance(row["Txn Date"], str) and isinstance(row["Narration"], str):
-                new_table_rows.append(row)
-            else:
-                continue
-        new_table = pd.DataFrame(columns=tab.columns, data=new_table_rows)
-        new_table = new_table.reset_index()
-        # new_table.to_csv("/tmp/hdfc_tables.csv")
-        for index, row in new_table.iterrows():
-            trans_date = parse(row["Txn Date"], dayfirst=True).date()
-            trans_desc = row["Narration"].replace("\r", " ")
-            is_debit = isinstance(row["Withdrawals"], str) and row["Withdrawals"].strip() != "" and row["Withdrawals"].strip() != "0.00"
-            trans_amt = -1 * D(row["Withdrawals"]) if is_debit else D(row["Deposits"])
-            # if not trans_amt in [1,-1]: continue
-
-            meta = data.new_metadata(f.name, index)
-            posting_meta = {'document': Path(f.name).name}
-
-            txn = data.Transaction(
-                meta=meta,
-                date=trans_date,
-                flag=flags.FLAG_OKAY,
-                payee=None,
-                narration=trans_desc,
-                tags=set(),
-                links=set(),
-                postings=[],
-            )
-
-            txn.postings.append(
-                data.Posting(
-                    self.account,
-                    amount.Amount(trans_amt, "INR"),
-                    None,
-                    None,
-                    None,
-                    posting_meta,
-                )
-            )
-
-            entries.append(txn)
-
-        return entries
+            tab = pd.concat([t.df for t in tables[1:]], ignore_index=True)
+
+        # merge multiline description rows into the row above them
+        is_str = lambda column: tab[column].map(lambda v: isinstance(v, str))
+        date_is_blank = tab["Txn Date"].isna() | (is_str("Txn Date") & (tab["Txn Date"].astype(str).str.strip() == ""))
+        is_continuation = date_is_blank & is_str("Narration")
+        is_start = ~is_continuation & is_str("Txn Date") & is_str("Narration")
+        row_group = is_start.cumsum()
+        keep = (is_start | is_continuation) & (row_group > 0)
+        narrations = tab.loc[keep, "Narration"].groupby(row_group[keep]).agg("".join)
+        new_table = tab[is_start].reset_index(drop=True)
+        new_table["Narration"] = narrations.values
+
+        rows = pd.DataFrame({
+            transactions.DATE: dates.parse_dates(new_table["Txn Date"], dayfirst=True),
+            transactions.NARRATION: new_table["Narration"].str.replace("\r", " "),
+            transactions.AMOUNT: amounts.debit_credit_amounts(new_table["Withdrawals"], new_table["Deposits"]),
+        })
+        return transactions.build_transactions(rows, f.name, self.account)
 
 
 if __name__ == "__main__":
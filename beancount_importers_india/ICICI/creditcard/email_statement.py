@@ -6,7 +6,6 @@ defined below as `table_areas`, with specific column separators defined as `colu
 import re
 from pathlib import Path
 from typing import Optional
-import pdfplumber
 from beancount.core.number import D
 from beancount.ingest import importer
 from beancount.core import amount
@@ -18,6 +17,11 @@ import camelot
 from dateutil.parser import parse
 import re
 import mimetypes
+from beancount_importers_india.utils.pdf import get_pdf_session
+from beancount_importers_india.utils.cache import cached
+from beancount_importers_india.utils import transactions
+from beancount_importers_india.utils import dates
+from beancount_importers_india.utils import amounts
 
 
 # Copied from the pdf
@@ -31,12 +35,6 @@ TRANSACTION_REF = "SerNo."
 column_separators = ["250,300,435,470,520"]
 table_areas = ["205,475,600,160"]
 
-def row_to_amount(row:pd.Series):
-    if row[AMOUNT].strip().lower().endswith("cr"):
-        return D(re.sub(r'cr', '', row[AMOUNT], flags=re.IGNORECASE))
-    else:
-        return -1 * D(row[AMOUNT].lower().replace("Dr", ""))
-
 def make_df_headers(df:pd.DataFrame):
     header_idx = 0
     for i,row in df.iterrows():
@@ -61,13 +59,8 @@ def add_card_name_column(df:pd.DataFrame, card_names:Optional[list[str]]):
     df["Card Holder"] = names
 
 def drop_non_date_rows(df:pd.DataFrame):
-    def tryDate(string):
-        try:
-            return parse(string, dayfirst=True, fuzzy=True).date()
-        except:
-            return ""
-    df[DATE] = df[DATE].apply(tryDate)
-    return df.drop(df[~((df[DATE]!="") & (df[AMOUNT].str.match(r'\d+([.,]\d+)*')))].index)
+    df[DATE] = dates.parse_dates(df[DATE], dayfirst=True, fuzzy=True, errors='coerce')
+    return df.drop(df[~(df[DATE].notna() & (df[AMOUNT].str.match(r'\d+([.,]\d+)*')))].index)
     
 
 
@@ -87,8 +80,7 @@ class ICICICreditCardEmailStatementImporter(importer.ImporterProtocol):
             return False
         # grepping the account number from the file should return 0
         try:
-            page = pdfplumber.open(f.name, password=self.password).pages[0]
-            text = page.extract_text()
+            text = get_pdf_session(f, self.password).text(0)
             for line in self.lines_to_grep:
                 if not line in text:
                     return False
@@ -97,62 +89,32 @@ class ICICICreditCardEmailStatementImporter(importer.ImporterProtocol):
             return False
     
     def extract_transactions_table(self, f):
-        tables = camelot.read_pdf(
-            f.name,
+        tables = get_pdf_session(f, self.password).tables(
             pages="1",
             flavor="stream",
             row_tol=10,
-            password=self.password,
             columns=column_separators,
             table_areas=table_areas
             )
         assert len(tables) == 1, f"Expected 1 table, got {len(tables)}"
-        df:pd.DataFrame = tables[0].df
+        df:pd.DataFrame = tables[0].df.copy()
         df = make_df_headers(df)
         df = drop_non_date_rows(df)
         return df
 
 
+    @cached
     def extract(self, f, existing_entries=None):
-        entries = []
         table = self.extract_transactions_table(f)
-        # new_table.to_csv("/tmp/hdfc_tables.csv")
-        for index, row in table.iterrows():
-            trans_date = row[DATE]
-            trans_desc = re.sub(r'(\r)?\n',' ', row[NARRATION])
-            if row[INTERNATIONAL_AMOUNT].strip():
-                trans_desc += f" :: Intl. Amount: {row[INTERNATIONAL_AMOUNT]}"
-            trans_amt = row_to_amount(row)
-            # if not trans_amt in [1,-1]: continue
-
-            meta = data.new_metadata(f.name, index)
-            posting_meta = {'document': Path(f.name).name}
-
-            txn = data.Transaction(
-                meta=meta,
-                date=trans_date,
-                flag=flags.FLAG_OKAY,
-                payee=None,
-                narration=trans_desc,
-                tags=set(),
-                links=set(),
-                postings=[],
-            )
-
-            txn.postings.append(
-                data.Posting(
-                    self.account,
-                    amount.Amount(trans_amt, "INR"),
-                    None,
-                    None,
-                    None,
-                    posting_meta,
-                )
-            )
-
-            entries.append(txn)
-
-        return entries
+        narrations = table[NARRATION].str.replace(r'(\r)?\n', ' ', regex=True)
+        has_intl_amount = table[INTERNATIONAL_AMOUNT].str.strip() != ''
+        narrations = narrations.where(~has_intl_amount, narrations + " :: Intl. Amount: " + table[INTERNATIONAL_AMOUNT])
+        rows = pd.DataFrame({
+            transactions.DATE: table[DATE],
+            transactions.NARRATION: narrations,
+            transactions.AMOUNT: amounts.parse_amounts(table[AMOUNT], default_sign=-1),
+        })
+        return transactions.build_transactions(rows, f.name, self.account)
 
 
 if __name__ == "__main__":
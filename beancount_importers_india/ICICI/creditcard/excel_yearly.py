@@ -8,11 +8,16 @@ from beancount.core.position import Cost
 import pandas as pd
 from beancount.ingest.cache import _FileMemo
 import math
+import operator
 from dateutil.parser import parse
 import subprocess
 import os
 import re
 import logging
+from beancount_importers_india.utils import transactions
+from beancount_importers_india.utils import dates
+from beancount_importers_india.utils import amounts
+from beancount_importers_india.utils.cache import cached
 
 
 logger = logging.getLogger(f'ICICIImporter')
@@ -51,44 +56,21 @@ class Importer(importer.ImporterProtocol):
                 break
         return start, end
 
+    @cached
     def extract(self, f, existing_entries=None):
-        entries = []
         start, end = self.find_start_and_end_row(f)
         tab = pd.read_excel(f.name, skiprows=start, nrows=end-start-1, header=0, usecols=[1,2,3,4,5,6])
         logger.info(tab.columns)
 
-        for index, row in tab.iterrows():
-            trans_date = parse(row['Date']).date()
-            trans_desc = row['Transaction Details']
-            # Debit Transactions are positive in the xlsx
-            trans_amt  = -1*D(row["Amount(in ₹)"])
-
-
-            meta = data.new_metadata(f.name, index)
-            ref_col = [c for c in tab.columns if re.search("Ref",c)][0]
-            ref = row[ref_col]
-            if isinstance(ref, str): meta["transaction_ref"] = ref.replace('\r',' ')
-
-            txn = data.Transaction(
-                meta=meta,
-                date=trans_date,
-                flag=flags.FLAG_OKAY,
-                payee=None,
-                narration = trans_desc,
-                tags=set(),
-                links=set(),
-                postings=[],
-            )
-
-            txn.postings.append(
-                data.Posting(self.account, amount.Amount(trans_amt,
-                    'INR'), None, None, None, None)
-            )
-
-            entries.append(txn)
-        data
-
-        return entries
+        ref_col = [c for c in tab.columns if re.search("Ref",c)][0]
+        rows = pd.DataFrame({
+            transactions.DATE: dates.parse_dates(tab['Date'], dayfirst=False),
+            transactions.NARRATION: tab['Transaction Details'],
+            # Debit Transactions are positive in the xlsx, and credits negative
+            transactions.AMOUNT: amounts.parse_amounts(tab["Amount(in ₹)"]).map(operator.neg),
+            'transaction_ref': tab[ref_col].map(lambda ref: ref.replace('\r',' ') if isinstance(ref, str) else None),
+        })
+        return transactions.build_transactions(rows, f.name, self.account, meta_columns={'transaction_ref': 'transaction_ref'}, document=None)
 
 if __name__ == "__main__":
     import os
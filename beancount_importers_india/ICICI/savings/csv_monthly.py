@@ -14,6 +14,10 @@ import os
 import re
 import logging
 from pathlib import Path
+from beancount_importers_india.utils import transactions
+from beancount_importers_india.utils import dates
+from beancount_importers_india.utils import amounts
+from beancount_importers_india.utils.cache import cached
 
 
 logger = logging.getLogger(f'ICICIImporter')
@@ -54,42 +58,18 @@ class Importer(importer.ImporterProtocol):
                 end = i
         return start, end
 
+    @cached
     def extract(self, f, existing_entries=None):
-        entries = []
         start, end = self.find_start_and_end_row(f)
         tab = pd.read_csv(f.name, skiprows=start, nrows=end-start, header=0, usecols=[0,1,2,3,4,5])
         logger.info(tab.columns)
 
-        for index, row in tab.iterrows():
-            trans_date = parse(row[DATE], dayfirst=True).date()
-            trans_desc = row[DESCRIPTION]
-            # Debit Transactions are positive in the xlsx
-            trans_amt  = D(row[CREDIT]) - D(row[DEBIT])
-
-
-            meta = data.new_metadata(f.name, index)
-            meta['document'] = Path(f.name).name
-
-            txn = data.Transaction(
-                meta=meta,
-                date=trans_date,
-                flag=flags.FLAG_OKAY,
-                payee=None,
-                narration = trans_desc,
-                tags=set(),
-                links=set(),
-                postings=[],
-            )
-
-            txn.postings.append(
-                data.Posting(self.account, amount.Amount(trans_amt,
-                    'INR'), None, None, None, None)
-            )
-
-            entries.append(txn)
-        data
-
-        return entries
+        rows = pd.DataFrame({
+            transactions.DATE: dates.parse_dates(tab[DATE], dayfirst=True),
+            transactions.NARRATION: tab[DESCRIPTION],
+            transactions.AMOUNT: amounts.debit_credit_amounts(tab[DEBIT], tab[CREDIT]),
+        })
+        return transactions.build_transactions(rows, f.name, self.account, document='txn')
 
 if __name__ == "__main__":
     import os
@@ -12,9 +12,11 @@ import mimetypes
 from enum import Enum
 import re
 from dateutil.parser import parse as dateparse
-import pdfplumber
-from pdfminer.high_level import extract_pages
-from pdfminer.layout import LTTextBoxHorizontal,  LAParams
+from beancount_importers_india.utils.pdf import PdfSession, get_pdf_session, map_pages
+from beancount_importers_india.utils.cache import cached
+from beancount_importers_india.utils import transactions
+from beancount_importers_india.utils import dates
+from beancount_importers_india.utils import amounts
 
 class Column(Enum):
     DATE = 'DATE'
@@ -29,30 +31,25 @@ def extract_headers(elements:list, header_line)->dict[Column, dict]:
     elements = [e for e in elements if header_line['x0'] <= e['x0'] and header_line['x1'] >= e['x1'] and header_line['top'] <= e['top'] and header_line['bottom'] >= e['bottom']]
     return {Column(e['text'].strip()): e for e in elements}
 
-def extract_transactions_from_page(pdf_path:str, password:str, page_number:int=0)->pd.DataFrame:
+def extract_transactions_from_page(session:PdfSession, page_number:int=0)->pd.DataFrame:
     # We are looking for a table with the following headers.
     # we first detect the position of these headers
     headers_text = 'DATE MODE PARTICULARS DEPOSITS WITHDRAWALS BALANCE'
-    # for page in pdfplumber.open(pdf_path).pages:
-    page = pdfplumber.open(pdf_path, password=password).pages[page_number]
-    text_lines = page.extract_text_lines()
+    text_lines = session.text_lines(page_number)
     header = [line for line in text_lines if line['text'].strip() == headers_text]
     if not header:
-        print(f"Skipping page {page.page_number}. No headers found. File: {pdf_path}")
+        print(f"Skipping page {page_number+1}. No headers found. File: {session.path}")
         return pd.DataFrame(columns=[c for c in Column])
     header = header[0]
     footer = [line for line in text_lines if re.match(r'^Total:[ \d,.]+$', line['text'].strip())]
     footer = footer[0] if footer else None
-    headers_map = extract_headers(page.extract_words(), header)
+    headers_map = extract_headers(session.words(page_number), header)
     # collect all row separators
-    row_separators = [line for line in page.lines if line['x1'] - line['x0'] > 100 and line['y0'] < header['chars'][0]['y0'] and (footer is None or line['y0'] > footer['chars'][0]['y0'])]
+    row_separators = [line for line in session.lines(page_number) if line['x1'] - line['x0'] > 100 and line['y0'] < header['chars'][0]['y0'] and (footer is None or line['y0'] > footer['chars'][0]['y0'])]
     # bottom to top transaction separators
     row_separators.sort(key=lambda x: x['y0'], reverse=True)
-    words = page.extract_words()
     # get all text lines between the header and footer
-    # text_lines = [e for e in page.layout._objs if isinstance(e, LTTextBoxHorizontal) and e.y0 > header['bottom'] and (footer is None or e.y1 < footer['top'])]
-    text_lines = [e for page_ in extract_pages(pdf_path, password=password, laparams=LAParams(line_margin=0), page_numbers=[page_number]) for e in page_]
-    text_lines = [e for e in text_lines if isinstance(e, LTTextBoxHorizontal) and e.y1 < header['chars'][0]['y0'] and (footer is None or e.y0 > footer['chars'][0]['y1'])]
+    text_lines = [e for e in session.layout_boxes(page_number) if e.y1 < header['chars'][0]['y0'] and (footer is None or e.y0 > footer['chars'][0]['y1'])]
 
     # sort the text lines from bottom to top since pop() will be used to get the lines which is O(1) instead of O(n) for pop(0)
     text_lines.sort(key=lambda x: x.y0, reverse=True)
@@ -70,11 +67,16 @@ def extract_transactions_from_page(pdf_path:str, password:str, page_number:int=0
     rows.reverse() # get top to bottom rows
     for row in rows:
         for k, v in row.items(): # clean up the rows
-            row[k] = v.strip('--') if k != Column.DATE else dateparse(v, dayfirst=True, fuzzy=True).date()
+            row[k] = v.strip('--')
     df = pd.DataFrame(rows)
+    df[Column.DATE] = dates.parse_dates(df[Column.DATE], dayfirst=True, fuzzy=True)
     df = df[[Column.DATE, Column.PARTICULARS, Column.DEPOSITS, Column.WITHDRAWALS, Column.BALANCE]]
     return df
 
+def extract_transactions(session:PdfSession)->pd.DataFrame:
+    """Transactions from all the pages of the statement"""
+    return pd.concat(map_pages(extract_transactions_from_page, session), ignore_index=True)
+
 class ICICISavingsEmailImporter(importer.ImporterProtocol):
     def __init__(self, account_number, name_in_file, password, account="Assets:Saving:ICICI"):
         self.account = account
@@ -90,8 +92,7 @@ class ICICISavingsEmailImporter(importer.ImporterProtocol):
         if mimetypes.guess_type(f.name)[0] != 'application/pdf': return False
         # grepping the account number from the file should return 0
         try:
-            page = pdfplumber.open(f.name, password=self.password).pages[0]
-            text = page.extract_text()
+            text = get_pdf_session(f, self.password).text(0)
             num_chars = len(str(self.account_number))
             if not 'X'*(num_chars-4)+self.account_number[-4:] in text: return False
             if not self.name_in_file in text: return False
@@ -100,52 +101,25 @@ class ICICISavingsEmailImporter(importer.ImporterProtocol):
             return False
     
     def parse_opening_balance(self, f)->data.Balance:
-        df = extract_transactions_from_page(f.name, self.password, 0)
+        df = extract_transactions_from_page(get_pdf_session(f, self.password), 0)
         return data.Balance({}, df.iloc[0][Column.DATE], self.account, data.Amount(D(df.iloc[0][Column.BALANCE]), 'INR'), None, None)
 
     def parse_closing_balance(self, f)->data.Balance:
-        num_pages = len(pdfplumber.open(f.name, password=self.password).pages)
-        df = pd.concat([extract_transactions_from_page(f.name, self.password, i) for i in range(num_pages)], ignore_index=True)
+        df = extract_transactions(get_pdf_session(f, self.password))
         return data.Balance({}, df.iloc[-1][Column.DATE], self.account, data.Amount(D(df.iloc[-1][Column.BALANCE]), 'INR'), None, None)
             
+    @cached
     def extract(self, f, existing_entries=None):
-        entries = []
-        
-        num_pages = len(pdfplumber.open(f.name, password=self.password).pages)
-        df = pd.concat([extract_transactions_from_page(f.name, self.password, i) for i in range(num_pages)], ignore_index=True)
+        df = extract_transactions(get_pdf_session(f, self.password))
         df = df[(~df[Column.DEPOSITS].isna()) | (~df[Column.WITHDRAWALS].isna())]
         df.reset_index(drop=True, inplace=True)
 
-        for index, row in df.iterrows():
-            trans_date = row[Column.DATE]
-            trans_desc = row[Column.PARTICULARS]
-            is_debit = isinstance(row[Column.WITHDRAWALS], str) # since the other column is NaN
-            trans_amt  = -1*D(row[Column.WITHDRAWALS]) if is_debit else D(row[Column.DEPOSITS])
-
-            meta = data.new_metadata(f.name, index)
-            
-            posting_meta = {}
-            posting_meta['document'] = Path(f.name).name
-
-            txn = data.Transaction(
-                meta=meta,
-                date=trans_date,
-                flag=flags.FLAG_OKAY,
-                payee=None,
-                narration = trans_desc,
-                tags=set(),
-                links=set(),
-                postings=[],
-            )
-
-            txn.postings.append(
-                data.Posting(self.account, amount.Amount(trans_amt,
-                    'INR'), None, None, None, posting_meta)
-            )
-
-            entries.append(txn)
-
-        return entries
+        rows = pd.DataFrame({
+            transactions.DATE: df[Column.DATE],
+            transactions.NARRATION: df[Column.PARTICULARS],
+            transactions.AMOUNT: amounts.debit_credit_amounts(df[Column.WITHDRAWALS], df[Column.DEPOSITS]),
+        })
+        return transactions.build_transactions(rows, f.name, self.account)
 
 if __name__ == "__main__":
     import os
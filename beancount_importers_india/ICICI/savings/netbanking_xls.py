@@ -15,6 +15,10 @@ import os
 import re
 import logging
 import xlrd 
+from beancount_importers_india.utils.cache import cached
+from beancount_importers_india.utils import transactions
+from beancount_importers_india.utils import dates
+from beancount_importers_india.utils import amounts
 
 def D(number):
     if isinstance(number, str):
@@ -45,44 +49,20 @@ class IciciSavingImporter(importer.ImporterProtocol):
         end = ws.cell_value(4,5)
         return f"ICICI_Saving_{start.replace('/','-')}_to_{end.replace('/','-')}.xls"
 
+    @cached
     def extract(self, f, existing_entries=None):
-        entries = []
         tab = pd.read_excel(f.name, skiprows=12, skipfooter=29, header=0, usecols=[1,2,3,4,5,6,7,8], index_col=0)
         logger.info(tab.columns)
-        for index, row in tab.iterrows():
-            assert D(row['Deposit Amount (INR )']) !=0 or D(row["Withdrawal Amount (INR )"]) != 0, "Both Deposit and Withdrawl Amounts are zero" 
-            trans_date = parse(row['Transaction Date'], dayfirst=True).date()
-            trans_desc = row['Transaction Remarks']
+        deposits = amounts.parse_amounts(tab['Deposit Amount (INR )'], empty=amounts.ZERO)
+        withdrawals = amounts.parse_amounts(tab["Withdrawal Amount (INR )"], empty=amounts.ZERO)
+        assert ((deposits != 0) | (withdrawals != 0)).all(), "Both Deposit and Withdrawl Amounts are zero"
+        rows = pd.DataFrame({
+            transactions.DATE: dates.parse_dates(tab['Transaction Date'], dayfirst=True),
+            transactions.NARRATION: tab['Transaction Remarks'],
             # Debit Transactions are positive in the xlsx
-            trans_amt  = -1*D(row["Withdrawal Amount (INR )"])
-            if trans_amt == 0:
-                trans_amt = D(row["Deposit Amount (INR )"])
-
-
-            meta = data.new_metadata(f.name, index)
-            # ref = row['Transaction Remarks']
-            # if isinstance(ref, str): meta["transaction_ref"] = ref.replace('\r',' ')
-
-            txn = data.Transaction(
-                meta=meta,
-                date=trans_date,
-                flag=flags.FLAG_OKAY,
-                payee=None,
-                narration = trans_desc,
-                tags=set(),
-                links=set(),
-                postings=[],
-            )
-
-            txn.postings.append(
-                data.Posting(self.account, amount.Amount(trans_amt,
-                    'INR'), None, None, None, None)
-            )
-
-            entries.append(txn)
-        data
-
-        return entries
+            transactions.AMOUNT: (-withdrawals).where(withdrawals != 0, deposits),
+        })
+        return transactions.build_transactions(rows, f.name, self.account, document=None)
 
 if __name__ == "__main__":
     import os
@@ -11,6 +11,11 @@ import subprocess
 import os
 import re
 import mimetypes
+from beancount_importers_india.utils.pdf import get_pdf_session
+from beancount_importers_india.utils.cache import cached
+from beancount_importers_india.utils import transactions
+from beancount_importers_india.utils import dates
+from beancount_importers_india.utils import amounts
 
 class Importer(importer.ImporterProtocol):
     def __init__(self, account_number, account="Assets:INR:PAYTM:Saving"):
@@ -31,56 +36,36 @@ class Importer(importer.ImporterProtocol):
         f'ps2txt {f.name} | grep -P "{self.account_number} \\s+ SAVING" > /dev/null', shell=True
                         )))
 
+    @cached
     def extract(self, f:_FileMemo, existing_entries=None):
-        tables = camelot.read_pdf(f.name, flavor='stream', pages='all')
+        tables = get_pdf_session(f).tables(flavor='stream', pages='all')
         tables = [t.df for t in tables if len(t.df.columns) == 4]
         header = list(tables[0].iloc[0,:])
         table = pd.concat([t.drop(index=0) for t in tables], ignore_index=True)
         table.columns = header
 
-        def make_transaction(date_and_time, desc_tuple, trans_amt, is_debit, line_no):
-            trans_amt  = -1*D(trans_amt) if is_debit else D(trans_amt)
-            meta = data.new_metadata(f.name, line_no)
-            posting_meta = {"transaction_ref":"\n".join(desc_tuple[2:])}
-            txn = data.Transaction(
-                meta=meta,
-                date=date_and_time.date(),
-                flag=flags.FLAG_OKAY,
-                payee=None,
-                narration = " ".join(desc_tuple[:2]),
-                tags=set(),
-                links=set(),
-                postings=[],
-            )
-            txn.postings.append(
-                data.Posting(self.account, amount.Amount(trans_amt,
-                    'INR'), None, None, None, posting_meta)
-            )
-            return txn
-    
-    
-        def table2entries(df):
-            DATE = [k for k in table.columns if 'date' in k.lower()][0]
-            AMOUNT = 'AMOUNT'
-            DETAILS = [k for k in table.columns if 'transaction' in k.lower()][0]
-            transaction = []
-            entries = []
-            date = []
-            for i, row in table.iterrows():
-                if not ":" in row[DATE].strip() and len(row[DATE].strip())>2:
-                    # if previous transaction collected, file it
-                    if date: entries.append(make_transaction(date, transaction, amount, is_debit, i))
-                    date = [row[DATE].strip()]
-                    is_debit = row[AMOUNT].strip().startswith('-')
-                    amount = row[AMOUNT].strip('+- ₹')
-                if re.match(r'\d\d?:\d{2} +(AM|PM)', row[DATE].strip()):
-                    date.append(row[DATE].strip())
-                    date = parse(" ".join(date))
-                if row[DETAILS]:
-                    transaction.append(row[DETAILS])
-            entries.append(make_transaction(date, transaction, amount, is_debit, i))
-            return entries 
-        return table2entries(table)
+        DATE = [k for k in table.columns if 'date' in k.lower()][0]
+        AMOUNT = 'AMOUNT'
+        DETAILS = [k for k in table.columns if 'transaction' in k.lower()][0]
+
+        # a transaction spans several rows: the first has the date and amount, the next the time,
+        # and the details column of all of them together describe it
+        cells = table[DATE].str.strip()
+        is_start = ~cells.str.contains(":") & (cells.str.len() > 2)
+        group = is_start.cumsum()
+        table, cells, group = table[group > 0], cells[group > 0], group[group > 0]
+        times = cells.where(cells.str.match(r'\d\d?:\d{2} +(AM|PM)')).groupby(group).first()
+        details = table[DETAILS].groupby(group).agg(lambda d: [v for v in d if v])
+        first = table[is_start]
+        rows = pd.DataFrame({
+            transactions.DATE: dates.parse_dates(cells[is_start] + " " + times.fillna("").values, dayfirst=False),
+            transactions.NARRATION: details.map(lambda d: " ".join(d[:2])).values,
+            transactions.AMOUNT: amounts.parse_amounts(first[AMOUNT]),
+            'transaction_ref': details.map(lambda d: "\n".join(d[2:])).values,
+        }, index=first.index)
+        return transactions.build_transactions(
+            rows, f.name, self.account, posting_meta_columns={'transaction_ref': 'transaction_ref'}, document=None
+        )
 
 if __name__ == "__main__":
     import os
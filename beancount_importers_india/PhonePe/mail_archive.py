@@ -0,0 +1,151 @@
+"""
+Imports PhonePe transaction emails straight from a mail archive.
+
+Instead of saving every notification as an .html file, point bean-extract at an mbox export (eg. from Google
+Takeout). bean-extract only hands regular files to the importers, so a Maildir can only be read by running this module
+on it. Messages are read one at a time, only the html part of the ones sent by
+PhonePe is decoded, and the parts are parsed in chunks by a pool of worker processes. Every transaction is imported
+once, however many copies of its email the archive has, and emails whose `phonepe_txn_id` is already in the
+existing entries are skipped.
+
+    python -m beancount_importers_india.PhonePe.mail_archive ~/Mail/phonepe -m XXXXXXXXXX56=Assets:Savings:Canara
+"""
+import os
+import mailbox
+import itertools
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional
+from logging import getLogger
+from beancount.core import data
+from beancount.ingest.cache import _FileMemo
+from beancount_importers_india.PhonePe.transaction_email import (
+    PhonePeTransactionEmailImporter, PhonePeEmail, parse_email_text,
+)
+
+logger = getLogger('beancount_importers_india.phonepe_mailbox')
+
+SENDERS = ('phonepe.com',) # emails from other senders are not decoded
+CHUNK_SIZE = 256 # emails sent to the workers at a time. bounds the memory used by a large archive
+HEAD_SIZE = 64 * 1024 # bytes of the archive read by identify
+
+
+def open_mailbox(path:str) -> mailbox.Mailbox:
+    """A Maildir directory or an mbox file"""
+    if os.path.isdir(path):
+        return mailbox.Maildir(path, factory=None, create=False)
+    return mailbox.mbox(path, create=False)
+
+
+def html_parts(path:str, senders=SENDERS) -> Iterator[tuple[int, str]]:
+    """(message number, html) of the emails from the senders, in the order of the archive"""
+    for number, message in enumerate(open_mailbox(path)):
+        sender = (message.get('From') or '').lower()
+        if not any(s in sender for s in senders):
+            continue
+        for part in message.walk():
+            if part.get_content_type() != 'text/html':
+                continue
+            payload = part.get_payload(decode=True)
+            if payload:
+                yield number, payload.decode(part.get_content_charset() or 'utf-8', errors='replace')
+                break
+
+
+def _parse(html:str) -> Optional[PhonePeEmail]:
+    # runs in a worker. emails that aren't transactions (offers, statements) are dropped
+    try:
+        return parse_email_text(html)
+    except Exception:
+        return None
+
+
+def parse_mailbox(path:str, senders=SENDERS, jobs:Optional[int]=None) -> Iterator[tuple[int, PhonePeEmail]]:
+    """(message number, parsed email) of the PhonePe emails in the archive"""
+    parts = html_parts(path, senders)
+    if jobs == 1:
+        for number, html in parts:
+            if (email := _parse(html)) is not None:
+                yield number, email
+        return
+    with ProcessPoolExecutor(jobs) as pool:
+        while chunk := list(itertools.islice(parts, CHUNK_SIZE)):
+            numbers, htmls = zip(*chunk)
+            for number, email in zip(numbers, pool.map(_parse, htmls, chunksize=32)):
+                if email is not None:
+                    yield number, email
+
+
+def existing_txn_ids(entries) -> set[str]:
+    return {
+        posting.meta['phonepe_txn_id']
+        for entry in entries or [] if isinstance(entry, data.Transaction)
+        for posting in entry.postings if posting.meta and posting.meta.get('phonepe_txn_id')
+    }
+
+
+class PhonePeMailboxImporter(PhonePeTransactionEmailImporter):
+    def __init__(self, accounts_map_from_emails, account:Optional[str]=None, add_payee:bool=True,
+                 senders=SENDERS, jobs:Optional[int]=None):
+        """PhonePe transaction emails from a mbox file (named *.mbox). extract also reads a Maildir, for the CLI
+
+        Args:
+        accounts_map_from_emails: see PhonePeTransactionEmailImporter
+        account: account the archive is filed under by bean-file. Defaults to the first account of the map
+        senders: the emails whose From contains one of these are parsed
+        jobs: worker processes parsing the emails. Defaults to the number of CPUs
+        """
+        super().__init__(accounts_map_from_emails=accounts_map_from_emails, add_payee=add_payee)
+        self.account = account or next(iter(accounts_map_from_emails.values()))
+        self.senders = tuple(senders)
+        self.jobs = jobs
+
+    def identify(self, f):
+        if Path(f.name).suffix.lower() != '.mbox':
+            return False
+        with open(f.name, 'rb') as archive:
+            head = archive.read(HEAD_SIZE).lower()
+        return head.startswith(b'from ') and any(s.encode() in head for s in self.senders)
+
+    def file_account(self, file):
+        return self.account
+
+    def file_date(self, f):
+        return None
+
+    def file_name(self, f):
+        return Path(f.name).name
+
+    def extract(self, f, existing_entries=None):
+        # not cached on disk like the other importers: the result depends on existing_entries, and Maildirs are folders
+        seen = existing_txn_ids(existing_entries)
+        entries = []
+        for number, email in parse_mailbox(f.name, self.senders, self.jobs):
+            # the same notification is often in an archive more than once (eg. in the inbox and a label)
+            if email.reference and email.reference in seen:
+                continue
+            try:
+                txn = self.transaction_from_email(email, f.name, number)
+            except (AssertionError, ValueError) as e:
+                logger.debug(f"Skipping email {number} of {f.name}: {e}")
+                continue
+            if email.reference:
+                seen.add(email.reference)
+            entries.append(txn)
+        return entries
+
+
+if __name__ == "__main__":
+    import sys
+    from argparse import ArgumentParser
+    from beancount.parser import printer
+
+    parser = ArgumentParser(description="Print the transactions of the PhonePe emails in a mbox file or Maildir")
+    parser.add_argument("archive")
+    parser.add_argument("-m", "--map", action="append", required=True, metavar="NUMBER=ACCOUNT",
+                        help="Masked account number in the emails and its beancount account. Repeat for every account")
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    importer = PhonePeMailboxImporter(dict(m.split("=", 1) for m in args.map), jobs=args.jobs)
+    printer.print_entries(importer.extract(_FileMemo(args.archive)), file=sys.stdout)
@@ -5,7 +5,13 @@ from beancount.core import data
 from beancount.ingest.cache import _FileMemo
 from dateutil.parser import parserinfo, parse as dateparse
 import re
+import os
+import datetime
 import mimetypes
+from decimal import Decimal
+from functools import lru_cache
+from typing import NamedTuple, Optional
+from beancount_importers_india.utils.cache import cached
 
 
 def month_to_number(month):
@@ -14,6 +20,74 @@ def month_to_number(month):
             return i + 1
 
 
+# every field of the email, scanned in a single pass over its text. The first match of each field is used.
+# each alternative is a lookahead, so a match consumes no text and can't hide the fields it runs into (eg. a date on
+# the payee's line, or the status label right after the unspaced txn id), like one search per field wouldn't
+FIELDS_REGEX = re.compile(
+    r"(?=(?P<date>(?P<month>\w+) (?P<day>\d+), (?P<year>\d{4})))"
+    r"|(?=Txn\. ID\s*:\s*(?P<reference>\w+))"
+    r"|(?=Txn\. status\s*:\s*(?P<status>\w*))"
+    r"|(?=Bank Ref\. No\.\s*: \s*(?P<bank_reference>\w*))"
+    r"|(?=₹ *(?P<amount>(?:\d+,)*\d+(?:.\d{2})?))"
+    r"|(?=(?P<account>\w+XXXX+\d+))"
+    r"|(?=Message\s*:\s*(?P<narration>(?:\w+ {1,2})*))" # narration can have multiple words separated by max 2 spaces
+    r"|(?=(?:Paid to|Received from)\s*(?P<payee>(?:\w+ {1,2})*))" # payee can have multiple words separated by max 2 spaces
+)
+TAG_REGEX = re.compile(r"<.*?>")
+MEMO_SIZE = 4096 # parsed emails kept in memory
+
+
+class PhonePeEmail(NamedTuple):
+    date: Optional[datetime.date]
+    amount: Optional[Decimal] # signed, -ve when debited
+    accounts: tuple[str, ...] # masked account numbers in the email, in order
+    reference: Optional[str]
+    bank_reference: Optional[str]
+    narration: Optional[str]
+    payee: Optional[str]
+    status: Optional[str]
+
+
+def parse_email_text(text:str) -> PhonePeEmail:
+    text = TAG_REGEX.sub("", text)  # remove html tags
+    text = text.replace("&#8377;", "₹")
+    found, accounts, accounts_end = {}, [], 0
+    for match in FIELDS_REGEX.finditer(text):
+        # the outermost named group of the alternative that matched
+        group = match.lastgroup
+        if group == "account":
+            # an account number also matches from every position inside it
+            if match.start() >= accounts_end:
+                accounts.append(match.group(group))
+                accounts_end = match.end(group)
+        elif group == "date":
+            found.setdefault(group, match)
+        else:
+            found.setdefault(group, match.group(group).strip())
+
+    date = None
+    if match := found.get("date"):
+        month = month_to_number(match.group("month"))
+        date = dateparse(f"{match.group('year')}-{month}-{match.group('day')}").date()
+    sign = -1 if "Debited from" in text else 1
+    amount = sign * data.D(found["amount"]) if "amount" in found else None
+    return PhonePeEmail(
+        date, amount, tuple(accounts), found.get("reference"), found.get("bank_reference"),
+        found.get("narration"), found.get("payee"), found.get("status"),
+    )
+
+
+@lru_cache(maxsize=MEMO_SIZE)
+def _parse_email_file(path:str, mtime_ns:int, size:int) -> PhonePeEmail:
+    return parse_email_text(Path(path).read_text())
+
+
+def parse_email(path:str) -> PhonePeEmail:
+    """Fields of the email, parsed once per version of the file however many times identify, file_* and extract ask"""
+    stat = os.stat(path)
+    return _parse_email_file(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
 class PhonePeTransactionEmailImporter(importer.ImporterProtocol):
     def __init__(
         self,
@@ -27,86 +101,32 @@ class PhonePeTransactionEmailImporter(importer.ImporterProtocol):
         self.account = None
 
     def extract_transaction_from_html(self, file: _FileMemo) -> data.Transaction:
-        payee_regex = re.compile(
-            r"(Paid to|Received from)\s*((\w+ {1,2})*)"
-        )  # payee can have multiple words separated by max 2 spaces
-        narration_regex = re.compile(
-            r"(Message\s*:\s*)((\w+ {1,2})*)"
-        )  # narration can have multiple words separated by max 2 spaces
-        # account_regex = re.compile(r'(Debited from|Credited to) *: *(X\w*)')
-        account_regex = re.compile(r"(\w+XXXX+\d+)")
-        reference_regex = re.compile(r"(Txn. ID\s*:\s*)(\w+)")
-        transaction_status_regex = re.compile(r"(Txn. status\s*:\s*)(\w*)")
-        bank_reference_regex = re.compile(r"(Bank Ref. No.\s*: \s*)(\w*)")
-        amount_regex = re.compile(r"₹ *(?P<amount>(\d+,)*\d+(.\d{2})?)")
-        date_regex = re.compile(r"(?P<month>\w+) (?P<day>\d+), (?P<year>\d{4})")
-
-        # dfs = pd.read_html(file.name)
-
-        payee, narration, account, reference, bank_reference, amount, date = (
-            None,
-            None,
-            None,
-            None,
-            None,
-            None,
-            None,
+        return self.transaction_from_email(parse_email(file.name), file.name)
+
+    def transaction_from_email(self, email: PhonePeEmail, filename: str, lineno: int = 0) -> data.Transaction:
+        """The transaction of a parsed email. Raises if the email isn't a successful transaction of a mapped account"""
+        account = None
+        for candidate in email.accounts:
+            if candidate in self.accounts_map_from_emails:
+                account = self.accounts_map_from_emails[candidate]
+                break
+        if email.accounts and account is None:
+            raise ValueError(
+                f"Account '{email.accounts[0]}' not found in the accounts_map_from_emails. available accounts are {self.accounts_map_from_emails.keys()}"
+            )
+        date, amount = email.date, data.Amount(email.amount, "INR") if email.amount is not None else None
+        payee, narration, reference, bank_reference, status = (
+            email.payee, email.narration, email.reference, email.bank_reference, email.status
         )
 
-        text = Path(file.name).read_text()
-        text = re.sub(r"<.*?>", "", text)  # remove html tags
-        text = re.sub(r"&#8377;", "₹", text)
-
-        sign = -1 if "Debited from" in text else 1
-
-        if date is None and (match := date_regex.search(text)):
-            try:
-                month = month_to_number(match.groupdict()["month"])
-            except:
-                raise ValueError(
-                    f'Could not parse the month from the date {match.groupdict()["month"]}'
-                )
-            date = dateparse(
-                f"{match.groupdict()['year']}-{month}-{match.groupdict()['day']}"
-            ).date()
-
-        if match := reference_regex.findall(text):
-            reference = match[0][1].strip()
-
-        if match := bank_reference_regex.findall(text):
-            bank_reference = match[0][1].strip()
-
-        if match := amount_regex.search(text):
-            amount = data.Amount(sign * data.D(match.groupdict()["amount"]), "INR")
-
-        if match := account_regex.findall(text):
-            account = None
-            for candidate in match:
-                if candidate in self.accounts_map_from_emails:
-                    account = self.accounts_map_from_emails[candidate]
-                    break
-            if account is None:
-                raise ValueError(
-                    f"Account '{match[0]}' not found in the accounts_map_from_emails. available accounts are {self.accounts_map_from_emails.keys()}"
-                )
-
-        if match := narration_regex.findall(text):
-            narration = match[0][1].strip()
-
-        if match := payee_regex.findall(text):
-            payee = match[0][1].strip()
-
-        if match := transaction_status_regex.search(text):
-            status = match.group(2)
-
         assert (
             date and amount and account
-        ), f"Could not extract date, amount or account from the file {file.name}. Date: {date}, Amount: {amount}, Account: {account}"
+        ), f"Could not extract date, amount or account from the file {filename}. Date: {date}, Amount: {amount}, Account: {account}"
         assert (
-            status.lower() == "successful"
+            status and status.lower() == "successful"
         ), f"Transaction status is not success. Status: {status}"
 
-        txn_meta = data.new_metadata(file.name, 0)
+        txn_meta = data.new_metadata(filename, lineno)
 
         txn = data.Transaction(
             meta=txn_meta,
@@ -156,6 +176,7 @@ class PhonePeTransactionEmailImporter(importer.ImporterProtocol):
         except:
             return False
 
+    @cached
     def extract(self, f, existing_entries=None):
         return [self.extract_transaction_from_html(f)]
 
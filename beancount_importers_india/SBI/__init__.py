@@ -11,6 +11,11 @@ import subprocess
 import os
 import re
 import mimetypes
+from beancount_importers_india.utils.pdf import get_pdf_session
+from beancount_importers_india.utils.cache import cached
+from beancount_importers_india.utils import transactions
+from beancount_importers_india.utils import dates
+from beancount_importers_india.utils import amounts
 
 class Importer(importer.ImporterProtocol):
     def __init__(self, account_number, account="Assets:INR:SBI:Saving"):
@@ -24,11 +29,10 @@ class Importer(importer.ImporterProtocol):
         # skip non pdf files
         if mimetypes.guess_type(f.name)[0] != 'application/pdf': return False
         # grepping the account number from the file should return 0
-        return not subprocess.call(
-        f'pdf2txt.py "{f.name}" | grep "{self.account_number}" > /dev/null',
-        shell=True,
-        stderr=open(os.devnull, "w"),
-        )
+        try:
+            return get_pdf_session(f).contains([str(self.account_number)])
+        except:
+            return False
     
     def clean_description(self, desc:str):
         desc = desc.replace("\r"," ")
@@ -36,47 +40,23 @@ class Importer(importer.ImporterProtocol):
             return desc.split('-')[1]
         return desc
 
+    @cached
     def extract(self, f, existing_entries=None):
-        entries = []
-        parse_amount = lambda val: float(val.replace(",","")) if isinstance(val, str) else val
         tables = tabula.read_pdf(f.name, pages='all', lattice=True)
         try: tab = pd.concat(tables, ignore_index=True)
         # If topmost description is extracted as 0th table
         except: tab = pd.concat(tables[1:], ignore_index=True)
 
-        for index, row in tab.iterrows():
-            trans_date = parse(row['Txn Date']).date()
-            trans_desc = self.clean_description(row['Description'])
-            is_debit = isinstance(row['Debit'], str)
-            trans_amt  = -1*D(row["Debit"]) if is_debit else D(row['Credit'])
-            # if not trans_amt in [1,-1]: continue
-
-
-            meta = data.new_metadata(f.name, index)
-            posting_meta = {}
-            ref_col = [c for c in tab.columns if re.search("Ref",c)][0]
-            ref = row[ref_col]
-            if isinstance(ref, str): posting_meta["transaction_ref"] = ref.replace('\r',' ')
-
-            txn = data.Transaction(
-                meta=meta,
-                date=trans_date,
-                flag=flags.FLAG_OKAY,
-                payee=None,
-                narration = trans_desc,
-                tags=set(),
-                links=set(),
-                postings=[],
-            )
-
-            txn.postings.append(
-                data.Posting(self.account, amount.Amount(trans_amt,
-                    'INR'), None, None, None, posting_meta)
-            )
-
-            entries.append(txn)
-
-        return entries
+        ref_col = [c for c in tab.columns if re.search("Ref",c)][0]
+        rows = pd.DataFrame({
+            transactions.DATE: dates.parse_dates(tab['Txn Date'], dayfirst=False),
+            transactions.NARRATION: tab['Description'].map(self.clean_description),
+            transactions.AMOUNT: amounts.debit_credit_amounts(tab['Debit'], tab['Credit']),
+            'transaction_ref': tab[ref_col].map(lambda ref: ref.replace('\r',' ') if isinstance(ref, str) else None),
+        })
+        return transactions.build_transactions(
+            rows, f.name, self.account, posting_meta_columns={'transaction_ref': 'transaction_ref'}, document=None
+        )
 
 if __name__ == "__main__":
     import os
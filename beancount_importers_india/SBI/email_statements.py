@@ -16,6 +16,11 @@ import re
 import mimetypes
 import datetime
 from typing import Tuple
+from beancount_importers_india.utils.pdf import get_pdf_session
+from beancount_importers_india.utils.cache import cached
+from beancount_importers_india.utils import transactions
+from beancount_importers_india.utils import dates
+from beancount_importers_india.utils import amounts
 
 class SBIEmailStatementImporter(importer.ImporterProtocol):
     def __init__(self, account_number, name_in_file, password, account="Assets:INR:SBI:Saving"):
@@ -36,23 +41,13 @@ class SBIEmailStatementImporter(importer.ImporterProtocol):
                 f'{self.name_in_file}'
                 ]
         try:
-            return all(
-            [
-
-                not subprocess.call(
-                    f"pdf2txt.py -P {self.password} '{f.name}' | grep '{line}' > /dev/null",
-                    shell=True,
-                    stderr=open(os.devnull, "w"),
-                )
-                for line in lines_to_check
-            ]
-        )
+            return get_pdf_session(f, self.password).contains(lines_to_check)
         except:
             return False
     
     def parse_opening_balance(self, f)->data.Balance:
         result = subprocess.run(
-            f"pdf2txt.py -M 1000 -L 1000 -P {self.password} '{f.name}' "
+            f"pdf2txt.py -M 1000 -L 1000 '{get_pdf_session(f, self.password).decrypted_path}' "
             "| awk '/Opening Balance/ {print $5, $6}'",
             shell=True,
             stdout=subprocess.PIPE
@@ -71,7 +66,7 @@ class SBIEmailStatementImporter(importer.ImporterProtocol):
         )
     def parse_closing_balance(self, f)->data.Balance:
         result = subprocess.run(
-            f"pdf2txt.py -M 1000 -L 1000 -P {self.password} '{f.name}' "
+            f"pdf2txt.py -M 1000 -L 1000 '{get_pdf_session(f, self.password).decrypted_path}' "
             "| awk '/Closing Balance/ {print $5, $6}'",
             shell=True,
             stdout=subprocess.PIPE
@@ -87,10 +82,9 @@ class SBIEmailStatementImporter(importer.ImporterProtocol):
             diff_amount=None,
         )
 
+    @cached
     def extract(self, f, existing_entries=None):
-        entries = []
-        parse_amount = lambda val: float(val.replace(",","")) if isinstance(val, str) else val
-        tables = tabula.read_pdf(f.name, pages='all', lattice=True, password=self.password)
+        tables = tabula.read_pdf(get_pdf_session(f, self.password).decrypted_path, pages='all', lattice=True)
         filtered_tables = []
         column_names = ['Date', 'Transaction Reference', 'Debit', 'Credit', 'Ref.No./Chq.No.','Balance']
         for t in tables:
@@ -101,40 +95,16 @@ class SBIEmailStatementImporter(importer.ImporterProtocol):
         # If topmost description is extracted as 0th table
         except: tab = pd.concat(tables[1:], ignore_index=True)
 
-        for index, row in tab.iterrows():
-            if row['Balance']=='null' or type(row['Balance']) is float and np.isnan(row['Balance']): continue
-            trans_date = parse(row['Date'], dayfirst=True).date()
-            trans_desc = row['Transaction Reference'].replace("\r"," ")
-            is_debit = isinstance(row['Debit'], str) and row['Debit'].strip('-')
-            trans_amt  = -1*D(row["Debit"]) if is_debit else D(row['Credit'])
-            # if not trans_amt in [1,-1]: continue
-
-
-            meta = data.new_metadata(f.name, index)
-            posting_meta = {'document': Path(f.name).name}
-            ref_col = [c for c in tab.columns if re.search("Ref",c)][-1]
-            ref = row[ref_col]
-            if isinstance(ref, str): posting_meta["transaction_ref"] = ref.replace('\r',' ')
-
-            txn = data.Transaction(
-                meta=meta,
-                date=trans_date,
-                flag=flags.FLAG_OKAY,
-                payee=None,
-                narration = trans_desc,
-                tags=set(),
-                links=set(),
-                postings=[],
-            )
-
-            txn.postings.append(
-                data.Posting(self.account, amount.Amount(trans_amt,
-                    'INR'), None, None, None, posting_meta)
-            )
-
-            entries.append(txn)
-
-        return entries
+        # rows without a balance are not transactions
+        tab = tab[~((tab['Balance'] == 'null') | tab['Balance'].isna())]
+        ref_col = [c for c in tab.columns if re.search("Ref",c)][-1]
+        rows = pd.DataFrame({
+            transactions.DATE: dates.parse_dates(tab['Date'], dayfirst=True),
+            transactions.NARRATION: tab['Transaction Reference'].str.replace("\r"," "),
+            transactions.AMOUNT: amounts.debit_credit_amounts(tab['Debit'], tab['Credit']),
+            'transaction_ref': tab[ref_col].map(lambda ref: ref.replace('\r',' ') if isinstance(ref, str) else None),
+        })
+        return transactions.build_transactions(rows, f.name, self.account, posting_meta_columns={'transaction_ref': 'transaction_ref'})
 
 if __name__ == "__main__":
     import os
@@ -0,0 +1,172 @@
+"""
+Extract a whole directory of statements in parallel.
+
+bean-extract walks the files one by one, and the camelot/ghostscript/tabula calls of each importer are single threaded.
+This driver runs identify and extract for each file in a pool of worker processes. Every worker imports the heavy
+libraries and loads the importers CONFIG once when it starts, then only receives file paths.
+The output is printed in file order, in the same format as bean-extract.
+
+    python -m beancount_importers_india.batch config.py ~/Downloads/statements -j 8 > new_entries.beancount
+"""
+import os
+import sys
+import runpy
+import logging
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+from beancount.core import data
+from beancount.ingest import extract, identify
+from beancount.ingest.cache import _FileMemo
+from beancount.utils import file_utils
+from beancount_importers_india.utils import cache, pdf, routing
+from beancount_importers_india.utils import lots, dedup, ledger, categorize
+
+logger = logging.getLogger('beancount_importers_india.batch')
+
+# modules imported once per worker instead of once per file
+WARM_MODULES = ['pandas', 'pdfplumber', 'pdfminer.high_level', 'camelot', 'tabula']
+
+# importers of the worker process and their router, loaded by _init_worker
+_importers = None
+_router = None
+
+
+def load_config(config_path:str) -> list:
+    """The CONFIG list of importers defined in a bean-extract config file"""
+    return runpy.run_path(config_path)['CONFIG']
+
+
+def load_rules(config_path:str) -> list:
+    """The RULES list of `categorize.Rule`s defined in the config file, if any"""
+    return runpy.run_path(config_path).get('RULES') or []
+
+
+def find_files(files_or_directories:list[str]) -> list[str]:
+    """All the files under the given paths, in a deterministic order"""
+    return sorted(
+        path for path in file_utils.find_files(files_or_directories)
+        if os.path.getsize(path) <= identify.FILE_TOO_LARGE_THRESHOLD
+    )
+
+
+def _init_worker(config_path:str, use_cache:bool):
+    global _importers, _router
+    if not use_cache:
+        cache.disable()
+    # files are already spread across the cores, so don't shard their pages as well
+    pdf.set_page_workers(1)
+    for module in WARM_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    _importers = load_config(config_path)
+    _router = routing.Router(_importers)
+
+
+def extract_file(path:str, importers:list=None) -> list[tuple[str, list]]:
+    """Runs every importer that identifies the file. Returns (importer name, entries) for each of them"""
+    router = _router if importers is None else routing.Router(importers)
+    # a memo per file (instead of beancount's global one) so the parsed file is freed once we are done with it
+    file = _FileMemo(path)
+    results = []
+    # only the importers the file is routed to run their identify
+    for importer in router.candidates(file):
+        try:
+            if not importer.identify(file):
+                continue
+            entries = importer.extract(file, existing_entries=None) or []
+        except Exception as e:
+            logger.exception(f"Importer {importer.name()} failed on {path}: {e}")
+            continue
+        entries.sort(key=data.entry_sortkey)
+        results.append((importer.name(), entries))
+    return results
+
+
+def batch_extract(config_path:str, files_or_directories:list[str], jobs:int=None, use_cache:bool=True):
+    """Yields (path, [(importer name, entries), ...]) for every file, in the order of `find_files`"""
+    files = find_files(files_or_directories)
+    if jobs == 1:
+        _init_worker(config_path, use_cache)
+        for path in files:
+            yield path, extract_file(path)
+        return
+    # the workers decrypt into the directory of this process, which is removed when it exits
+    pdf.decrypt_dir()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(config_path, use_cache)) as pool:
+        # map returns results in submission order, so the output doesn't depend on which worker finishes first
+        yield from zip(files, pool.map(extract_file, files))
+
+
+def dedup_results(results, existing_entries:list) -> list:
+    """The results of batch_extract with the entries already in existing_entries marked as duplicates"""
+    results = list(results)
+    index = dedup.DuplicateIndex(existing_entries or [])
+    return [
+        (path, [(name, dedup.mark_duplicates(entries, index)) for name, entries in matches])
+        for path, matches in results
+    ]
+
+
+def categorize_results(results, categorizer:categorize.Categorizer) -> list:
+    """The results of batch_extract with the other posting of every single posting transaction from its rule"""
+    return [
+        (path, [(name, categorizer.categorize_all(entries)) for name, entries in matches])
+        for path, matches in results
+    ]
+
+
+def book_results(results, importers:list, existing_entries:list=None) -> list:
+    """The results of batch_extract with the sells of all the files FIFO booked together, see `utils.lots`"""
+    results = list(results)
+    entries = [entry for _, matches in results for _, file_entries in matches for entry in file_entries]
+    booked = iter(lots.book_lots(entries, importers, existing_entries))
+    return [
+        (path, [(name, [next(booked) for _ in file_entries]) for name, file_entries in matches])
+        for path, matches in results
+    ]
+
+
+def print_results(results, output=sys.stdout):
+    output.write(extract.HEADER)
+    for path, matches in results:
+        for _, entries in matches:
+            output.write(identify.SECTION.format(path))
+            output.write('\n')
+            extract.print_extracted_entries(entries, output)
+
+
+def main(argv=None):
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Extract transactions from a directory of statements in parallel")
+    parser.add_argument('config', help="bean-extract config file defining the CONFIG list of importers")
+    parser.add_argument('paths', nargs='+', help="Files or directories to import")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="Number of worker processes. Defaults to the number of CPUs")
+    parser.add_argument('--no-cache', action='store_true', help="Don't read or write the extraction cache")
+    parser.add_argument('--rule-hits', action='store_true', help="Print the number of transactions categorized by each of the config's RULES")
+    parser.add_argument('--book-lots', action='store_true', help="FIFO book the sells of all the files against each other's lots")
+    parser.add_argument('--existing', help="Ledger to mark the entries already in it as duplicates, and to book the sells against its lots with --book-lots")
+    args = parser.parse_args(argv)
+
+    results = batch_extract(args.config, args.paths, jobs=args.jobs, use_cache=not args.no_cache)
+    existing_entries = None
+    if args.existing:
+        # a snapshot of the ledger's transactions, only parsing the files changed since the last run
+        existing_entries = ledger.load_snapshot(args.existing)
+        results = dedup_results(results, existing_entries)
+    rules = load_rules(args.config)
+    if rules:
+        categorizer = categorize.Categorizer(rules)
+        results = categorize_results(results, categorizer)
+    if args.book_lots:
+        results = book_results(results, load_config(args.config), existing_entries)
+    print_results(results)
+    if rules and args.rule_hits:
+        for rule, hits in categorizer.report():
+            print(f"{hits:8d}  {rule.account}  {rule.substring or rule.regex or rule.vpa}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
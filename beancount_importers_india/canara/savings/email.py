@@ -17,6 +17,11 @@ import re
 import mimetypes
 import datetime
 from typing import Tuple
+from beancount_importers_india.utils.pdf import get_pdf_session
+from beancount_importers_india.utils.cache import cached
+from beancount_importers_india.utils import transactions
+from beancount_importers_india.utils import dates
+from beancount_importers_india.utils import amounts
 
 # headers from the canara bank email statement
 DATE = "Txn Date"
@@ -41,23 +46,14 @@ class CanaraSavingsEmailStatementImporter(importer.ImporterProtocol):
         if mimetypes.guess_type(f.name)[0] != "application/pdf":
             return False
         # grepping the account number from the file should return 0
-        lines_to_check = [self.account_number, self.name_in_file]
+        lines_to_check = [str(self.account_number), self.name_in_file]
         try:
-            return all(
-                [
-                    not subprocess.call(
-                        f"pdf2txt.py -P {self.password} '{f.name}' | grep '{line}' > /dev/null",
-                        shell=True,
-                        stderr=open(os.devnull, "w"),
-                    )
-                    for line in lines_to_check
-                ]
-            )
+            return get_pdf_session(f, self.password).contains(lines_to_check)
         except:
             return False
 
     def load_df(self, f):
-        tables = camelot.read_pdf(f.name, pages="all", password=self.password)
+        tables = get_pdf_session(f, self.password).tables(pages="all")
         dfs = [table.df.copy() for table in tables]
         headers = list(dfs[0].iloc[0])
         # camelot returns the first row as the header, so we need to drop it after copying
@@ -95,53 +91,16 @@ class CanaraSavingsEmailStatementImporter(importer.ImporterProtocol):
             diff_amount=None,
         )
 
+    @cached
     def extract(self, f, existing_entries=None):
-        entries = []
-        parse_amount = lambda val: (
-            float(val.replace(",", "")) if isinstance(val, str) else val
-        )
         df = self.load_df(f)
-        for index, row in df.iterrows():
-            assert (
-                row[DEBIT] != "" or row[CREDIT] != ""
-            ), "Both Debit and Credit Amounts are empty in row {} of statement {}".format(
-                index, f.name
-            )
-            trans_date = parse(row[DATE]).date()
-            trans_desc = re.sub(r'(\r|\n|\r\n)', ' ', row[NARRATION]) 
-            is_debit = (
-                isinstance(row[DEBIT], str)
-                and row[DEBIT].strip() != ""
-                and row[DEBIT].strip() != "0.00"
-            )
-            trans_amt = -1 * D(row[DEBIT]) if is_debit else D(row[CREDIT])
-            # if not trans_amt in [1,-1]: continue
-
-            meta = data.new_metadata(f.name, index)
-            posting_meta = {'document': Path(f.name).name}
-
-            txn = data.Transaction(
-                meta=meta,
-                date=trans_date,
-                flag=flags.FLAG_OKAY,
-                payee=None,
-                narration=trans_desc,
-                tags=set(),
-                links=set(),
-                postings=[],
-            )
-
-            txn.postings.append(
-                data.Posting(
-                    self.account,
-                    amount.Amount(trans_amt, "INR"),
-                    None,
-                    None,
-                    None,
-                    posting_meta,
-                )
-            )
-
-            entries.append(txn)
-
-        return entries
+        both_empty = (df[DEBIT] == "") & (df[CREDIT] == "")
+        assert not both_empty.any(), "Both Debit and Credit Amounts are empty in row {} of statement {}".format(
+            df.index[both_empty][0] if both_empty.any() else None, f.name
+        )
+        rows = pd.DataFrame({
+            transactions.DATE: dates.parse_dates(df[DATE], dayfirst=False),
+            transactions.NARRATION: df[NARRATION].str.replace(r'(\r|\n|\r\n)', ' ', regex=True),
+            transactions.AMOUNT: amounts.debit_credit_amounts(df[DEBIT], df[CREDIT]),
+        })
+        return transactions.build_transactions(rows, f.name, self.account)
@@ -2,16 +2,33 @@
 This source is a wrapper around pricehist source.
 Since BSE data fetched from yahoo by pricehist is not quantized, we get quotes like INR 120.099999234 while the actual price is INR 120.1
 In beanount, there is no way to pass the quantize flag to pricehist source, hence this source is a wrapper around the pricehist source that quantizes the prices fetched from the pricehist source.
+
+Fetched prices are kept in a local `PriceStore`, along with the date ranges already fetched, so only the missing days
+are ever downloaded. A miss is widened to the neighbouring gaps (up to a year back and up to yesterday), so bean-price
+asking for years of daily prices one date at a time results in a handful of range queries per ticker.
+
+To price a whole ledger, prefetch all its tickers concurrently before running bean-price:
+
+    python -m beancount_importers_india.sources.yahoo_quantized ledger.beancount -j 8
+
+The jobs come from the `price:` metadata of the commodities (as written by `BSEClient.export_commodity_declaration`),
+and an optional `tick_size:` (eg. "0.05") sets the rounding of each commodity's prices, which defaults to paise.
 """
 import re
-from datetime import date, datetime, timedelta, timezone
+import sys
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from datetime import date, datetime, time, timedelta, timezone
 from decimal import Decimal
-from typing import List, NamedTuple, Optional
+from typing import Callable, Iterable, List, NamedTuple, Optional
 
 
 from pricehist import exceptions
 from pricehist.series import Series
 from pricehist.sources.yahoo import Yahoo
+from beancount_importers_india.utils.cache import cache_dir
 
 SourcePrice = NamedTuple(
     "SourcePrice",
@@ -22,7 +39,154 @@ SourcePrice = NamedTuple(
     ],
 )
 
+COALESCE_DAYS = 365 # a missing date is fetched along with up to this many uncovered days before it
+ONE_DAY = timedelta(days=1)
+TICK_SIZE = Decimal("0.01")
+SOURCE_NAME = 'beancount_importers_india.sources.yahoo_quantized'
+
+# prices loaded by `Source.prefetch`, shared by all the instances of the source: {ticker: (start, end, [(date, price, quote)])}
+_prefetched = {}
+_prefetched_lock = threading.Lock()
+
+
+class PriceJob(NamedTuple):
+    ticker: str
+    start: date
+    end: date
+    tick_size: Decimal = TICK_SIZE
+
+
+def quantize(price:Decimal, tick_size:Decimal=TICK_SIZE) -> Decimal:
+    """Round the price to the nearest tick. eg. 120.0999 -> 120.10 for a tick size of 0.05"""
+    return ((price / tick_size).quantize(Decimal(1)) * tick_size).quantize(tick_size)
+
+
+def jobs_from_entries(entries:list, start:Optional[date]=None, end:Optional[date]=None) -> list[PriceJob]:
+    """A job per commodity priced by this source, from the first day it is held (or `start`) to `end` (or today)"""
+    from beancount.core import data
+
+    first_used = {}
+    for entry in entries:
+        if isinstance(entry, data.Transaction):
+            for posting in entry.postings:
+                first_used.setdefault(posting.units.currency, entry.date)
+    jobs = []
+    for entry in entries:
+        if not isinstance(entry, data.Commodity) or entry.currency not in first_used:
+            continue
+        # eg. INR:beancount_importers_india.sources.yahoo_quantized/RELIANCE.BO, possibly with other sources
+        for spec in re.split(r'[\s,]+', str(entry.meta.get('price', ''))):
+            source, _, ticker = spec.partition(':')[2].lstrip('^').partition('/')
+            if source == SOURCE_NAME and ticker:
+                tick_size = Decimal(str(entry.meta.get('tick_size', TICK_SIZE)))
+                jobs.append(PriceJob(ticker, start or first_used[entry.currency], end or date.today(), tick_size))
+    return jobs
+
+
+class PriceStore:
+    """Prices already fetched per ticker, and the date ranges they cover (including days without prices, like holidays)"""
+    def __init__(self, path:Path=None):
+        self.path = Path(path) if path else cache_dir()/'prices.sqlite3'
+        self._local = threading.local() # bean-price calls sources from several threads
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if getattr(self._local, 'db', None) is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('CREATE TABLE IF NOT EXISTS prices (ticker TEXT, date TEXT, price TEXT, quote TEXT, PRIMARY KEY (ticker, date))')
+            db.execute('CREATE TABLE IF NOT EXISTS coverage (ticker TEXT, start TEXT, end TEXT)')
+            db.execute('CREATE TABLE IF NOT EXISTS tick_sizes (ticker TEXT PRIMARY KEY, tick_size TEXT)')
+            db.commit()
+            self._local.db = db
+        return self._local.db
+
+    def prices(self, ticker:str, start:date, end:date) -> list[tuple[date, Decimal, str]]:
+        rows = self.db.execute(
+            'SELECT date, price, quote FROM prices WHERE ticker = ? AND date BETWEEN ? AND ? ORDER BY date',
+            (ticker, start.isoformat(), end.isoformat())
+        )
+        return [(date.fromisoformat(d), Decimal(price), quote) for d, price, quote in rows]
+
+    def tick_size(self, ticker:str) -> Decimal:
+        row = self.db.execute('SELECT tick_size FROM tick_sizes WHERE ticker = ?', (ticker,)).fetchone()
+        return Decimal(row[0]) if row else TICK_SIZE
+
+    def set_tick_size(self, ticker:str, tick_size:Decimal):
+        with self.db as db:
+            db.execute('INSERT OR REPLACE INTO tick_sizes VALUES (?, ?)', (ticker, str(tick_size)))
+
+    def coverage(self, ticker:str) -> list[tuple[date, date]]:
+        rows = self.db.execute('SELECT start, end FROM coverage WHERE ticker = ? ORDER BY start', (ticker,))
+        return [(date.fromisoformat(start), date.fromisoformat(end)) for start, end in rows]
+
+    def missing(self, ticker:str, start:date, end:date) -> list[tuple[date, date]]:
+        """Date ranges between start and end that were never fetched"""
+        gaps = []
+        for covered_start, covered_end in self.coverage(ticker):
+            if covered_end < start or covered_start > end:
+                continue
+            if covered_start > start:
+                gaps.append((start, covered_start - ONE_DAY))
+            start = max(start, covered_end + ONE_DAY)
+        if start <= end:
+            gaps.append((start, end))
+        return gaps
+
+    def add(self, ticker:str, prices:list[tuple[date, Decimal]], quote:str, start:date, end:date):
+        """Store the prices fetched for start..end, and mark the range as covered"""
+        with self.db as db:
+            db.executemany(
+                'INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?)',
+                [(ticker, d.isoformat(), str(price), quote) for d, price in prices]
+            )
+            if start > end:
+                return
+            ranges = sorted(self.coverage(ticker) + [(start, end)])
+            merged = [ranges[0]]
+            for range_start, range_end in ranges[1:]:
+                if range_start <= merged[-1][1] + ONE_DAY:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], range_end))
+                else:
+                    merged.append((range_start, range_end))
+            db.execute('DELETE FROM coverage WHERE ticker = ?', (ticker,))
+            db.executemany('INSERT INTO coverage VALUES (?, ?, ?)', [(ticker, s.isoformat(), e.isoformat()) for s, e in merged])
+
+
 class Source:
+    """
+    Args:
+    fetch_series: function fetching a pricehist `Series`. Defaults to pricehist's Yahoo source; replace it to test
+        against a local stand-in
+    """
+    def __init__(self, store:PriceStore=None, fetch_series:Callable[[Series], Series]=None):
+        self.store = store or PriceStore()
+        self.yahoo = Yahoo()
+        self.fetch_series = fetch_series or self.yahoo.fetch
+
+    def prefetch(self, jobs:Iterable[PriceJob], max_workers:int=8) -> dict[str, Exception]:
+        """Fetch the missing prices of all the jobs concurrently, and keep them in memory for the per ticker calls
+        of bean-price. Returns the errors by ticker.
+        """
+        jobs = list(jobs)
+        for job in jobs:
+            self.store.set_tick_size(job.ticker, job.tick_size)
+
+        def run(job:PriceJob):
+            self._fetch_missing(job.ticker, job.start, job.end)
+            prices = self.store.prices(job.ticker, job.start, job.end)
+            with _prefetched_lock:
+                _prefetched[job.ticker] = (job.start, job.end, prices)
+
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for job, future in [(job, pool.submit(run, job)) for job in jobs]:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors[job.ticker] = e
+        return errors
+
     def get_latest_price(self, ticker: str) -> Optional[SourcePrice]:
         time_end = datetime.combine(date.today(), datetime.min.time())
         time_begin = time_end - timedelta(days=7)
@@ -47,28 +211,52 @@ class Source:
         time_begin: datetime,
         time_end: datetime,
     ) -> Optional[List[SourcePrice]]:
-        base, quote, type = self._decode(ticker)
-
-        start = time_begin.date().isoformat()
-        end = time_end.date().isoformat()
+        start = time_begin.date()
+        end = time_end.date()
 
         local_tz = datetime.now(timezone.utc).astimezone().tzinfo
         user_tz = time_begin.tzinfo or local_tz
 
-        try:
-            series = Yahoo().fetch(Series(base, quote, type, start, end))
-        except exceptions.SourceError:
-            return None
+        prefetched = _prefetched.get(ticker)
+        if prefetched and prefetched[0] <= start and end <= prefetched[1]:
+            prices = [p for p in prefetched[2] if start <= p[0] <= end]
+        else:
+            try:
+                self._fetch_missing(ticker, start, end)
+            except exceptions.SourceError:
+                return None
+            prices = self.store.prices(ticker, start, end)
 
+        tick_size = self.store.tick_size(ticker)
         return [
             SourcePrice(
-                price.amount.quantize(Decimal("1.00")),
-                datetime.fromisoformat(price.date).replace(tzinfo=user_tz),
-                series.quote,
+                quantize(price, tick_size),
+                datetime.combine(day, time.min).replace(tzinfo=user_tz),
+                quote,
             )
-            for price in series.prices
+            for day, price, quote in prices
         ]
 
+    def _fetch_missing(self, ticker:str, start:date, end:date):
+        yesterday = date.today() - ONE_DAY
+        coverage = self.store.coverage(ticker)
+        for gap_start, gap_end in self.store.missing(ticker, start, end):
+            # coalesce with the uncovered days around the gap, so the next requests are already covered
+            before = [e for s, e in coverage if e < gap_start]
+            after = [s for s, e in coverage if s > gap_end]
+            gap_start = max(gap_start - timedelta(days=COALESCE_DAYS), max(before) + ONE_DAY if before else date.min)
+            if gap_end < yesterday:
+                gap_end = min(yesterday, min(after) - ONE_DAY if after else yesterday)
+            self.fetch(ticker, gap_start, gap_end)
+
+    def fetch(self, ticker:str, start:date, end:date):
+        """Download the prices of start..end into the store. Days up to yesterday are marked as covered"""
+        base, quote, type = self._decode(ticker)
+        series = self.fetch_series(Series(base, quote, type, start.isoformat(), end.isoformat()))
+        prices = [(date.fromisoformat(price.date), price.amount) for price in series.prices]
+        # today's price may still change, so it is fetched again next time
+        self.store.add(ticker, prices, series.quote, start, min(end, date.today() - ONE_DAY))
+
     def _decode(self, ticker):
         # https://github.com/beancount/beanprice/blob/b05203/beanprice/price.py#L166
         parts = [
@@ -76,5 +264,26 @@ class Source:
             for part in ticker.split(":")
         ]
         base, quote, candidate_type = (parts + [""] * 3)[0:3]
-        type = candidate_type or Yahoo().types()[0]
-        return (base, quote, type)
\ No newline at end of file
+        type = candidate_type or self.yahoo.types()[0]
+        return (base, quote, type)
+
+
+def main(argv=None):
+    from argparse import ArgumentParser
+    from beancount import loader
+
+    parser = ArgumentParser(description="Prefetch the prices of all the commodities of a ledger priced by this source")
+    parser.add_argument('ledger', help="beancount file")
+    parser.add_argument('-j', '--jobs', type=int, default=8, help="Number of concurrent fetches")
+    args = parser.parse_args(argv)
+
+    entries, _, _ = loader.load_file(args.ledger)
+    jobs = jobs_from_entries(entries)
+    errors = Source().prefetch(jobs, max_workers=args.jobs)
+    for ticker, error in errors.items():
+        print(f"{ticker}: {error}", file=sys.stderr)
+    print(f"Prefetched {len(jobs) - len(errors)} of {len(jobs)} tickers", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
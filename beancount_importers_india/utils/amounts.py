@@ -0,0 +1,81 @@
+"""
+Parses whole columns of statement amounts into signed Decimals.
+
+Statements write amounts in many ways: lakh/crore grouping (`1,23,456.78`), a currency prefix (`₹ -500`, `Rs. 20`),
+a trailing `Cr`/`Dr` marker, or a separate debit and credit column. `parse_amounts` handles all of them with a single
+regex over the column instead of per-cell string surgery, so every importer shares (and we only optimize) one parser.
+
+Signs follow the account: money coming in (`Cr`, `+`) is positive and money going out (`Dr`, `-`, brackets) negative.
+The same holds for columns read as numbers: a negative number stays negative, and only the others take `default_sign`.
+"""
+import re
+from decimal import Decimal, InvalidOperation
+from typing import Optional
+import pandas as pd
+
+ZERO = Decimal(0)
+
+AMOUNT_RE = re.compile(r"""
+    ^\s*(?P<sign>[-+])?\s*
+    (?:₹|Rs\.?|INR)?\s*
+    (?P<sign2>[-+])?\s*
+    (?P<open>\()?\s*
+    (?P<number>\d[\d,]*(?:\.\d*)?|\.\d+)\s*
+    \)?\s*
+    (?P<marker>cr|dr)?\.?\s*$
+""", re.IGNORECASE | re.VERBOSE)
+# cells treated as no amount
+EMPTY_CELLS = {'', '-', '--', 'nan', 'None'}
+
+
+def _empty(values:pd.Series) -> pd.Series:
+    return values.isna() | values.astype(str).str.strip().isin(EMPTY_CELLS)
+
+
+def parse_amounts(values:pd.Series, default_sign:int=1, require_marker:bool=False, empty:Optional[Decimal]=None,
+                  errors:str='raise') -> pd.Series:
+    """Signed Decimals for a column of amounts, with the same index.
+
+    Args:
+    default_sign: sign of the amounts without a Cr/Dr marker or +/- sign. eg. -1 for card statements marking only credits.
+        Explicitly negative amounts (`-500`, `(500)`, `500 Dr`, or -500.0 in a numeric column) are negative whatever it is
+    require_marker: raise (or coerce) amounts without a Cr/Dr marker
+    empty: value for empty cells, like `ZERO` for debit/credit columns. Defaults to None
+    errors: 'raise' on cells that are not amounts, or 'coerce' them to None
+    """
+    is_empty = _empty(values)
+    result = pd.Series([empty]*len(values), index=values.index, dtype=object)
+    if pd.api.types.is_numeric_dtype(values):
+        # numbers read from csv/xls. like a '-' in a string, a negative number keeps its sign
+        result[~is_empty] = values[~is_empty].map(lambda v: Decimal(str(v)) if v < 0 else Decimal(str(v)) * default_sign)
+        return result
+
+    parts = values[~is_empty].astype(str).str.extract(AMOUNT_RE)
+    matched = parts['number'].notna()
+    if require_marker:
+        matched &= parts['marker'].notna()
+    if not matched.all():
+        bad = values[~is_empty][~matched]
+        if errors == 'raise':
+            raise ValueError(f"Not an amount{' with a Cr/Dr marker' if require_marker else ''}: {bad.iloc[0]!r}")
+        result[bad.index] = None
+        parts = parts[matched]
+
+    markers = parts['marker'].str.lower()
+    negative = (
+        (parts['sign'] == '-') | (parts['sign2'] == '-') | parts['open'].notna() | (markers == 'dr')
+        | (markers.isna() & parts['sign'].isna() & parts['sign2'].isna() & (default_sign < 0))
+    )
+    try:
+        numbers = parts['number'].str.replace(',', '', regex=False).map(Decimal)
+    except InvalidOperation as e:
+        raise ValueError(f"Not an amount: {e}")
+    result[parts.index] = numbers.where(~negative, -numbers)
+    return result
+
+
+def debit_credit_amounts(debits:pd.Series, credits:pd.Series) -> pd.Series:
+    """Signed amounts from a pair of withdrawal and deposit columns, whichever of them is filled in each row"""
+    debits = parse_amounts(debits, empty=ZERO).map(abs)
+    credits = parse_amounts(credits, empty=ZERO).map(abs)
+    return credits - debits
@@ -1,4 +1,14 @@
 import re
+import os
+import sys
+import sqlite3
+import tempfile
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from logging import getLogger
+from contextlib import closing
+from typing import Callable, Iterable, Mapping, Optional
 from textwrap import dedent
 from pathlib import Path
 import json
@@ -6,6 +16,9 @@ import subprocess
 import datetime
 import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from beancount_importers_india.utils.cache import cache_dir
 
 
 BSE_DATA = Path(__file__).parent.absolute()/'bse.json'
@@ -14,41 +27,222 @@ ISIN_KEY = 'ISIN_NUMBER'
 NAME_KEY = 'SCRIP_NAME'
 PRICE_KEY = 'wap' # weight average price
 SCRIP_CODE_KEY = 'SCRIP_CD'
+LEADING_DIGIT = re.compile(r'^\d')
+MMAP_SIZE = 64 * 1024 * 1024 # bytes of the store read through mmap
+MAX_AGE = datetime.timedelta(days=2) # refresh the store once it is older than this
+BSE_API_BASE = 'https://api.bseindia.com/BseIndiaAPI/api'
+BSE_LIST_URL = BSE_API_BASE+'/ListofScripData/w?Group=&Scripcode=&industry=&segment=Equity&status=Active'
+BSE_SOURCE_ENV = 'BEANCOUNT_IMPORTERS_INDIA_BSE_SOURCE'
+
+logger = getLogger('beancount_importers_india.bse')
+
+
+class TokenBucket:
+    """Rate limiter shared by threads. Allows bursts of up to `capacity` calls, and `rate` calls per second after"""
+    def __init__(self, rate:float, capacity:Optional[float]=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class _ColumnMapping(Mapping):
+    """Read-only view of one column of the companies table, keyed by another. Queried on access, never loaded"""
+    def __init__(self, store:'BSEStore', key:str, value:Optional[str]):
+        self.store, self.key, self.value = store, key, value
+
+    def __getitem__(self, key):
+        # the first company wins when several share a key (eg. tickers that sanitize alike)
+        row = self.store.execute(f'SELECT * FROM companies WHERE {self.key} = ? ORDER BY rowid LIMIT 1', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self.store.company(row) if self.value is None else row[self.value]
+
+    def __iter__(self):
+        return (row[0] for row in self.store.execute(f'SELECT DISTINCT {self.key} FROM companies ORDER BY {self.key}'))
+
+    def __len__(self):
+        return self.store.execute(f'SELECT COUNT(DISTINCT {self.key}) FROM companies').fetchone()[0]
+
+
+class BSEStore:
+    """The BSE scrip master in SQLite, keeping only the fields the package uses, indexed by ISIN, ticker and
+    sanitized ticker. Opened lazily and read through mmap, so creating a client costs nothing until a lookup.
+    Every thread (eg. the background refresh) reads through its own connection.
+    """
+    def __init__(self, path:Path=None):
+        self.path = Path(path) if path else cache_dir()/'bse.sqlite3'
+        self._local = threading.local()
+        self._version = 0 # bumped by writers, possibly from another thread, so every thread reopens the new file
+
+    def execute(self, sql:str, parameters=()) -> sqlite3.Cursor:
+        if getattr(self._local, 'version', None) != self._version:
+            self.close()
+        if getattr(self._local, 'connection', None) is None:
+            connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+            connection.row_factory = sqlite3.Row
+            connection.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+            self._local.connection, self._local.version = connection, self._version
+        return self._local.connection.execute(sql, parameters)
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def age(self) -> datetime.timedelta:
+        return datetime.date.today() - datetime.datetime.fromtimestamp(self.path.stat().st_mtime).date()
+
+    @staticmethod
+    def company(row:sqlite3.Row) -> dict:
+        return {ISIN_KEY: row['isin'], TICKER_KEY: row['scrip_id'], SCRIP_CODE_KEY: row['scrip_code'], NAME_KEY: row['name']}
+
+    def companies(self) -> list[dict]:
+        if not self.exists():
+            return []
+        return [self.company(row) for row in self.execute('SELECT * FROM companies ORDER BY rowid')]
+
+    def write(self, companies:list[dict], sanitize:Callable[[str], str]):
+        """Replace the store with the given companies. Readers keep seeing the old file until it is swapped in"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix='.tmp')
+        os.close(fd)
+        try:
+            with closing(sqlite3.connect(tmp)) as db:
+                db.execute('CREATE TABLE companies (isin TEXT PRIMARY KEY, scrip_id TEXT, sanitized TEXT, scrip_code TEXT, name TEXT)')
+                db.executemany('INSERT OR REPLACE INTO companies VALUES (?, ?, ?, ?, ?)', [
+                    (c[ISIN_KEY], c[TICKER_KEY], sanitize(c[TICKER_KEY]), str(c.get(SCRIP_CODE_KEY, '')),
+                     c.get(NAME_KEY) or c.get('Scrip_Name'))
+                    for c in companies
+                ])
+                db.execute('CREATE INDEX companies_scrip_id ON companies (scrip_id)')
+                db.execute('CREATE INDEX companies_sanitized ON companies (sanitized)')
+                db.commit()
+            os.replace(tmp, self.path)
+        finally:
+            Path(tmp).unlink(missing_ok=True)
+        self._version += 1
+
+    def close(self):
+        """Close the connection of the calling thread"""
+        if getattr(self._local, 'connection', None) is not None:
+            self._local.connection.close()
+            self._local.connection = None
 
 
 class BSEClient:
     """ A Client to interact with Bombay Stock Exchange, to fetch company data and prices
+
+    The company data lives in a `BSEStore`. Lookups by ISIN, ticker and sanitized ticker are indexed queries, exposed
+    as read-only mappings. When the store is older than 2 days, the `refresh` mode decides what the first lookup does:
+    'background' serves the existing store and refreshes it in a thread, 'sync' refreshes it first, 'never' doesn't
+    (refresh it with `bse-refresh` instead). A missing store is always fetched first.
+
+    Args:
+    source: url or path of a json file of the scrip master, eg. a fixture for working offline.
+        Defaults to $BEANCOUNT_IMPORTERS_INDIA_BSE_SOURCE or the BSE api
+    api_base: base url of the price api, eg. a local stub server in tests
+    max_workers: concurrent price requests of `isins_to_prices`, each with its own pooled connection
+    requests_per_second: rate limit of the price requests, shared by all the workers. None for no limit
+    retries: retries of a price request failing to connect or with a 429/5xx response, with exponential backoff
     """
-    def __init__(self):
+    def __init__(self, store:BSEStore=None, refresh:str='background', source:str=None, api_base:str=BSE_API_BASE,
+                 max_workers:int=8, requests_per_second:Optional[float]=10, retries:int=3):
         self.session = requests.Session()
         self.session.headers.update({
             'referer':'https://www.bseindia.com/',
             'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
             })
-        # We refresh the data if it's older than 2 days
-        if not BSE_DATA.exists() or datetime.date.today() - datetime.datetime.fromtimestamp(BSE_DATA.stat().st_mtime).date() > datetime.timedelta(days=2):
-            # download the data
-            new_data = self._fetch_bse_data()
-            old_data = json.loads(BSE_DATA.read_text()) if BSE_DATA.exists() else []
-            assert isinstance(new_data, list), 'BSE data being downloaded should be list of dicts where each dict contains a single company info'
-            all_entries = {e['ISIN_NUMBER']:e for e in old_data}
-            # copy over new entries to all_entries
-            # this ensures we don't lose any data incase the bse api changes or doesn't return anything
-            for e in new_data:
-                all_entries[e['ISIN_NUMBER']] = e
-            self.bse_data = list(all_entries.values())
-            # write to our local store
-            BSE_DATA.write_text(json.dumps(self.bse_data))
-        else:
-            # load the data
-            with open(BSE_DATA, 'r') as f:
-                self.bse_data = json.load(f)
-        self.bse_isin_to_company = {x['ISIN_NUMBER']: x for x in self.bse_data}
-        self.ticker_to_isin = {x[TICKER_KEY]:x[ISIN_KEY] for x in self.bse_data}
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.api_base = api_base.rstrip('/')
+        self.max_workers = max_workers
+        self.limiter = TokenBucket(requests_per_second) if requests_per_second else None
+        self._store = store or BSEStore()
+        assert refresh in ('background', 'sync', 'never'), f"Unknown refresh mode {refresh}"
+        self.refresh_mode = refresh
+        self.source = source or os.environ.get(BSE_SOURCE_ENV) or BSE_LIST_URL
+        self._checked = False
+        self.refresh_thread = None
+
+    @property
+    def store(self) -> BSEStore:
+        if not self._checked:
+            self._checked = True
+            if not self._store.exists():
+                self.refresh()
+            elif self._store.age() > MAX_AGE and self.refresh_mode == 'sync':
+                self.refresh()
+            elif self._store.age() > MAX_AGE and self.refresh_mode == 'background':
+                # stale while revalidate: lookups keep reading the old file until the new one replaces it
+                self.refresh_thread = threading.Thread(target=self._refresh_in_background, name='bse-refresh', daemon=True)
+                self.refresh_thread.start()
+        return self._store
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning(f"Could not refresh BSE data, using the existing copy: {e}")
+
+    def refresh(self):
+        """Download the scrip master and merge it into the store"""
+        new_data = self._fetch_bse_data()
+        assert isinstance(new_data, list), 'BSE data being downloaded should be list of dicts where each dict contains a single company info'
+        old_data = self._store.companies()
+        if not old_data and BSE_DATA.exists():
+            # migrate the json store of older versions
+            old_data = json.loads(BSE_DATA.read_text())
+        all_entries = {e[ISIN_KEY]:e for e in old_data}
+        # copy over new entries to all_entries
+        # this ensures we don't lose any data incase the bse api changes or doesn't return anything
+        for e in new_data:
+            all_entries[e[ISIN_KEY]] = e
+        self._store.write(list(all_entries.values()), self.sanitize_ticker)
+
+    @property
+    def bse_data(self)->list[dict]:
+        """All the companies. Prefer the mappings below, which don't load the whole store"""
+        return self.store.companies()
+
+    @property
+    def bse_isin_to_company(self)->Mapping[str, dict]:
+        return _ColumnMapping(self.store, 'isin', None)
+
+    @property
+    def ticker_to_isin(self)->Mapping[str, str]:
+        return _ColumnMapping(self.store, 'scrip_id', 'isin')
+
+    @property
+    def sanitized_to_ticker(self)->Mapping[str, str]:
+        """AR-AND-M -> AR&M"""
+        return _ColumnMapping(self.store, 'sanitized', 'scrip_id')
+
+    @property
+    def ticker_to_sanitized(self)->Mapping[str, str]:
+        """AR&M -> AR-AND-M"""
+        return _ColumnMapping(self.store, 'scrip_id', 'sanitized')
+
+    @property
+    def isin_to_scrip_code(self)->Mapping[str, str]:
+        return _ColumnMapping(self.store, 'isin', 'scrip_code')
 
     def isin_to_ticker(self, isin: str) -> str:
         assert isin in self.bse_isin_to_company, f"ISIN {isin} not found in BSE data"
-        return self.sanitize_ticker(self.bse_isin_to_company[isin]['scrip_id'])
+        return self.ticker_to_sanitized[self.bse_isin_to_company[isin][TICKER_KEY]]
     
     def ticker_to_price(self, ticker:str)->float:
         ticker = self.unsanitize_ticker(ticker)
@@ -56,37 +250,59 @@ class BSEClient:
         return self.isin_to_price(self.ticker_to_isin[ticker])
     
     def isin_to_price(self, isin:str)->float:
-        assert isin in self.bse_isin_to_company
-        scrip_code = self.bse_isin_to_company[isin][SCRIP_CODE_KEY]
-        resp = self.session.get(f'https://api.bseindia.com/BseIndiaAPI/api/StockTrading/w?flag=&quotetype=EQ&scripcode={scrip_code}')
+        assert isin in self.isin_to_scrip_code
+        return self._fetch_price(isin, self.isin_to_scrip_code[isin])
+
+    def _fetch_price(self, isin:str, scrip_code:str)->float:
+        if self.limiter:
+            self.limiter.acquire()
+        resp = self.session.get(f'{self.api_base}/StockTrading/w?flag=&quotetype=EQ&scripcode={scrip_code}')
         if resp.status_code != 200:
             raise ValueError(f'Failed to Fetch price for ISIN {isin}. Status code: {resp.status_code}')
         return float(resp.json()[PRICE_KEY])
+
+    def isins_to_prices(self, isins:Iterable[str])->tuple[dict[str, float], dict[str, Exception]]:
+        """Prices of many ISINs, fetched concurrently. Returns ({isin: price}, {isin: error}) for the ones that failed"""
+        prices, errors, scrip_codes = {}, {}, {}
+        # looked up here, since the store connection is not shared with the worker threads
+        for isin in dict.fromkeys(isins):
+            try:
+                scrip_codes[isin] = self.isin_to_scrip_code[isin]
+            except KeyError:
+                errors[isin] = KeyError(f"ISIN {isin} not found in BSE data")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self._fetch_price, isin, code): isin for isin, code in scrip_codes.items()}
+            for future in as_completed(futures):
+                isin = futures[future]
+                try:
+                    prices[isin] = future.result()
+                except Exception as e:
+                    logger.warning(f"Could not fetch the price of {isin}: {e}")
+                    errors[isin] = e
+        return prices, errors
         
     def sanitize_ticker(self, ticker:str)->str:
         """AR&M -> AR-AND-M
         """
-        if re.match('^\d', ticker):
+        if LEADING_DIGIT.match(ticker):
             ticker = 'N-'+ticker
-        ticker = re.sub(r'&', '-AND-', ticker)
-        ticker = re.sub(r' ', '', ticker)
-        return ticker
+        return ticker.replace('&', '-AND-').replace(' ', '')
 
     def unsanitize_ticker(self, ticker:str)->str:
         """AR-AND-M -> AR&M
         """
-        for company in self.bse_data:
-            if self.sanitize_ticker(company[TICKER_KEY]) == ticker:
-                return company[TICKER_KEY]
-        raise ValueError(f"Ticker {ticker} not found in BSE data")
+        try:
+            return self.sanitized_to_ticker[ticker]
+        except KeyError:
+            raise ValueError(f"Ticker {ticker} not found in BSE data")
     
+    def _price_source(self, raw_ticker:str)->str:
+        return 'beancount_importers_india.sources.yahoo_quantized/'+raw_ticker+'.BO'
+
     def ticker_to_price_source(self, ticker:str)->str:
         """ Eg. RELIANCE -> pricehist.beanprice.yahoo/RELIANCE.BO
         """
-        for company in self.bse_data:
-            if self.sanitize_ticker(company[TICKER_KEY]) == ticker:
-                return 'beancount_importers_india.sources.yahoo_quantized/'+company[TICKER_KEY]+'.BO'
-        raise ValueError(f"Ticker {ticker} not found in BSE data")
+        return self._price_source(self.unsanitize_ticker(ticker))
     
     def export_commodity_declaration(self)->str:
         """
@@ -96,10 +312,14 @@ class BSEClient:
             price: "INR:pricehist.beanprice.yahoo/TATAMOTORS.BO"
         ...
         """
-        data = set()
-        for company in self.bse_data:
-            data.add(f"2000-01-01 commodity {self.sanitize_ticker(company[TICKER_KEY])}\n    price: \"INR:{self.ticker_to_price_source(self.sanitize_ticker(company[TICKER_KEY]))}\"")
-        return '\n'.join(data)
+        rows = self.store.execute(
+            'SELECT sanitized, scrip_id FROM companies WHERE rowid IN (SELECT MIN(rowid) FROM companies GROUP BY sanitized) '
+            'ORDER BY sanitized'
+        )
+        return '\n'.join(
+            f"2000-01-01 commodity {sanitized}\n    price: \"INR:{self._price_source(ticker)}\""
+            for sanitized, ticker in rows
+        )
         
     def _fetch_bse_data(self)->list[dict]:
         """Loads the BSE data from the BSE API and returns it as a list of Dict
@@ -120,9 +340,34 @@ class BSEClient:
          'scrip_id': 'ADHIRAJ'}
 
         """
-        resp = self.session.get('https://api.bseindia.com/BseIndiaAPI/api/ListofScripData/w?Group=&Scripcode=&industry=&segment=Equity&status=Active')
-        assert resp.status_code == 200, 'Failed to fetch BSE data.'
-        data = resp.json()
+        if not re.match(r'^https?://', self.source):
+            data = json.loads(Path(self.source).expanduser().read_text())
+        else:
+            resp = self.session.get(self.source)
+            assert resp.status_code == 200, 'Failed to fetch BSE data.'
+            data = resp.json()
         assert isinstance(data, list), 'Returned data is not a list of dict as expected. The api might have changed. try manually'
         return data
 
+
+def refresh_bse_data(source:str=None, store:BSEStore=None) -> BSEStore:
+    """Download the scrip master (or read it from `source`) into the store, now"""
+    client = BSEClient(store=store, refresh='never', source=source)
+    client.refresh()
+    return client._store
+
+
+def main(argv=None):
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Refresh the local copy of the BSE scrip master used to map ISINs to tickers")
+    parser.add_argument('--source', help=f"url or json file to read the scrip list from. Defaults to ${BSE_SOURCE_ENV} or the BSE api")
+    parser.add_argument('--store', help="Path of the SQLite store. Defaults to the package cache directory")
+    args = parser.parse_args(argv)
+
+    store = refresh_bse_data(args.source, BSEStore(args.store) if args.store else None)
+    print(f"{store.path}: {len(BSEClient(store, refresh='never').bse_isin_to_company)} companies", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Persistent cache of extraction results, shared by all the importers.
+
+Table detection with camelot/tabula is the slowest part of an import, and re-running bean-extract over an archive
+repeats it for every statement already seen. Results are pickled to disk, keyed by the sha256 of the file, the importer
+class, the importer version (a hash of its module source and of the shared parsing modules in utils) and a hash of its
+configuration, so editing an importer, the parsers it uses or its config invalidates its entries. The least recently
+used entries are evicted once the cache outgrows `max_size`.
+
+The cache lives in ~/.cache/beancount-importers-india (or $BEANCOUNT_IMPORTERS_INDIA_CACHE_DIR).
+Set BEANCOUNT_IMPORTERS_INDIA_NO_CACHE=1, or call `disable()` from your config, to bypass it.
+"""
+import os
+import sys
+import inspect
+import pickle
+import hashlib
+import functools
+import tempfile
+from pathlib import Path
+from logging import getLogger
+
+logger = getLogger('beancount_importers_india.cache')
+
+CACHE_DIR_ENV = 'BEANCOUNT_IMPORTERS_INDIA_CACHE_DIR'
+NO_CACHE_ENV = 'BEANCOUNT_IMPORTERS_INDIA_NO_CACHE'
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024 # bytes
+# modules of utils the importers parse with, part of every importer's version
+SHARED_MODULES = ['transactions', 'amounts', 'dates', 'pdf']
+_MISSING = object()
+_enabled = True
+
+
+def cache_dir() -> Path:
+    """User cache directory of the package"""
+    if os.environ.get(CACHE_DIR_ENV):
+        return Path(os.environ[CACHE_DIR_ENV])
+    return Path(os.environ.get('XDG_CACHE_HOME') or Path.home()/'.cache')/'beancount-importers-india'
+
+
+def enabled() -> bool:
+    return _enabled and not os.environ.get(NO_CACHE_ENV)
+
+
+def disable():
+    """Bypass the cache for the rest of the run"""
+    global _enabled
+    _enabled = False
+
+
+def file_sha256(filename:str) -> str:
+    """sha256 of the file contents. Also usable as a `_FileMemo` converter"""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def shared_version() -> str:
+    """Hash of the source of the shared parsing modules"""
+    utils = Path(__file__).parent
+    return hashlib.sha256(''.join(file_sha256(utils/f'{name}.py') for name in SHARED_MODULES).encode()).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def importer_version(cls:type) -> str:
+    """Hash of the source of the module defining the importer and of the shared parsing modules.
+    Changes whenever the importer or the parsers it shares are edited
+    """
+    try:
+        own = file_sha256(inspect.getsourcefile(cls))
+    except (TypeError, OSError):
+        own = cls.__module__
+    return hashlib.sha256(f'{own}\0{shared_version()}'.encode()).hexdigest()
+
+
+def config_hash(importer) -> str:
+    """Hash of the plain (str, number, list, dict...) attributes of the importer, i.e. its constructor config"""
+    plain = (str, int, float, bool, type(None), list, tuple, dict, set)
+    config = sorted((k, repr(v)) for k, v in vars(importer).items() if isinstance(v, plain))
+    return hashlib.sha256(repr(config).encode()).hexdigest()
+
+
+def _rename_entries(entries:list, old_name:str, new_name:str):
+    """Point entries cached for a file at another path with the same contents"""
+    old_document, new_document = Path(old_name).name, Path(new_name).name
+    for entry in entries:
+        meta = getattr(entry, 'meta', None) or {}
+        if meta.get('filename') == old_name:
+            meta['filename'] = new_name
+        for m in [meta] + [p.meta for p in getattr(entry, 'postings', []) if p.meta]:
+            if m.get('document') == old_document:
+                m['document'] = new_document
+
+
+class ExtractionCache:
+    """A directory of pickled results, evicted least recently used first once it grows beyond `max_size` bytes"""
+    def __init__(self, directory=None, max_size:int=DEFAULT_MAX_SIZE):
+        self.directory = Path(directory) if directory else cache_dir()/'extract'
+        self.max_size = max_size
+        self._size = None # bytes of the entries, scanned on the first put and kept up to date by this process
+
+    def key(self, importer, file, name:str='extract') -> str:
+        cls = type(importer)
+        sha256 = file.convert(file_sha256) if hasattr(file, 'convert') else file_sha256(file.name)
+        parts = [sha256, f'{cls.__module__}.{cls.__qualname__}', importer_version(cls), config_hash(importer), name]
+        return hashlib.sha256('\0'.join(parts).encode()).hexdigest()
+
+    def content_key(self, filename:str, *parts) -> str:
+        """Key of a result that only depends on the file contents and `parts`, like the tables found in it"""
+        return hashlib.sha256('\0'.join([file_sha256(filename)] + [repr(p) for p in parts]).encode()).hexdigest()
+
+    def _path(self, key:str) -> Path:
+        return self.directory/f'{key}.pkl'
+
+    def get(self, key:str, default=None):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path) # mark as recently used
+            return value
+        except FileNotFoundError:
+            return default
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache entry {path}: {e}")
+            return default
+
+    def put(self, key:str, value):
+        tmp = None
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True, mode=0o700)
+            # write to a temporary file first so a concurrent reader never sees a partial pickle
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            if self._size is None:
+                self._size = self.size()
+            path = self._path(key)
+            replaced = path.stat().st_size if path.exists() else 0
+            self._size += os.path.getsize(tmp) - replaced
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.warning(f"Could not cache {key}: {e}")
+            if tmp:
+                Path(tmp).unlink(missing_ok=True)
+            return
+        # the directory is only scanned when the running total says the cache outgrew max_size
+        if self._size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in max_size"""
+        entries = []
+        for e in os.scandir(self.directory):
+            if e.name.endswith('.pkl'):
+                stat = e.stat()
+                entries.append((stat.st_mtime, stat.st_size, e.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            Path(path).unlink(missing_ok=True)
+            total -= size
+        self._size = total
+
+    def clear(self):
+        if self.directory.exists():
+            for path in self.directory.glob('*.pkl'):
+                path.unlink(missing_ok=True)
+        self._size = None
+
+    def size(self) -> int:
+        return sum(p.stat().st_size for p in self.directory.glob('*.pkl')) if self.directory.exists() else 0
+
+
+@functools.lru_cache(maxsize=None)
+def default_cache() -> ExtractionCache:
+    """The cache shared by all the importers of the package"""
+    return ExtractionCache()
+
+
+def cached(method):
+    """Decorator for importer methods taking a file (like `extract`) that caches their result across runs"""
+    @functools.wraps(method)
+    def wrapper(self, file, *args, **kwargs):
+        if not enabled():
+            return method(self, file, *args, **kwargs)
+        cache = default_cache()
+        key = cache.key(self, file, method.__name__)
+        hit = cache.get(key, _MISSING)
+        if hit is not _MISSING:
+            name, result = hit
+            if name != file.name and isinstance(result, list):
+                _rename_entries(result, name, file.name)
+            return result
+        result = method(self, file, *args, **kwargs)
+        cache.put(key, (file.name, result))
+        return result
+    return wrapper
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Inspect or clear the extraction cache")
+    parser.add_argument('--clear', action='store_true', help="Delete all cached results")
+    args = parser.parse_args()
+
+    cache = default_cache()
+    if args.clear:
+        cache.clear()
+    print(f"{cache.directory}: {cache.size()/(1024*1024):.1f} MiB", file=sys.stderr)
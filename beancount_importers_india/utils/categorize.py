@@ -0,0 +1,215 @@
+"""
+Rule based categorization of imported transactions.
+
+The importers emit transactions with a single posting, to the statement's account. A `Categorizer` adds the other
+posting (and optionally a payee and tags) from a list of `Rule`s, the first matching rule winning. Rules match on
+  * substrings of the payee and narration, eg. 'swiggy', found together for all rules by an Aho-Corasick automaton,
+  * regexes. Those starting with a literal (like 'uber\\s*trip') are only run when the automaton found the literal,
+    the others are combined into a single regex run once over the text,
+  * UPI VPAs like 'merchant@okicici', looked up in a dict for every VPA in the narration,
+  * and a range of the (signed) amount, checked only for the rules whose text matched.
+So each transaction costs one pass over its text, however many rules there are. Install `pyahocorasick` for a faster
+automaton; a pure python one is used otherwise.
+
+    RULES = [
+        Rule('Expenses:Food', substring='swiggy', tags={'food'}),
+        Rule('Expenses:Rent', vpa='landlord@okhdfcbank', payee='Landlord'),
+        Rule('Expenses:Travel', regex=r'uber|ola\\s*cabs', max_amount=0),
+    ]
+    ingest(CONFIG, hooks=[dedup.find_duplicate_entries, Categorizer(RULES).hook])
+
+Define RULES in the config passed to `batch` and it is applied too. Rule hits are counted in `Categorizer.hits`.
+"""
+import re
+from collections import Counter
+from decimal import Decimal
+from typing import Iterable, NamedTuple, Optional
+from logging import getLogger
+from beancount.core import data
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+logger = getLogger('beancount_importers_india.categorize')
+
+VPA_RE = re.compile(r'[\w.\-]+@[a-z][a-z0-9]+', re.IGNORECASE)
+# characters of a regex that only match themselves
+LITERAL_RE = re.compile(r'[A-Za-z0-9 _/@\-]+')
+MIN_ANCHOR = 3 # shorter literals would match too many texts to be worth it
+
+
+def literal_prefix(regex:str) -> Optional[str]:
+    """A literal every match of the regex starts with, or None"""
+    if '|' in regex:
+        return None
+    match = LITERAL_RE.match(regex)
+    if not match:
+        return None
+    prefix = match.group()
+    if regex[len(prefix):len(prefix)+1] in ('?', '*', '{', '+'):
+        # the quantifier applies to the last character only
+        prefix = prefix[:-1]
+    return prefix if len(prefix) >= MIN_ANCHOR else None
+
+
+class Rule(NamedTuple):
+    account: str # the posting added to the matching transactions
+    substring: Optional[str] = None # in the payee or narration, ignoring case
+    regex: Optional[str] = None # searched in the payee and narration, ignoring case. don't use numbered backreferences
+    vpa: Optional[str] = None # UPI id in the narration, ignoring case
+    min_amount: Optional[Decimal] = None # of the statement's posting, -ve for money going out
+    max_amount: Optional[Decimal] = None
+    payee: Optional[str] = None # set on matching transactions without a payee
+    tags: frozenset = frozenset()
+
+
+class _Automaton:
+    """Pure python Aho-Corasick automaton, for when pyahocorasick isn't installed"""
+    def __init__(self, patterns:Iterable[tuple[str, int]]):
+        self.goto = [{}]
+        self.outputs = [[]]
+        for pattern, value in patterns:
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.outputs.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.outputs[state].append(value)
+        # failure links, breadth first
+        self.fail = [0] * len(self.goto)
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    def values(self, text:str) -> set[int]:
+        """Values of all the patterns found in the text"""
+        found = set()
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+        return found
+
+
+def _automaton(patterns:list[tuple[str, int]]):
+    if ahocorasick is None:
+        return _Automaton(patterns)
+    automaton = ahocorasick.Automaton()
+    by_pattern = {}
+    for pattern, value in patterns:
+        by_pattern.setdefault(pattern, []).append(value)
+    for pattern, values in by_pattern.items():
+        automaton.add_word(pattern, values)
+    automaton.make_automaton()
+    return automaton
+
+
+class Categorizer:
+    def __init__(self, rules:Iterable[Rule]):
+        self.rules = list(rules)
+        self.hits = Counter() # rule index -> number of transactions categorized by it
+        # the automaton finds the substrings (value i) and the literal prefixes of the regexes (value -1-i)
+        patterns = [(r.substring.casefold(), i) for i, r in enumerate(self.rules) if r.substring]
+        self.anchored = {}
+        unanchored = []
+        for i, rule in enumerate(self.rules):
+            if rule.regex and (anchor := literal_prefix(rule.regex)):
+                patterns.append((anchor.casefold(), -1-i))
+                self.anchored[i] = re.compile(rule.regex, re.IGNORECASE)
+            elif rule.regex:
+                unanchored.append(i)
+        self.automaton = _automaton(patterns) if patterns else None
+        self.vpas = {}
+        for i, rule in enumerate(self.rules):
+            if rule.vpa:
+                self.vpas.setdefault(rule.vpa.casefold(), []).append(i)
+        # the other regexes in a lookahead each, so the scan reports the first rule matching at each position.
+        # the scan is slow, so it only runs on the texts the same regexes without groups find a match in
+        parts, self.regex_groups = [], {}
+        for i in unanchored:
+            self.regex_groups[1 + sum(re.compile(p).groups for p in parts)] = i
+            parts.append(f'(?=({self.rules[i].regex}))')
+        self.regex = re.compile('|'.join(parts), re.IGNORECASE) if parts else None
+        self.regex_filter = re.compile('|'.join(f'(?:{self.rules[i].regex})' for i in unanchored), re.IGNORECASE) if parts else None
+        self.unanchored = unanchored
+
+    def _text_matches(self, text:str) -> set[int]:
+        """Indices of the rules whose substring, VPA or regex is in the text"""
+        folded = text.casefold()
+        found = set()
+        if isinstance(self.automaton, _Automaton):
+            found = self.automaton.values(folded)
+        elif self.automaton is not None:
+            for _, values in self.automaton.iter(folded):
+                found.update(values)
+        matched = {i for i in found if i >= 0}
+        matched.update(-1-i for i in found if i < 0 and self.anchored[-1-i].search(text))
+        for vpa in VPA_RE.findall(folded):
+            matched.update(self.vpas.get(vpa, ()))
+        if self.regex is not None and self.regex_filter.search(text):
+            matched.update(self.regex_groups[m.lastindex] for m in self.regex.finditer(text) if m.lastindex)
+        return matched
+
+    def _amount_matches(self, rule:Rule, number:Optional[Decimal]) -> bool:
+        if rule.min_amount is None and rule.max_amount is None:
+            return True
+        if number is None:
+            return False
+        return ((rule.min_amount is None or number >= Decimal(str(rule.min_amount)))
+                and (rule.max_amount is None or number <= Decimal(str(rule.max_amount))))
+
+    def match(self, entry:data.Transaction) -> Optional[int]:
+        """Index of the first rule matching the transaction, or None"""
+        text = f'{entry.payee or ""}\n{entry.narration or ""}'
+        units = entry.postings[0].units if entry.postings else None
+        number = units.number if units is not None and isinstance(units.number, Decimal) else None
+        matched = self._text_matches(text)
+        for i in sorted(matched):
+            if self._amount_matches(self.rules[i], number):
+                return i
+        # the scan only reports the first regex at each position. if it failed on the amount, a later one may not
+        if any(i in self.regex_groups.values() for i in matched):
+            for i in self.unanchored:
+                if i not in matched and self._amount_matches(self.rules[i], number) and re.search(self.rules[i].regex, text, re.IGNORECASE):
+                    return i
+        return None
+
+    def categorize(self, entry:data.Directive) -> data.Directive:
+        """The transaction with the posting, payee and tags of its rule. Only single posting transactions are changed"""
+        if not isinstance(entry, data.Transaction) or len(entry.postings) != 1:
+            return entry
+        i = self.match(entry)
+        if i is None:
+            return entry
+        self.hits[i] += 1
+        rule = self.rules[i]
+        return entry._replace(
+            payee=entry.payee or rule.payee,
+            tags=(entry.tags or frozenset()) | frozenset(rule.tags),
+            postings=entry.postings + [data.Posting(rule.account, None, None, None, None, None)],
+        )
+
+    def categorize_all(self, entries:Iterable[data.Directive]) -> list[data.Directive]:
+        return [self.categorize(entry) for entry in entries]
+
+    def hook(self, new_entries_list:list, existing_entries:Optional[list]=None) -> list:
+        """bean-extract hook categorizing the entries of every file"""
+        return [(key, self.categorize_all(entries)) for key, entries in new_entries_list]
+
+    def report(self) -> list[tuple[Rule, int]]:
+        """Every rule with the number of transactions it categorized, most used first"""
+        return sorted(((rule, self.hits[i]) for i, rule in enumerate(self.rules)), key=lambda hit: -hit[1])
@@ -0,0 +1,143 @@
+"""
+Finds the imported transactions that are already in the ledger, in constant time per transaction.
+
+bean-extract's default hook compares every new entry with every existing one, which doesn't scale to a large ledger.
+`DuplicateIndex` hashes the existing transactions once per run instead, by
+  * the ids PhonePe gives every transaction (`phonepe_txn_id`, `phonepe_bank_ref`) with the account,
+  * the other references the importers put in the metadata (`transaction_ref`, `Cheque_number`) with the account and
+    amount, bucketed by date, since those repeat (eg. BOI's is the narration),
+  * and the (account, amount) of every posting, bucketed by date so a match a few days apart is found too.
+A new transaction is a duplicate if it shares a PhonePe id with an existing one, if one of its postings shares a
+reference and amount with one within `window_days` of it, or if every posting with an amount has a match within
+`window_days`. Every existing posting matches at most one new one, so two payments of the same
+amount on the same day aren't both taken as the one already in the ledger.
+
+    from beancount_importers_india.utils import dedup
+    ingest(CONFIG, hooks=[dedup.find_duplicate_entries])  # in place of bean-extract's default hook
+"""
+import datetime
+from collections import defaultdict
+from typing import Iterable, Optional
+from beancount.core import data
+from beancount.core.number import MISSING
+from beancount.ingest.extract import DUPLICATE_META
+
+# metadata holding an identifier of the transaction given by the bank or the app
+REFERENCE_META = ['transaction_ref', 'phonepe_bank_ref', 'phonepe_txn_id', 'Cheque_number']
+# those unique to a transaction, matched whatever the date and amount
+UNIQUE_REFERENCE_META = ['phonepe_txn_id', 'phonepe_bank_ref']
+EMPTY_REFERENCES = {'', '-', 'nan', 'None'}
+WINDOW_DAYS = 3 # posting dates differ between statements, eg. card transaction and posting dates
+
+
+def _amount_postings(entry:data.Transaction) -> list[data.Posting]:
+    return [
+        p for p in entry.postings
+        if p.units is not None and p.units is not MISSING and p.units.number is not MISSING and p.units.number is not None
+    ]
+
+
+def _references(entry:data.Transaction) -> tuple[set, list]:
+    # (account, reference) of the unique references, and (posting, reference) of the others.
+    # a reference in the transaction's meta belongs to all its postings
+    unique, others = set(), []
+    for posting in _amount_postings(entry):
+        references = set()
+        for meta in (posting.meta, entry.meta):
+            for key in REFERENCE_META:
+                value = str((meta or {}).get(key, '')).strip()
+                if value in EMPTY_REFERENCES:
+                    continue
+                if key in UNIQUE_REFERENCE_META:
+                    unique.add((posting.account, value))
+                else:
+                    references.add(value)
+        others.extend((posting, reference) for reference in sorted(references))
+    return unique, others
+
+
+class DuplicateIndex:
+    def __init__(self, entries:Iterable[data.Directive]=(), window_days:int=WINDOW_DAYS):
+        self.window_days = window_days
+        self.references = set()
+        # (account, number, currency, date bucket) -> dates of the postings not yet matched
+        self.postings = defaultdict(list)
+        # (account, reference, number, currency, date bucket) -> dates of the postings with the reference
+        self.referenced_postings = defaultdict(list)
+        for entry in entries:
+            self.add(entry)
+
+    def _bucket(self, date:datetime.date) -> int:
+        # a date within the window of another is at most one bucket away
+        return date.toordinal() // (self.window_days + 1)
+
+    def _key(self, posting:data.Posting, reference:Optional[str]=None) -> tuple:
+        if reference is None:
+            return (posting.account, posting.units.number, posting.units.currency)
+        return (posting.account, reference, posting.units.number, posting.units.currency)
+
+    def add(self, entry:data.Directive):
+        if not isinstance(entry, data.Transaction):
+            return
+        unique, others = _references(entry)
+        self.references.update(unique)
+        for posting, reference in others:
+            self.referenced_postings[self._key(posting, reference) + (self._bucket(entry.date),)].append(entry.date)
+        for posting in _amount_postings(entry):
+            self.postings[self._key(posting) + (self._bucket(entry.date),)].append(entry.date)
+
+    def _find(self, index:dict, key:tuple, date:datetime.date, taken:set=frozenset()) -> Optional[tuple]:
+        # (key, index) of an unmatched existing posting within the window, not in taken
+        bucket = self._bucket(date)
+        for b in (bucket, bucket - 1, bucket + 1):
+            bucket_key = key + (b,)
+            for i, existing in enumerate(index.get(bucket_key, ())):
+                if abs((existing - date).days) <= self.window_days and (bucket_key, i) not in taken:
+                    return bucket_key, i
+        return None
+
+    def is_duplicate(self, entry:data.Directive) -> bool:
+        """True if the entry is in the index. Its matching postings are then taken out of the index"""
+        if not isinstance(entry, data.Transaction):
+            return False
+        unique, others = _references(entry)
+        if self.references & unique:
+            return True
+        for posting, reference in others:
+            match = self._find(self.referenced_postings, self._key(posting, reference), entry.date)
+            if match is not None:
+                key, i = match
+                self.referenced_postings[key].pop(i)
+                return True
+        postings = _amount_postings(entry)
+        if not postings:
+            return False
+        taken = set()
+        for posting in postings:
+            match = self._find(self.postings, self._key(posting), entry.date, taken)
+            if match is None:
+                return False
+            taken.add(match)
+        for key, i in sorted(taken, key=lambda match: -match[1]):
+            self.postings[key].pop(i)
+        return True
+
+
+def mark_duplicates(entries:list[data.Directive], index:DuplicateIndex, drop:bool=False) -> list[data.Directive]:
+    """The entries with those in the index marked as duplicates (commented out by bean-extract), or dropped.
+    Only the existing entries the index was built from are matched, never the other new entries, so repeated
+    transactions of a statement (eg. two rides of the same fare) are all kept.
+    """
+    marked = []
+    for entry in entries:
+        if not index.is_duplicate(entry):
+            marked.append(entry)
+        elif not drop:
+            marked.append(entry._replace(meta={**entry.meta, DUPLICATE_META: True}))
+    return marked
+
+
+def find_duplicate_entries(new_entries_list:list, existing_entries:Optional[list]) -> list:
+    """Drop-in for the hook of the same name in `beancount.ingest.extract`. Builds the index once per call"""
+    index = DuplicateIndex(existing_entries or [])
+    return [(key, mark_duplicates(entries, index)) for key, entries in new_entries_list]
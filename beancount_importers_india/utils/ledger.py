@@ -0,0 +1,137 @@
+"""
+A cached snapshot of the ledger, for the features that look at it while importing (duplicates, lots, categories).
+
+`loader.load_file` parses every included file, then runs the booking, the plugins and the validations, which takes
+tens of seconds on a large ledger and used to be repeated every run. The importers only need the transactions, so
+`load_snapshot` parses each file of the ledger on its own (without booking or plugins), keeps a slim copy of its
+transactions (date, payee, narration, the postings with an amount and the reference metadata) and caches it on disk
+by the file's contents. The next run only parses the files that changed, and reads the others from the cache.
+
+    entries = ledger.load_snapshot('main.beancount')
+    python -m beancount_importers_india.utils.ledger main.beancount  # build the snapshot ahead of an import
+
+Postings keep their cost spec as written (eg. `{}` for a sell), since nothing is booked.
+"""
+import os
+import gc
+import glob
+from contextlib import contextmanager
+from typing import NamedTuple
+from logging import getLogger
+from beancount.core import data
+from beancount.core.number import MISSING
+from beancount.parser import parser
+from beancount_importers_india.utils.cache import default_cache, enabled as cache_enabled
+from beancount_importers_india.utils.dedup import REFERENCE_META
+
+logger = getLogger('beancount_importers_india.ledger')
+
+SNAPSHOT_VERSION = 1 # bump when the slim entries change
+# metadata kept in the snapshot, besides the position in the file
+KEPT_META = ['filename', 'lineno', 'document'] + REFERENCE_META
+
+# snapshots of the files parsed by this process, by (path, mtime, size)
+_snapshots = {}
+
+
+class FileSnapshot(NamedTuple):
+    entries: list # slim transactions of the file
+    includes: list[str] # absolute paths of the files it includes, globs expanded
+
+
+def _slim_meta(meta:dict) -> dict:
+    return {key: meta[key] for key in KEPT_META if meta and key in meta}
+
+
+def slim(entry:data.Transaction) -> data.Transaction:
+    """The transaction without the postings that have no amount and without metadata the importers don't use"""
+    return entry._replace(
+        meta=_slim_meta(entry.meta),
+        postings=[
+            posting._replace(meta=_slim_meta(posting.meta) or None)
+            for posting in entry.postings if posting.units is not None and posting.units is not MISSING
+        ],
+    )
+
+
+def _parse(path:str) -> FileSnapshot:
+    entries, errors, options_map = parser.parse_file(path)
+    if errors:
+        logger.warning(f"{len(errors)} errors parsing {path}, eg. {errors[0].message}")
+    directory = os.path.dirname(path)
+    includes = []
+    for pattern in options_map['include']:
+        includes.extend(sorted(glob.glob(os.path.join(directory, pattern))))
+    return FileSnapshot([slim(e) for e in entries if isinstance(e, data.Transaction)], includes)
+
+
+@contextmanager
+def _gc_paused():
+    # parsing or unpickling a ledger creates millions of objects, which would trigger the cyclic gc over and over
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def file_snapshot(path:str) -> FileSnapshot:
+    """The snapshot of a single file, from the cache if the file didn't change"""
+    stat = os.stat(path)
+    memo_key = (path, stat.st_mtime_ns, stat.st_size)
+    if memo_key not in _snapshots:
+        with _gc_paused():
+            _snapshots[memo_key] = _load(path)
+    return _snapshots[memo_key]
+
+
+def _load(path:str) -> FileSnapshot:
+    if cache_enabled():
+        cache = default_cache()
+        key = cache.content_key(path, 'ledger', SNAPSHOT_VERSION)
+        snapshot = cache.get(key)
+        if snapshot is None:
+            snapshot = _parse(path)
+            cache.put(key, snapshot)
+    else:
+        snapshot = _parse(path)
+    return snapshot
+
+
+def ledger_files(path:str) -> list[str]:
+    """The ledger file and all the files it includes, recursively, in the order they are included"""
+    files, pending = [], [os.path.abspath(path)]
+    while pending:
+        file = pending.pop(0)
+        if file in files:
+            continue
+        files.append(file)
+        pending.extend(file_snapshot(file).includes)
+    return files
+
+
+def load_snapshot(path:str) -> list[data.Transaction]:
+    """Slim transactions of the ledger and all its includes, sorted like beancount sorts them"""
+    files = ledger_files(path)
+    with _gc_paused():
+        entries = [entry for file in files for entry in file_snapshot(file).entries]
+        entries.sort(key=data.entry_sortkey)
+    return entries
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from argparse import ArgumentParser
+    # the package's module rather than __main__, so the cached snapshots can be unpickled by the importers
+    from beancount_importers_india.utils.ledger import load_snapshot, ledger_files
+
+    arg_parser = ArgumentParser(description="Build (or refresh) the snapshot of a ledger used while importing")
+    arg_parser.add_argument("ledger")
+    args = arg_parser.parse_args()
+
+    start = time.time()
+    entries = load_snapshot(args.ledger)
+    print(f"{len(entries)} transactions from {len(ledger_files(args.ledger))} files in {time.time()-start:.2f}s", file=sys.stderr)
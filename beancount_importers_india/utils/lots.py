@@ -0,0 +1,164 @@
+"""
+FIFO booking of the sells of many contract notes at once.
+
+The Groww importer writes sells with an empty cost (`-7 INDNIPPON {} @ 700 INR`) and an empty capital gains posting,
+leaving beancount to find the lots with FIFO booking over the whole ledger. When a year of notes is imported at once,
+`LotBook` books them here instead: it walks the trades in date order, keeps a FIFO queue of the open lots of every
+holding account, and rewrites each sell into one posting per lot it closes, with the lot's cost, and fills in the
+realized gains. The notes are still parsed in parallel by `batch`, only the booking is serial.
+
+    python -m beancount_importers_india.batch config.py ~/Downloads/contract_notes --book-lots --existing main.beancount
+
+Sells of units that are not in the queues (eg. bought before the `existing` ledger starts) are left for beancount.
+"""
+from collections import deque
+from decimal import Decimal
+from typing import Iterable, NamedTuple, Optional
+from logging import getLogger
+from beancount.core import amount, data
+from beancount.core.number import MISSING
+from beancount.core.inventory import Inventory
+from beancount.ingest.extract import DUPLICATE_META
+
+logger = getLogger('beancount_importers_india.lots')
+
+
+class Lot(NamedTuple):
+    units: Decimal # open units, always positive
+    cost: Decimal # per unit
+    currency: str # of the cost
+    date: object # acquisition date, datetime.date
+
+
+def _missing(value) -> bool:
+    # the importers leave numbers to interpolate as None, the parser as MISSING
+    return value is None or value is MISSING or getattr(value, 'number', None) is MISSING
+
+
+class LotBook:
+    """Open lots of the sub-accounts of `holding_account`, oldest first"""
+    def __init__(self, holding_account:str, capital_gains_account:str):
+        self.holding_account = holding_account
+        self.capital_gains_account = capital_gains_account
+        self.lots:dict[str, deque[Lot]] = {}
+
+    def is_holding(self, account:str) -> bool:
+        return account.startswith(self.holding_account + ':')
+
+    def seed(self, entries:Iterable[data.Directive]):
+        """Opens the lots still held at the end of the ledger's entries. Either booked by the loader, or as written
+        (eg. from `ledger.load_snapshot`), in which case they are booked here
+        """
+        inventories:dict[str, Inventory] = {}
+        unbooked = []
+        for entry in entries:
+            if not isinstance(entry, data.Transaction):
+                continue
+            for posting in entry.postings:
+                if self.is_holding(posting.account) and isinstance(posting.cost, data.Cost):
+                    inventories.setdefault(posting.account, Inventory()).add_position(posting)
+            if any(self.is_holding(p.account) and isinstance(p.cost, data.CostSpec) for p in entry.postings):
+                unbooked.append(entry)
+        for account, inventory in inventories.items():
+            positions = sorted((p for p in inventory if p.units.number > 0), key=lambda p: p.cost.date)
+            self.lots[account] = deque(
+                Lot(p.units.number, p.cost.number, p.cost.currency, p.cost.date) for p in positions
+            )
+        self.book_all(unbooked)
+
+    def _close(self, account:str, units:Decimal) -> tuple[list[tuple[Decimal, Lot]], Decimal]:
+        # (units taken, lot) for the oldest lots covering units, and the units not covered by any lot
+        queue = self.lots.get(account, deque())
+        taken = []
+        while units > 0 and queue:
+            lot = queue[0]
+            take = min(units, lot.units)
+            taken.append((take, lot))
+            units -= take
+            if take == lot.units:
+                queue.popleft()
+            else:
+                queue[0] = lot._replace(units=lot.units - take)
+        return taken, units
+
+    def _close_lot(self, account:str, units:Decimal, cost:data.CostSpec):
+        # a sell of a given lot, eg. booked by a previous run. the oldest matching lot is reduced
+        queue = self.lots.get(account, deque())
+        for i, lot in enumerate(queue):
+            if lot.cost == cost.number_per and (_missing(cost.date) or lot.date == cost.date):
+                take = min(units, lot.units)
+                if take == lot.units:
+                    del queue[i]
+                else:
+                    queue[i] = lot._replace(units=lot.units - take)
+                units -= take
+                break
+        if units > 0:
+            self._close(account, units)
+
+    def book(self, entry:data.Directive) -> data.Directive:
+        """The entry with its sells booked against the open lots. Buys open new lots. Call in date order"""
+        # duplicates of entries in the ledger are already in the lots it was seeded with
+        if not isinstance(entry, data.Transaction) or DUPLICATE_META in entry.meta:
+            return entry
+        postings, gains, unbooked = [], {}, set()
+        for posting in entry.postings:
+            if not self.is_holding(posting.account) or _missing(posting.units):
+                postings.append(posting)
+                continue
+            units, ticker, cost = posting.units.number, posting.units.currency, posting.cost
+            if units > 0 and isinstance(cost, data.CostSpec) and not _missing(cost.number_per):
+                self.lots.setdefault(posting.account, deque()).append(
+                    Lot(units, cost.number_per, cost.currency, entry.date if _missing(cost.date) else cost.date)
+                )
+                postings.append(posting)
+            elif units < 0 and isinstance(cost, data.CostSpec) and _missing(cost.number_per) and not _missing(posting.price):
+                taken, remaining = self._close(posting.account, -units)
+                for take, lot in taken:
+                    postings.append(posting._replace(
+                        units=amount.Amount(-take, ticker),
+                        cost=data.CostSpec(lot.cost, None, lot.currency, lot.date, None, False),
+                    ))
+                    gain = take * (posting.price.number - lot.cost)
+                    gains[ticker] = amount.add(gains[ticker], amount.Amount(gain, posting.price.currency)) \
+                        if ticker in gains else amount.Amount(gain, posting.price.currency)
+                if remaining:
+                    logger.warning(f"{entry.date} {posting.account}: no open lots for {remaining} of the units sold, left for beancount to book")
+                    postings.append(posting._replace(units=amount.Amount(-remaining, ticker)))
+                    unbooked.add(ticker)
+            elif units < 0 and isinstance(cost, data.CostSpec):
+                self._close_lot(posting.account, -units, cost)
+                postings.append(posting)
+            else:
+                postings.append(posting)
+
+        # realized gains go to the (empty) capital gains posting of the ticker, unless beancount still has to book some
+        for i, posting in enumerate(postings):
+            ticker = posting.account[len(self.capital_gains_account)+1:]
+            if (posting.account.startswith(self.capital_gains_account + ':') and _missing(posting.units)
+                    and ticker in gains and ticker not in unbooked):
+                postings[i] = posting._replace(units=-gains[ticker])
+        return entry._replace(postings=postings)
+
+    def book_all(self, entries:Iterable[data.Directive]) -> list[data.Directive]:
+        """Books the entries in date order, returned in their original order"""
+        entries = list(entries)
+        booked = list(entries)
+        for i in sorted(range(len(entries)), key=lambda i: entries[i].date):
+            booked[i] = self.book(entries[i])
+        return booked
+
+
+def book_lots(entries:list[data.Directive], importers:list, existing_entries:Optional[list]=None) -> list[data.Directive]:
+    """Books the entries with a `LotBook` for every importer that has a holding and capital gains account"""
+    accounts = []
+    for importer in importers:
+        importer = getattr(importer, 'importer', importer) # routed importers
+        holding = getattr(importer, 'holding_account', None)
+        gains = getattr(importer, 'capital_gains_account', None)
+        if holding and gains and (holding, gains) not in accounts:
+            accounts.append((holding, gains))
+            book = LotBook(holding, gains)
+            book.seed(existing_entries or [])
+            entries = book.book_all(entries)
+    return entries
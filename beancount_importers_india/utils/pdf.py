@@ -0,0 +1,293 @@
+"""
+Shared access to the contents of a pdf statement.
+
+Every importer used to open the pdf on its own, with pdfplumber to identify it, again per page to find the table
+and once more with pdfminer for the layout of each page. A `PdfSession` opens the document once per file and password,
+and memoizes everything the importers ask of it (text, words, lines, layout boxes, ruled and camelot tables).
+Sessions live on beancount's `_FileMemo`, so identify, the balance parsers and extract all share the same one.
+Unencrypted files get a single session whatever the password, so importers with different passwords share it too.
+
+Password protected files are decrypted once per file and password with pypdf, into a private directory (on tmpfs
+when available) that is removed at exit. pdfplumber, camelot, tabula and pdf2txt.py all read the decrypted copy, from
+`PdfSession.decrypted_path`, instead of each decrypting the file again. Worker processes reuse the same copies.
+
+Large statements can be sharded by page across worker processes with `map_pages` (for the pdfplumber parsers) and
+`PdfSession.tables` (for camelot), each worker opening its own session. Set BEANCOUNT_IMPORTERS_INDIA_PAGE_WORKERS=1
+to parse on a single core.
+"""
+import os
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+from typing import Callable, Iterable, NamedTuple, Optional
+import pandas as pd
+import pdfplumber
+from pdfminer.layout import LAParams, LTTextBoxHorizontal
+from pdfminer.converter import PDFPageAggregator
+from pdfminer.pdfinterp import PDFPageInterpreter
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdfdocument import PDFDocument, PDFPasswordIncorrect
+from beancount_importers_india.utils.cache import ExtractionCache, enabled as cache_enabled, file_sha256
+
+
+PAGE_WORKERS_ENV = 'BEANCOUNT_IMPORTERS_INDIA_PAGE_WORKERS'
+MIN_PAGES_PER_WORKER = 4 # smaller shards cost more in process startup than they save
+_page_workers = None
+DECRYPT_DIR_ENV = 'BEANCOUNT_IMPORTERS_INDIA_DECRYPT_DIR'
+_decrypt_dir = None
+# pdfplumber settings for tables whose cells are all bordered by lines
+RULED_TABLE_SETTINGS = {'vertical_strategy': 'lines', 'horizontal_strategy': 'lines'}
+# line_margin=0 makes pdfminer put every text line in its own box, which is what the table parsers expect
+LAYOUT_PARAMS = {'line_margin': 0}
+
+
+def page_workers() -> int:
+    """Number of processes a single document is sharded across"""
+    if _page_workers is not None:
+        return _page_workers
+    return int(os.environ.get(PAGE_WORKERS_ENV) or os.cpu_count() or 1)
+
+
+def set_page_workers(workers:int):
+    """Eg. set to 1 when files are already processed in parallel, to not oversubscribe the cores"""
+    global _page_workers
+    _page_workers = workers
+
+
+def _shards(page_numbers:list[int]) -> list[list[int]]:
+    """Splits the pages into contiguous shards, one per worker"""
+    workers = min(page_workers(), len(page_numbers) // MIN_PAGES_PER_WORKER)
+    if workers <= 1:
+        return [page_numbers]
+    size = -(-len(page_numbers) // workers)
+    return [page_numbers[i:i+size] for i in range(0, len(page_numbers), size)]
+
+
+class Table(NamedTuple):
+    """A camelot table reduced to what the importers use, so it can be sent between processes and cached"""
+    page: int
+    df: pd.DataFrame
+
+
+class PdfSession:
+    """A pdf opened once and parsed on demand. Results are memoized per page."""
+    def __init__(self, path:str, password:Optional[str]=None):
+        self.path = path
+        self.password = password
+        self._decrypted_path = None
+        self._pdf = None
+        self._memo = {}
+
+    @property
+    def decrypted_path(self) -> str:
+        """Path of the pdf to hand to other libraries, without a password. The file itself if it is not encrypted"""
+        if self._decrypted_path is None:
+            self._decrypted_path = decrypt(self.path, self.password) if pdf_is_encrypted(self.path) else self.path
+        return self._decrypted_path
+
+    @property
+    def pdf(self) -> pdfplumber.PDF:
+        if self._pdf is None:
+            # without layout analysis, which only `layout_boxes` needs. text, words and tables come from the chars
+            self._pdf = pdfplumber.open(self.decrypted_path)
+        return self._pdf
+
+    @property
+    def pages(self) -> list:
+        return self.pdf.pages
+
+    @property
+    def num_pages(self) -> int:
+        return len(self.pages)
+
+    def _memoized(self, key, compute):
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+    def text(self, page_number:int=0) -> str:
+        return self._memoized(('text', page_number), lambda: self.pages[page_number].extract_text())
+
+    def text_lines(self, page_number:int=0) -> list[dict]:
+        return self._memoized(('text_lines', page_number), lambda: self.pages[page_number].extract_text_lines())
+
+    def words(self, page_number:int=0) -> list[dict]:
+        return self._memoized(('words', page_number), lambda: self.pages[page_number].extract_words())
+
+    def lines(self, page_number:int=0) -> list[dict]:
+        return self.pages[page_number].lines
+
+    def layout_boxes(self, page_number:int=0) -> list[LTTextBoxHorizontal]:
+        """pdfminer text boxes of the page, one per line of text"""
+        return self._memoized(
+            ('layout_boxes', page_number),
+            lambda: [e for e in self._analyzed_layout(page_number) if isinstance(e, LTTextBoxHorizontal)]
+        )
+
+    def _analyzed_layout(self, page_number:int):
+        # the page laid out by pdfminer with LAYOUT_PARAMS, like pdf2txt.py does
+        page = self.pages[page_number]
+        device = PDFPageAggregator(self.pdf.rsrcmgr, pageno=page.page_number, laparams=LAParams(**LAYOUT_PARAMS))
+        PDFPageInterpreter(self.pdf.rsrcmgr, device).process_page(page.page_obj)
+        return device.get_result()
+
+    def layout_text(self, page_number:int=0) -> str:
+        """Text of the page in the layout `pdf2txt.py` prints it"""
+        return self._memoized(
+            ('layout_text', page_number),
+            lambda: ''.join(box.get_text() for box in self.layout_boxes(page_number))
+        )
+
+    def contains(self, needles:Iterable[str]) -> bool:
+        """True if all the needles are in the text of the document.
+        Pages are read in order only until every needle is found, which is usually the first page.
+        """
+        remaining = set(needles)
+        for page_number in range(self.num_pages):
+            if not remaining:
+                break
+            text = self.layout_text(page_number)
+            remaining = {needle for needle in remaining if needle not in text}
+        return not remaining
+
+    def ruled_tables(self, page_numbers:Optional[Iterable[int]]=None) -> list[Table]:
+        """Tables of the pages (all by default) drawn with ruling lines, in page order, like camelot's lattice flavor.
+        Cells are found from pdfplumber's line and rect geometry and filled with the chars inside them, so unlike
+        lattice nothing is rasterized. Multi-line cells keep their '\\n' and empty or merged cells are ''.
+        """
+        page_numbers = tuple(range(self.num_pages) if page_numbers is None else page_numbers)
+        return self._memoized(
+            ('ruled_tables', page_numbers),
+            lambda: [table for tables in map_pages(_ruled_page_tables, self, page_numbers) for table in tables]
+        )
+
+    def tables(self, pages:str='1', cache:Optional[ExtractionCache]=None, **kwargs) -> list[Table]:
+        """camelot tables of the document, in page order. kwargs are passed to `camelot.read_pdf`.
+        With pages='all', large documents are split into page ranges read by worker processes.
+        With a `cache`, tables are also kept on disk by file contents, to be shared across runs (eg. bean-file and
+        bean-extract).
+        """
+        key = ('tables', pages, tuple(sorted((k, repr(v)) for k, v in kwargs.items())))
+        return self._memoized(key, lambda: self._cached_tables(pages, kwargs, cache))
+
+    def _cached_tables(self, pages:str, kwargs:dict, cache:Optional[ExtractionCache]) -> list[Table]:
+        if cache is None or not cache_enabled():
+            return self._read_tables(pages, kwargs)
+        disk_key = cache.content_key(self.path, 'camelot', pages, sorted(kwargs.items()))
+        tables = cache.get(disk_key)
+        if tables is None:
+            tables = self._read_tables(pages, kwargs)
+            cache.put(disk_key, tables)
+        return tables
+
+    def _read_tables(self, pages:str, kwargs:dict) -> list[Table]:
+        shards = _shards(list(range(1, self.num_pages+1))) if pages == 'all' else [None]
+        if len(shards) == 1:
+            return _camelot_tables(self.decrypted_path, pages, kwargs)
+        page_ranges = [f'{shard[0]}-{shard[-1]}' for shard in shards]
+        decrypt_dir() # created here, so it is removed when this process exits
+        with ProcessPoolExecutor(len(shards)) as pool:
+            results = pool.map(_camelot_tables, *zip(*[(self.decrypted_path, r, kwargs) for r in page_ranges]))
+            return [table for tables in results for table in tables]
+
+
+def _camelot_tables(path:str, pages:str, kwargs:dict) -> list[Table]:
+    import camelot
+    return [Table(int(t.page), t.df) for t in camelot.read_pdf(path, pages=pages, **kwargs)]
+
+
+def _ruled_page_tables(session:PdfSession, page_number:int) -> list[Table]:
+    tables = session.pages[page_number].extract_tables(RULED_TABLE_SETTINGS)
+    return [
+        Table(page_number+1, pd.DataFrame([[cell or '' for cell in row] for row in rows]))
+        for rows in tables if rows
+    ]
+
+
+def _map_shard(func:Callable, path:str, password:Optional[str], page_numbers:list[int]) -> list:
+    # runs in a worker process, which has its own session of the document
+    session = PdfSession(path, password)
+    return [func(session, i) for i in page_numbers]
+
+
+def map_pages(func:Callable, session:PdfSession, page_numbers:Optional[Iterable[int]]=None) -> list:
+    """`func(session, page_number)` for every page (all by default), returned in page order and memoized on the session.
+    Large documents are sharded across worker processes, so func must be a module level (picklable) function.
+    """
+    page_numbers = tuple(range(session.num_pages) if page_numbers is None else page_numbers)
+    return session._memoized(('map_pages', func, page_numbers), lambda: _map_pages(func, session, list(page_numbers)))
+
+
+def _map_pages(func:Callable, session:PdfSession, page_numbers:list[int]) -> list:
+    shards = _shards(page_numbers)
+    if len(shards) == 1:
+        return [func(session, i) for i in page_numbers]
+    decrypt_dir() # created here, so it is removed when this process exits
+    with ProcessPoolExecutor(len(shards)) as pool:
+        results = pool.map(_map_shard, *zip(*[(func, session.path, session.password, shard) for shard in shards]))
+        return [result for shard_results in results for result in shard_results]
+
+
+def pdf_is_encrypted(filename:str) -> bool:
+    """Reads only the trailer of the pdf to check if it is encrypted"""
+    with open(filename, 'rb') as fp:
+        try:
+            return PDFDocument(PDFParser(fp)).encryption is not None
+        except PDFPasswordIncorrect:
+            return True
+
+
+def decrypt_dir() -> Path:
+    """Private directory for the decrypted copies of this run, removed at exit by the process that created it.
+    Call it before starting worker processes, so they share (and don't each leave behind) the parent's directory
+    """
+    global _decrypt_dir
+    if _decrypt_dir is None:
+        if os.environ.get(DECRYPT_DIR_ENV) and os.path.isdir(os.environ[DECRYPT_DIR_ENV]):
+            # created by the parent process
+            _decrypt_dir = Path(os.environ[DECRYPT_DIR_ENV])
+        else:
+            # on tmpfs, decrypted statements never touch the disk
+            base = '/dev/shm' if os.access('/dev/shm', os.W_OK) else None
+            _decrypt_dir = Path(tempfile.mkdtemp(prefix='beancount-importers-india-', dir=base)) # mode 0700
+            os.environ[DECRYPT_DIR_ENV] = str(_decrypt_dir)
+            # unlike atexit handlers, finalizers also run when a pool worker exits, in case a worker created the dir
+            Finalize(None, shutil.rmtree, args=(_decrypt_dir,), kwargs={'ignore_errors': True}, exitpriority=0)
+    return _decrypt_dir
+
+
+def decrypt(path:str, password:Optional[str]) -> str:
+    """Path of a decrypted copy of the pdf. Decrypted only once per file and password"""
+    from pypdf import PdfReader, PdfWriter
+
+    key = hashlib.sha256(f'{file_sha256(path)}\0{password or ""}'.encode()).hexdigest()
+    target = decrypt_dir()/f'{key}.pdf'
+    if target.exists():
+        return str(target)
+    reader = PdfReader(path)
+    if not reader.decrypt(password or ''):
+        raise PDFPasswordIncorrect(f"Incorrect password for {path}")
+    # write to a temporary file first so a concurrent worker never reads a partial copy
+    fd, tmp = tempfile.mkstemp(dir=target.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        PdfWriter(clone_from=reader).write(f)
+    os.replace(tmp, target)
+    return str(target)
+
+
+def _pdf_sessions(filename:str) -> dict:
+    # converter for _FileMemo.convert. The memo keeps one dict of sessions (keyed by password) per file
+    return {}
+
+
+def get_pdf_session(file, password:Optional[str]=None) -> PdfSession:
+    """Returns the session of the file for the given password, creating it on first use"""
+    sessions = file.convert(_pdf_sessions)
+    if password is not None and not file.convert(pdf_is_encrypted):
+        password = None
+    if password not in sessions:
+        sessions[password] = PdfSession(file.name, password)
+    return sessions[password]
@@ -0,0 +1,203 @@
+"""
+Routes each file to the importers that could possibly identify it.
+
+Every importer's `identify` used to run on every file, each opening (and decrypting) pdfs on its own. A `Router`
+takes a cheap fingerprint of the file once (kind, size, encryption flag and the text of the first page, or the head of
+csv/html files) and hands the file to the importers whose kind matches. Of those, an importer is only dropped when none
+of its needles (`lines_to_grep`, `strings_to_match`, `name_in_file`, or the last 4 digits of `account_number`/`last_4`)
+is in all the text its `identify` looks at: the first page of a pdf, or a text file read whole. Importers whose
+`identify` scans every page (`WHOLE_DOCUMENT_IMPORTERS`) or that read more than the head of a text file are always
+candidates. The candidates still run their full `identify`, so routing only saves work, it doesn't change what gets
+imported.
+
+    CONFIG = routing.routed([importer1, importer2, ...])  # in a bean-extract config
+"""
+import os
+import mimetypes
+from pathlib import Path
+from typing import NamedTuple, Optional
+from logging import getLogger
+from beancount_importers_india.utils.pdf import get_pdf_session, pdf_is_encrypted
+
+logger = getLogger('beancount_importers_india.routing')
+
+# kinds of files read by the importers of the package, by importer class
+IMPORTER_FILE_KINDS = {
+    'beancount_importers_india.Axis.creditcard.email_statement.AxisCreditCardEmailImporter': {'pdf'},
+    'beancount_importers_india.BOI.BOI_enquiry_statement_docx.Importer': {'docx'},
+    'beancount_importers_india.canara.savings.email.CanaraSavingsEmailStatementImporter': {'pdf'},
+    'beancount_importers_india.GROWW.contract_note.GrowwContractNoteImporter': {'pdf'},
+    'beancount_importers_india.HDFC.creditcard.HDFCCreditCardEmailStatementImporter': {'pdf'},
+    'beancount_importers_india.HDFC.savings.HDFCEmailStatementImporter': {'pdf'},
+    'beancount_importers_india.ICICI.creditcard.email_statement.ICICICreditCardEmailStatementImporter': {'pdf'},
+    'beancount_importers_india.ICICI.creditcard.excel_yearly.Importer': {'xls'},
+    'beancount_importers_india.ICICI.savings.csv_monthly.Importer': {'csv'},
+    'beancount_importers_india.ICICI.savings.email_statement.ICICISavingsEmailImporter': {'pdf'},
+    'beancount_importers_india.ICICI.savings.netbanking_xls.IciciSavingImporter': {'xls'},
+    'beancount_importers_india.PayTM.Importer': {'pdf'},
+    'beancount_importers_india.PhonePe.mail_archive.PhonePeMailboxImporter': {'mbox'},
+    'beancount_importers_india.PhonePe.transaction_email.PhonePeTransactionEmailImporter': {'html'},
+    'beancount_importers_india.SBI.Importer': {'pdf'},
+    'beancount_importers_india.SBI.email_statements.SBIEmailStatementImporter': {'pdf'},
+}
+# importers whose identify finds their needles on any page of a pdf, so the first page can't rule them out
+WHOLE_DOCUMENT_IMPORTERS = {
+    'beancount_importers_india.canara.savings.email.CanaraSavingsEmailStatementImporter',
+    'beancount_importers_india.GROWW.contract_note.GrowwContractNoteImporter',
+    'beancount_importers_india.HDFC.savings.HDFCEmailStatementImporter',
+    'beancount_importers_india.PayTM.Importer',
+    'beancount_importers_india.SBI.Importer',
+    'beancount_importers_india.SBI.email_statements.SBIEmailStatementImporter',
+}
+# importer attributes matched as is, and those of which only the last 4 digits are printed in statements
+TEXT_NEEDLES = ['lines_to_grep', 'strings_to_match', 'name_in_file']
+NUMBER_NEEDLES = ['account_number', 'accountNumber', 'last_4', 'last_four']
+HEAD_SIZE = 64 * 1024 # bytes of text files read for the fingerprint
+
+
+class Fingerprint(NamedTuple):
+    kind: str # pdf, csv, xls, docx, html or the file extension
+    size: int
+    encrypted: bool
+    text: Optional[str] # normalized text of the first page or the head of the file. None if not readable
+    complete: bool = False # True if text is the whole of a text file
+
+
+def _normalize(text:str) -> str:
+    # needles are matched ignoring case and whitespace, since pdf text extraction is loose with both
+    return ''.join(text.split()).casefold()
+
+
+def file_kind(filename:str) -> str:
+    extension = Path(filename).suffix.lower().lstrip('.')
+    mime = mimetypes.guess_type(filename)[0]
+    if mime == 'application/pdf':
+        return 'pdf'
+    if extension in ('xls', 'xlsx'):
+        return 'xls'
+    if mime == 'text/html' or extension in ('html', 'htm'):
+        return 'html'
+    return extension
+
+
+def fingerprint(filename:str) -> Fingerprint:
+    """Cheap summary of the file. Also usable as a `_FileMemo` converter"""
+    kind = file_kind(filename)
+    encrypted, text, complete = False, None, False
+    size = os.path.getsize(filename)
+    try:
+        if kind == 'pdf':
+            encrypted = pdf_is_encrypted(filename)
+        elif kind in ('csv', 'html', 'txt', 'eml'):
+            with open(filename, 'rb') as f:
+                text = _normalize(f.read(HEAD_SIZE).decode('utf-8', errors='ignore'))
+            complete = size <= HEAD_SIZE
+    except Exception as e:
+        logger.debug(f"Could not fingerprint {filename}: {e}")
+    return Fingerprint(kind, size, encrypted, text, complete)
+
+
+def _class_names(importer) -> list[str]:
+    return [f'{cls.__module__}.{cls.__qualname__}' for cls in type(importer).__mro__]
+
+
+def importer_kinds(importer) -> Optional[set]:
+    """Kinds of files the importer reads, or None if unknown (eg. importers from other packages)"""
+    for name in _class_names(importer):
+        kinds = IMPORTER_FILE_KINDS.get(name)
+        if kinds is not None:
+            return kinds
+    return None
+
+
+def reads_whole_document(importer) -> bool:
+    """True if the importer's identify looks for its needles on every page of a pdf"""
+    return any(name in WHOLE_DOCUMENT_IMPORTERS for name in _class_names(importer))
+
+
+def importer_needles(importer) -> list[str]:
+    """Normalized strings of which at least one is in every file the importer identifies"""
+    needles = []
+    for name in TEXT_NEEDLES:
+        value = getattr(importer, name, None)
+        for v in ([value] if isinstance(value, str) else value or []):
+            needles.append(_normalize(str(v)))
+    for name in NUMBER_NEEDLES:
+        value = getattr(importer, name, None)
+        if value is not None and str(value).strip():
+            needles.append(_normalize(str(value))[-4:])
+    return [n for n in needles if n]
+
+
+class Router:
+    """Picks the candidate importers of a file from the fingerprint of the file"""
+    def __init__(self, importers:list):
+        self.importers = list(importers)
+        unwrapped = [importer.importer if isinstance(importer, RoutedImporter) else importer for importer in self.importers]
+        self.kinds = [importer_kinds(importer) for importer in unwrapped]
+        self.needles = [importer_needles(importer) for importer in unwrapped]
+        self.whole_document = [reads_whole_document(importer) for importer in unwrapped]
+
+    def _first_page_text(self, file, password:Optional[str]) -> Optional[str]:
+        try:
+            # the session is shared with the importers' identify and extract, so this parse is not wasted
+            return _normalize(get_pdf_session(file, password).text(0))
+        except Exception:
+            return None
+
+    def _route(self, file) -> list:
+        print_ = file.convert(fingerprint)
+        by_kind = [i for i, kinds in enumerate(self.kinds) if kinds is None or print_.kind in kinds]
+        if print_.kind == 'pdf' and not print_.encrypted:
+            text = self._first_page_text(file, None)
+            texts = {i: text for i in by_kind}
+        elif print_.kind == 'pdf':
+            # decrypt once per distinct password rather than once per importer
+            passwords = {i: getattr(self.importers[i], 'password', None) for i in by_kind}
+            by_password = {password: self._first_page_text(file, password) for password in set(passwords.values())}
+            texts = {i: by_password[passwords[i]] for i in by_kind}
+        else:
+            # only the whole of the file can prove a needle absent
+            texts = {i: print_.text if print_.complete else None for i in by_kind}
+
+        candidates = []
+        for i in by_kind:
+            if texts[i] is None or not self.needles[i] or self.kinds[i] is None or self.whole_document[i]:
+                # nothing proves the needles absent from what identify looks at; let it decide
+                candidates.append(i)
+            elif any(needle in texts[i] for needle in self.needles[i]):
+                candidates.append(i)
+        return candidates
+
+    def candidates(self, file) -> list:
+        """The importers that could identify the file, in their configured order"""
+        routes = file.convert(_routes)
+        if id(self) not in routes:
+            routes[id(self)] = self._route(file)
+        return [self.importers[i] for i in routes[id(self)]]
+
+
+def _routes(filename:str) -> dict:
+    # converter for _FileMemo.convert. Candidates of the file for each router
+    return {}
+
+
+class RoutedImporter:
+    """Wraps an importer so that its identify only runs on files routed to it"""
+    def __init__(self, importer, router:Router):
+        self.importer = importer
+        self.router = router
+
+    def identify(self, file) -> bool:
+        if not any(candidate is self.importer for candidate in self.router.candidates(file)):
+            return False
+        return self.importer.identify(file)
+
+    def __getattr__(self, name):
+        return getattr(self.importer, name)
+
+
+def routed(importers:list) -> list:
+    """The importers wrapped to share one router. Use in place of the CONFIG list of a bean-extract config"""
+    router = Router(importers)
+    return [RoutedImporter(importer, router) for importer in importers]
@@ -0,0 +1,94 @@
+"""
+Builds beancount transactions from a normalized DataFrame of statement rows.
+
+Every importer used to walk its table with `df.iterrows()`, converting and cleaning each cell on the way, which is
+slow for multi-year statements with tens of thousands of rows. Importers now prepare whole columns (date, narration,
+signed amount and optional metadata) and `build_transactions` zips them into single posting Transactions in one loop.
+"""
+from pathlib import Path
+from typing import Iterable, Optional
+import pandas as pd
+from beancount.core import amount
+from beancount.core import flags
+from beancount.core import data
+
+# columns of the normalized DataFrame
+DATE = 'date'
+NARRATION = 'narration'
+AMOUNT = 'amount' # signed Decimal, -ve for money going out of the account
+PAYEE = 'payee'
+
+
+def to_dates(values:pd.Series) -> pd.Series:
+    """datetime64 columns to `datetime.date`. Columns that already hold dates are returned as is"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.date
+    return values
+
+
+def _isempty(value) -> bool:
+    return value is None or (isinstance(value, float) and value != value) or (isinstance(value, str) and not value.strip())
+
+
+def _metas(df:pd.DataFrame, columns:Optional[dict]) -> Iterable[dict]:
+    """One dict of metadata per row, from {meta key: column}. Empty values are skipped"""
+    if not columns:
+        return iter(lambda: {}, None) # endless fresh dicts
+    keys = list(columns)
+    rows = zip(*[df[column].tolist() for column in columns.values()])
+    return ({k: v for k, v in zip(keys, row) if not _isempty(v)} for row in rows)
+
+
+def build_transactions(
+    df:pd.DataFrame,
+    filename:str,
+    account:str,
+    currency:str='INR',
+    meta_columns:Optional[dict]=None,
+    posting_meta_columns:Optional[dict]=None,
+    document:Optional[str]='posting',
+    extra_postings:Iterable[tuple[str, str]]=(),
+    tags:Optional[set]=None,
+    flag:str=flags.FLAG_OKAY,
+) -> list[data.Transaction]:
+    """A Transaction per row of df, with a posting of the signed AMOUNT to `account`.
+
+    Args:
+    df: has DATE, NARRATION and AMOUNT columns, and optionally PAYEE. The index is used as the line number
+    meta_columns / posting_meta_columns: {meta key: column} copied to the transaction / posting metadata
+    document: add the file name as `document` metadata to the 'posting' or the 'txn', or None to skip it
+    extra_postings: (account, column) pairs. A posting of the column's amount is added when it is non zero
+    """
+    document_name = Path(filename).name
+    dates = to_dates(df[DATE]).tolist()
+    narrations = df[NARRATION].tolist()
+    payees = df[PAYEE].tolist() if PAYEE in df.columns else [None]*len(df)
+    numbers = df[AMOUNT].tolist()
+    extras = [(extra_account, df[column].tolist()) for extra_account, column in extra_postings]
+    txn_metas = _metas(df, meta_columns)
+    posting_metas = _metas(df, posting_meta_columns)
+
+    entries = []
+    for i, (lineno, date, narration, payee, number, txn_meta, posting_meta) in enumerate(
+            zip(df.index.tolist(), dates, narrations, payees, numbers, txn_metas, posting_metas)):
+        meta = data.new_metadata(filename, lineno)
+        meta.update(txn_meta)
+        if document == 'txn':
+            meta['document'] = document_name
+        elif document == 'posting':
+            posting_meta['document'] = document_name
+        postings = [data.Posting(account, amount.Amount(number, currency), None, None, None, posting_meta or None)]
+        for extra_account, extra_numbers in extras:
+            if not _isempty(extra_numbers[i]) and extra_numbers[i] != 0:
+                postings.append(data.Posting(extra_account, amount.Amount(extra_numbers[i], currency), None, None, None, None))
+        entries.append(data.Transaction(
+            meta=meta,
+            date=date,
+            flag=flag,
+            payee=None if _isempty(payee) else payee,
+            narration=narration,
+            tags=set(tags) if tags else set(),
+            links=set(),
+            postings=postings,
+        ))
+    return entries
@@ -18,5 +18,10 @@ setup(
     license='GPLv3',
     long_description=long_description,
     python_requires='>3.8.0',
-    install_requires=requirements
+    install_requires=requirements,
+    entry_points={
+        'console_scripts': [
+            'bse-refresh=beancount_importers_india.utils.bse:main',
+        ],
+    },
 )
@@ -0,0 +1,27 @@
+from decimal import Decimal
+import pandas as pd
+import pytest
+from beancount_importers_india.utils import amounts
+
+
+def decimals(*values):
+    return [Decimal(v) for v in values]
+
+
+@pytest.mark.parametrize('values', [[-500.0, 100.0], ['-500', '100']])
+def test_default_sign_keeps_explicit_negatives(values):
+    # numbers from an xls and strings from a pdf follow the same rule
+    assert list(amounts.parse_amounts(pd.Series(values), default_sign=-1)) == decimals('-500', '-100')
+    assert list(amounts.parse_amounts(pd.Series(values))) == decimals('-500', '100')
+
+
+def test_markers_and_grouping():
+    values = pd.Series(['1,23,456.78 Cr', '₹ 500 Dr', '(20)', 'Rs. +30', ''])
+    assert list(amounts.parse_amounts(values, default_sign=-1, empty=amounts.ZERO)) == \
+        decimals('123456.78', '-500', '-20', '30', '0')
+
+
+def test_not_an_amount():
+    with pytest.raises(ValueError):
+        amounts.parse_amounts(pd.Series(['abc']))
+    assert list(amounts.parse_amounts(pd.Series(['abc', '5']), errors='coerce')) == [None, Decimal(5)]
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import threading
+import pytest
+import requests
+from beancount_importers_india.utils import bse
+
+COMPANIES = [
+    {'scrip_id': 'AR&M', 'ISIN_NUMBER': 'INE001', 'SCRIP_CD': '500001', 'SCRIP_NAME': 'AR and M'},
+    {'scrip_id': 'RELIANCE', 'ISIN_NUMBER': 'INE002', 'SCRIP_CD': '500325', 'SCRIP_NAME': 'Reliance'},
+]
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.payload, self.status_code = payload, status_code
+
+    def json(self):
+        return self.payload
+
+
+@pytest.fixture(autouse=True)
+def no_network(monkeypatch):
+    def get(*args, **kwargs):
+        raise AssertionError(f"unexpected request {args}")
+    monkeypatch.setattr(requests.Session, 'get', get)
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path/'scrips.json'
+    path.write_text(json.dumps(COMPANIES))
+    return path
+
+
+def make_stale(store, days=10):
+    old = time.time() - days * 24 * 3600
+    os.utime(store.path, (old, old))
+
+
+def test_bse_refresh_from_json(source, tmp_path, capsys):
+    store_path = tmp_path/'bse.sqlite3'
+    bse.main(['--source', str(source), '--store', str(store_path)])
+    assert '2 companies' in capsys.readouterr().err
+    client = bse.BSEClient(bse.BSEStore(store_path), refresh='never')
+    assert client.isin_to_ticker('INE001') == 'AR-AND-M'
+    assert client.unsanitize_ticker('AR-AND-M') == 'AR&M'
+    assert client.isin_to_scrip_code['INE002'] == '500325'
+
+
+def test_refresh_keeps_companies_missing_from_the_source(source, tmp_path):
+    store = bse.refresh_bse_data(str(source), bse.BSEStore(tmp_path/'bse.sqlite3'))
+    source.write_text(json.dumps(COMPANIES[1:]))
+    bse.refresh_bse_data(str(source), store)
+    assert sorted(bse.BSEClient(store, refresh='never').bse_isin_to_company) == ['INE001', 'INE002']
+
+
+def test_fresh_store_is_not_refreshed(source, tmp_path):
+    store = bse.refresh_bse_data(str(source), bse.BSEStore(tmp_path/'bse.sqlite3'))
+    source.write_text(json.dumps(COMPANIES + [{'scrip_id': 'NEW', 'ISIN_NUMBER': 'INE003', 'SCRIP_CD': '3'}]))
+    client = bse.BSEClient(bse.BSEStore(store.path), refresh='sync', source=str(source))
+    assert 'INE003' not in client.bse_isin_to_company
+    assert client.refresh_thread is None
+
+
+@pytest.mark.parametrize('mode', ['sync', 'background', 'never'])
+def test_stale_store(source, tmp_path, mode):
+    store = bse.refresh_bse_data(str(source), bse.BSEStore(tmp_path/'bse.sqlite3'))
+    make_stale(store)
+    assert store.age() > bse.MAX_AGE
+    source.write_text(json.dumps(COMPANIES + [{'scrip_id': 'NEW', 'ISIN_NUMBER': 'INE003', 'SCRIP_CD': '3'}]))
+    client = bse.BSEClient(bse.BSEStore(store.path), refresh=mode, source=str(source))
+    companies = client.bse_isin_to_company
+    if mode == 'background':
+        # the stale copy is served while the refresh runs
+        client.refresh_thread.join()
+    assert ('INE003' in companies) == (mode != 'never')
+    assert (client.store.age() <= bse.MAX_AGE) == (mode != 'never')
+
+
+def test_missing_store_is_fetched_first(source, tmp_path):
+    client = bse.BSEClient(bse.BSEStore(tmp_path/'bse.sqlite3'), refresh='never', source=str(source))
+    assert client.ticker_to_isin['RELIANCE'] == 'INE002'
+
+
+def test_threads_read_through_their_own_connections(source, tmp_path):
+    store = bse.refresh_bse_data(str(source), bse.BSEStore(tmp_path/'bse.sqlite3'))
+    assert len(store.companies()) == 2
+    companies = []
+    thread = threading.Thread(target=lambda: companies.extend(store.companies()))
+    thread.start()
+    thread.join()
+    # a connection shared across threads would have raised in the thread
+    assert len(companies) == 2
+    source.write_text(json.dumps(COMPANIES + [{'scrip_id': 'NEW', 'ISIN_NUMBER': 'INE003', 'SCRIP_CD': '3'}]))
+    thread = threading.Thread(target=bse.refresh_bse_data, args=(str(source), store))
+    thread.start()
+    thread.join()
+    # the file written by the other thread is reopened
+    assert len(store.companies()) == 3
+
+
+def test_isins_to_prices(source, tmp_path, monkeypatch):
+    store = bse.refresh_bse_data(str(source), bse.BSEStore(tmp_path/'bse.sqlite3'))
+    client = bse.BSEClient(store, refresh='never', requests_per_second=None)
+    urls = []
+
+    def get(url, *args, **kwargs):
+        urls.append(url)
+        if url.endswith('scripcode=500001'):
+            return FakeResponse({}, status_code=503)
+        return FakeResponse({bse.PRICE_KEY: '2950.5'})
+    monkeypatch.setattr(client.session, 'get', get)
+
+    prices, errors = client.isins_to_prices(['INE002', 'INE001', 'INE002', 'INE999'])
+    assert prices == {'INE002': 2950.5}
+    assert set(errors) == {'INE001', 'INE999'}
+    # one request per known ISIN, however many times it is asked for
+    assert len(urls) == 2
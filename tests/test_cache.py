@@ -0,0 +1,97 @@
+import os
+import pytest
+from beancount_importers_india.utils import cache
+
+
+# accounts of the importers whose extract ran. kept off the importer, since its attributes are its config
+calls = []
+
+
+class Importer:
+    def __init__(self, account='Assets:Bank'):
+        self.account = account
+
+    @cache.cached
+    def extract(self, file, existing_entries=None):
+        calls.append(self.account)
+        return [self.account]
+
+
+class File:
+    def __init__(self, name):
+        self.name = name
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv(cache.CACHE_DIR_ENV, str(tmp_path))
+    monkeypatch.delenv(cache.NO_CACHE_ENV, raising=False)
+    calls.clear()
+    cache.default_cache.cache_clear()
+    yield tmp_path
+    cache.default_cache.cache_clear()
+
+
+@pytest.fixture
+def statement(tmp_path):
+    path = tmp_path/'statement.pdf'
+    path.write_bytes(b'%PDF statement')
+    return path
+
+
+def test_results_are_cached_by_contents_and_config(statement, tmp_path):
+    importer = Importer()
+    assert importer.extract(File(str(statement))) == ['Assets:Bank']
+    assert importer.extract(File(str(statement))) == ['Assets:Bank']
+    assert calls == ['Assets:Bank']
+    # the same contents under another name are a hit
+    copy = tmp_path/'copy.pdf'
+    copy.write_bytes(statement.read_bytes())
+    importer.extract(File(str(copy)))
+    assert calls == ['Assets:Bank']
+    # other contents or another config are a miss
+    statement.write_bytes(b'%PDF other statement')
+    importer.extract(File(str(statement)))
+    other = Importer('Assets:Other')
+    assert other.extract(File(str(copy))) == ['Assets:Other']
+    assert calls == ['Assets:Bank', 'Assets:Bank', 'Assets:Other']
+
+
+def test_version_covers_the_shared_parsers(monkeypatch, tmp_path):
+    before = cache.importer_version(Importer)
+    utils = tmp_path/'utils'
+    utils.mkdir()
+    for name in cache.SHARED_MODULES:
+        (utils/f'{name}.py').write_text(f'# {name} edited\n')
+    monkeypatch.setattr(cache, '__file__', str(utils/'cache.py'))
+    cache.shared_version.cache_clear()
+    cache.importer_version.cache_clear()
+    try:
+        assert cache.importer_version(Importer) != before
+    finally:
+        monkeypatch.undo()
+        cache.shared_version.cache_clear()
+        cache.importer_version.cache_clear()
+    assert cache.importer_version(Importer) == before
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    store = cache.ExtractionCache(tmp_path/'extract', max_size=2500)
+    for i in range(3):
+        store.put(f'k{i}', b'x' * 1000)
+        os.utime(store._path(f'k{i}'), (i, i))
+    # k0 is the oldest, and the cache only fits two entries
+    assert store.get('k0') is None
+    assert store.get('k1') == b'x' * 1000
+    store.put('k3', b'x' * 1000)
+    assert store.get('k2') is None and store.get('k3') is not None
+    assert store.size() <= 2500
+
+
+def test_eviction_scans_only_when_over_the_limit(tmp_path, monkeypatch):
+    store = cache.ExtractionCache(tmp_path/'extract', max_size=10**6)
+    scans = []
+    monkeypatch.setattr(store, 'evict', lambda: scans.append(1))
+    for i in range(50):
+        store.put(f'k{i}', i)
+    assert scans == []
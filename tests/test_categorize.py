@@ -0,0 +1,96 @@
+import datetime
+from decimal import Decimal
+import pytest
+from beancount.core import amount, data
+from beancount_importers_india.utils import categorize
+from beancount_importers_india.utils.categorize import Categorizer, Rule
+
+
+@pytest.fixture(params=['pure python', 'pyahocorasick'], autouse=True)
+def automaton(request, monkeypatch):
+    if request.param == 'pure python':
+        monkeypatch.setattr(categorize, 'ahocorasick', None)
+    elif categorize.ahocorasick is None:
+        pytest.skip('pyahocorasick is not installed')
+    return request.param
+
+
+def transaction(narration:str, number:str='-150', payee=None, postings=1) -> data.Transaction:
+    posting = data.Posting('Liabilities:Card', amount.Amount(Decimal(number), 'INR'), None, None, None, None)
+    other = data.Posting('Expenses:Other', None, None, None, None, None)
+    return data.Transaction(
+        {'filename': 'statement.pdf', 'lineno': 0}, datetime.date(2024, 1, 1), '*', payee, narration,
+        frozenset(), frozenset(), [posting, other][:postings],
+    )
+
+
+def account(categorizer:Categorizer, entry:data.Transaction):
+    categorized = categorizer.categorize(entry)
+    return categorized.postings[-1].account if len(categorized.postings) > len(entry.postings) else None
+
+
+def test_pure_python_automaton_finds_overlapping_patterns():
+    automaton = categorize._Automaton([('he', 0), ('she', 1), ('his', 2), ('hers', 3)])
+    assert automaton.values('ushers') == {0, 1, 3}
+    assert automaton.values('xyz') == set()
+
+
+def test_literal_prefix():
+    assert categorize.literal_prefix(r'uber\s*trip') == 'uber'
+    assert categorize.literal_prefix('swiggy?') == 'swigg'
+    assert categorize.literal_prefix('ola|uber') is None
+    assert categorize.literal_prefix(r'\d+ rides') is None
+
+
+@pytest.mark.parametrize('rules, expected', [
+    # substrings, anchored regexes and unanchored regexes: the first rule in the list wins whatever its kind
+    ([Rule('Expenses:Substring', substring='uber'), Rule('Expenses:Regex', regex=r'uber\s*trip')], 'Expenses:Substring'),
+    ([Rule('Expenses:Regex', regex=r'uber\s*trip'), Rule('Expenses:Substring', substring='uber')], 'Expenses:Regex'),
+    ([Rule('Expenses:Unanchored', regex=r'(ola|uber) trip'), Rule('Expenses:Substring', substring='trip')], 'Expenses:Unanchored'),
+    ([Rule('Expenses:Substring', substring='trip'), Rule('Expenses:Unanchored', regex=r'(ola|uber) trip')], 'Expenses:Substring'),
+    ([Rule('Expenses:Food', substring='swiggy')], None),
+])
+def test_first_matching_rule_wins(rules, expected):
+    assert account(Categorizer(rules), transaction('UBER TRIP BANGALORE')) == expected
+
+
+def test_amount_ranges():
+    categorizer = Categorizer([
+        Rule('Expenses:Food:Party', substring='swiggy', max_amount=Decimal(-1000)),
+        Rule('Expenses:Food', substring='swiggy'),
+        Rule('Income:Refunds', substring='swiggy', min_amount=0),
+    ])
+    assert account(categorizer, transaction('SWIGGY', '-2500')) == 'Expenses:Food:Party'
+    assert account(categorizer, transaction('SWIGGY', '-200')) == 'Expenses:Food'
+
+
+def test_unanchored_regex_after_one_failing_on_the_amount():
+    # both match at the same position, and the scan only reports the first of them
+    categorizer = Categorizer([
+        Rule('Income:Refunds', regex=r'(ola|uber)', min_amount=0),
+        Rule('Expenses:Travel', regex=r'(ola|uber) cab'),
+    ])
+    assert account(categorizer, transaction('ola cab', '-100')) == 'Expenses:Travel'
+    assert account(categorizer, transaction('ola cab', '100')) == 'Income:Refunds'
+
+
+def test_vpa_payee_tags_and_hits():
+    categorizer = Categorizer([
+        Rule('Expenses:Rent', vpa='Landlord@okhdfcbank', payee='Landlord', tags=frozenset({'rent'})),
+        Rule('Expenses:Other', substring='upi'),
+    ])
+    rent = categorizer.categorize(transaction('UPI/landlord@okhdfcbank/rent', '-20000'))
+    assert (rent.postings[-1].account, rent.payee, rent.tags) == ('Expenses:Rent', 'Landlord', {'rent'})
+    # an existing payee is kept
+    assert categorizer.categorize(transaction('UPI/landlord@okhdfcbank', payee='Mr Rao')).payee == 'Mr Rao'
+    # a VPA only matches whole
+    assert account(categorizer, transaction('UPI/landlord@okhdfcbank2')) == 'Expenses:Other'
+    assert [hits for _, hits in categorizer.report()] == [2, 1]
+
+
+def test_only_single_posting_transactions_are_changed():
+    categorizer = Categorizer([Rule('Expenses:Travel', substring='uber')])
+    entry = transaction('UBER TRIP', postings=2)
+    assert categorizer.categorize(entry) is entry
+    [(_, [categorized])] = categorizer.hook([('statement.pdf', [transaction('UBER TRIP')])])
+    assert categorized.postings[-1].account == 'Expenses:Travel'
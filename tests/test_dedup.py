@@ -0,0 +1,51 @@
+import datetime
+from decimal import Decimal
+from beancount.core import amount, data
+from beancount.ingest.extract import DUPLICATE_META
+from beancount_importers_india.utils import dedup
+
+
+def transaction(day:int, number:str, narration='UBER TRIP', month=1, account='Liabilities:CreditCard', **meta):
+    return data.Transaction(
+        {'filename': 'statement.pdf', 'lineno': 0}, datetime.date(2024, month, day), '*', None, narration,
+        frozenset(), frozenset(),
+        [data.Posting(account, amount.Amount(Decimal(number), 'INR'), None, None, None, meta or None)],
+    )
+
+
+def flags(new_entries_list):
+    return [[DUPLICATE_META in entry.meta for entry in entries] for _, entries in new_entries_list]
+
+
+def test_repeated_transactions_of_a_statement_are_kept():
+    new = [('statement.pdf', [transaction(1, '-150'), transaction(2, '-150')])]
+    assert flags(dedup.find_duplicate_entries(new, [])) == [[False, False]]
+    assert flags(dedup.find_duplicate_entries(new, None)) == [[False, False]]
+
+
+def test_new_entries_of_other_files_are_not_matched():
+    new = [('a.pdf', [transaction(1, '-150')]), ('b.pdf', [transaction(1, '-150')])]
+    assert flags(dedup.find_duplicate_entries(new, [])) == [[False], [False]]
+
+
+def test_existing_entries_match_once_within_the_window():
+    existing = [transaction(1, '-150')]
+    new = [('statement.pdf', [transaction(3, '-150'), transaction(3, '-150'), transaction(9, '-150')])]
+    assert flags(dedup.find_duplicate_entries(new, existing)) == [[True, False, False]]
+    # the index is built per call, so the same hook call again finds the same duplicates
+    assert flags(dedup.find_duplicate_entries(new, existing)) == [[True, False, False]]
+
+
+def test_references():
+    existing = [
+        transaction(5, '-500', 'ATM CASH WDL', transaction_ref='ATM CASH WDL'),
+        transaction(7, '-50', 'UPI', account='Assets:Bank', phonepe_txn_id='T1'),
+    ]
+    new = [('statement.pdf', [
+        # a repeating reference needs the amount and the date window too
+        transaction(1, '-2000', 'ATM CASH WDL', month=3, transaction_ref='ATM CASH WDL'),
+        transaction(6, '-500', 'ATM CASH WDL', transaction_ref='ATM CASH WDL'),
+        # a PhonePe id is enough on its own
+        transaction(1, '-99', 'UPI', month=5, account='Assets:Bank', phonepe_txn_id='T1'),
+    ])]
+    assert flags(dedup.find_duplicate_entries(new, existing)) == [[False, True, True]]
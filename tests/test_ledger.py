@@ -0,0 +1,77 @@
+import os
+import pytest
+from beancount.core import data
+from beancount_importers_india.utils import cache, ledger
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv(cache.CACHE_DIR_ENV, str(tmp_path/'cache'))
+    monkeypatch.delenv(cache.NO_CACHE_ENV, raising=False)
+    cache.default_cache.cache_clear()
+    monkeypatch.setattr(ledger, '_snapshots', {})
+    yield
+    cache.default_cache.cache_clear()
+
+
+@pytest.fixture
+def main(tmp_path):
+    (tmp_path/'accounts').mkdir()
+    (tmp_path/'accounts'/'bank.beancount').write_text('''
+2024-01-02 * "ATM" #cash
+  transaction_ref: "ATM CASH WDL"
+  note: "dropped from the snapshot"
+  Assets:Bank  -500 INR
+    phonepe_txn_id: "T1"
+  Expenses:Cash
+''')
+    (tmp_path/'accounts'/'card.beancount').write_text('''
+2024-01-01 * "UBER TRIP"
+  Liabilities:Card  -150 INR
+  Expenses:Travel
+''')
+    (tmp_path/'stocks.beancount').write_text('''
+2024-01-03 * "sell"
+  Assets:Stocks:INFY  -2 INFY {} @ 150 INR
+  Income:CapitalGains:INFY
+  Assets:Cash  300 INR
+''')
+    path = tmp_path/'main.beancount'
+    path.write_text('include "accounts/*.beancount"\ninclude "stocks.beancount"\ninclude "main.beancount"\n')
+    return path
+
+
+def test_includes_are_resolved_recursively(main, tmp_path):
+    names = [os.path.relpath(f, tmp_path) for f in ledger.ledger_files(str(main))]
+    # globs expanded in sorted order, and a file included twice is read once
+    assert names == ['main.beancount', 'accounts/bank.beancount', 'accounts/card.beancount', 'stocks.beancount']
+
+
+def test_snapshot_keeps_what_the_importers_use(main):
+    uber, atm, sell = ledger.load_snapshot(str(main))
+    # sorted by date, like the loader sorts
+    assert [e.narration for e in (uber, atm, sell)] == ['UBER TRIP', 'ATM', 'sell']
+    assert atm.meta['transaction_ref'] == 'ATM CASH WDL' and 'note' not in atm.meta
+    # the postings without an amount are dropped
+    assert [p.account for p in atm.postings] == ['Assets:Bank']
+    assert atm.postings[0].meta["phonepe_txn_id"] == "T1"
+    # the sell's cost is kept as written, unbooked
+    assert isinstance(sell.postings[0].cost, data.CostSpec)
+
+
+def test_only_changed_files_are_parsed_again(main, tmp_path, monkeypatch):
+    ledger.load_snapshot(str(main))
+    parsed = []
+    parse = ledger._parse
+    monkeypatch.setattr(ledger, '_parse', lambda path: parsed.append(os.path.basename(path)) or parse(path))
+    # a new process: nothing in memory, the snapshots come from the cache
+    monkeypatch.setattr(ledger, '_snapshots', {})
+    card = tmp_path/'accounts'/'card.beancount'
+    card.write_text(card.read_text() + '''
+2024-01-05 * "UBER TRIP"
+  Liabilities:Card  -90 INR
+  Expenses:Travel
+''')
+    entries = ledger.load_snapshot(str(main))
+    assert parsed == ['card.beancount']
+    assert len(entries) == 4
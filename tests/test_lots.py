@@ -0,0 +1,90 @@
+import datetime
+from decimal import Decimal
+from beancount.core import amount, data
+from beancount.ingest.extract import DUPLICATE_META
+from beancount.parser import parser
+from beancount_importers_india.utils import lots
+
+HOLDING = 'Assets:Stocks:Groww'
+GAINS = 'Income:Groww:CapitalGains'
+
+
+def trade(day:datetime.date, units:int, price:str, **meta) -> data.Transaction:
+    units, price = Decimal(units), Decimal(price)
+    postings = [data.Posting('Assets:Groww:Cash', amount.Amount(-units * price, 'INR'), None, None, None, None)]
+    if units > 0:
+        cost, price_amount = data.CostSpec(price, None, 'INR', day, None, False), None
+    else:
+        postings.append(data.Posting(f'{GAINS}:INFY', None, None, None, None, {}))
+        cost, price_amount = data.CostSpec(None, None, None, None, None, None), amount.Amount(price, 'INR')
+    postings.append(data.Posting(f'{HOLDING}:INFY', amount.Amount(units, 'INFY'), cost, price_amount, None, {}))
+    return data.Transaction({'filename': 'note.pdf', 'lineno': 0, **meta}, day, '*', None, 'trade', frozenset(), frozenset(), postings)
+
+
+def holding_postings(entry):
+    return [(p.units.number, p.cost.number_per, p.cost.date) for p in entry.postings if p.account.startswith(HOLDING)]
+
+
+def gains(entry):
+    return [p.units for p in entry.postings if p.account.startswith(GAINS)][0]
+
+
+JAN1, JAN2, FEB1 = datetime.date(2024, 1, 1), datetime.date(2024, 1, 2), datetime.date(2024, 2, 1)
+
+
+def test_sell_is_split_over_the_oldest_lots():
+    book = lots.LotBook(HOLDING, GAINS)
+    # given out of date order, booked in date order and returned as given
+    sell, buy1, buy2 = book.book_all([trade(FEB1, -12, '150'), trade(JAN1, 10, '100'), trade(JAN2, 5, '120')])
+    assert holding_postings(sell) == [(Decimal(-10), Decimal(100), JAN1), (Decimal(-2), Decimal(120), JAN2)]
+    # 10 * 50 + 2 * 30 of gains, an income
+    assert gains(sell) == amount.Amount(Decimal(-560), 'INR')
+    assert list(book.lots[f'{HOLDING}:INFY']) == [lots.Lot(Decimal(3), Decimal(120), 'INR', JAN2)]
+    assert buy1 == trade(JAN1, 10, '100')
+
+
+def test_units_without_lots_are_left_for_beancount():
+    book = lots.LotBook(HOLDING, GAINS)
+    buy, sell = book.book_all([trade(JAN1, 10, '100'), trade(FEB1, -12, '150')])
+    assert holding_postings(sell) == [(Decimal(-10), Decimal(100), JAN1), (Decimal(-2), None, None)]
+    # beancount books the rest, and the gains along with it
+    assert gains(sell) is None
+
+
+def test_seeded_from_an_unbooked_ledger():
+    entries, errors, _ = parser.parse_string(f'''
+2024-01-01 * "buy"
+  {HOLDING}:INFY  10 INFY {{100 INR}}
+  Assets:Groww:Cash
+2024-01-02 * "buy"
+  {HOLDING}:INFY  5 INFY {{120 INR}}
+  Assets:Groww:Cash
+2024-01-10 * "sell"
+  {HOLDING}:INFY  -4 INFY {{}} @ 130 INR
+  {GAINS}:INFY
+  Assets:Groww:Cash
+''')
+    assert not errors
+    book = lots.LotBook(HOLDING, GAINS)
+    book.seed(entries)
+    assert [(lot.units, lot.cost) for lot in book.lots[f'{HOLDING}:INFY']] == [(6, 100), (5, 120)]
+    sell = book.book(trade(FEB1, -8, '150'))
+    assert holding_postings(sell) == [(Decimal(-6), Decimal(100), JAN1), (Decimal(-2), Decimal(120), JAN2)]
+
+
+def test_duplicates_are_not_booked_again():
+    book = lots.LotBook(HOLDING, GAINS)
+    book.book(trade(JAN1, 10, '100'))
+    duplicate = trade(FEB1, -10, '150', **{DUPLICATE_META: True})
+    assert book.book(duplicate) is duplicate
+    assert book.lots[f'{HOLDING}:INFY'][0].units == 10
+
+
+def test_book_lots_books_per_importer_accounts():
+    class Importer:
+        holding_account, capital_gains_account = HOLDING, GAINS
+
+    existing = [trade(JAN1, 10, '100')]
+    sell, = lots.book_lots([trade(FEB1, -10, '150')], [Importer(), Importer()], existing)
+    assert holding_postings(sell) == [(Decimal(-10), Decimal(100), JAN1)]
+    assert gains(sell) == amount.Amount(Decimal(-500), 'INR')
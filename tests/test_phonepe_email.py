@@ -0,0 +1,66 @@
+import re
+import pytest
+from beancount.core import data
+from dateutil.parser import parse as dateparse
+from beancount_importers_india.PhonePe.transaction_email import month_to_number, parse_email_text
+
+EMAILS = [
+    # fields on their own lines
+    """<html><body>
+<p>Paid to</p>
+<p>Ramesh Kumar</p>
+<p>&#8377; 1,250.00</p>
+<p>Message : lunch money</p>
+<p>Txn. ID : T2401051234</p>
+<p>Txn. status : Successful</p>
+<p>Debited from : </p><p>HDFCXXXXXX9927</p>
+<p>Bank Ref. No. : 401234567</p>
+<p>Jan 5, 2024</p></body></html>""",
+    # all on one line, words of the payee and message followed by spaces
+    """<html><body><p>Received from</p><p>Ramesh Kumar </p><p>&#8377; 1,250.00</p><p>Message : lunch money </p>
+<p>Txn. ID : T2401051234</p><p>Txn. status : Successful</p><p>Credited to : </p><p>HDFCXXXXXX9927</p>
+<p>Bank Ref. No. : 401234567</p>
+<p>Jan 5, 2024</p></body></html>""",
+    # the date on the payee's line and an amount in the message
+    """<html><body><p>Paid to Ramesh Kumar Jan 5, 2024</p><p>Message : rent ₹ 300 </p>
+<p>&#8377; 1,250.00</p><p>Txn. ID : T2401051234</p><p>Txn. status : Successful</p>
+<p>Debited from : </p><p>HDFCXXXXXX9927</p></body></html>""",
+]
+
+
+def old_fields(text:str) -> tuple:
+    # the fields as the importer parsed them with one search per field, before the single pass
+    text = re.sub(r"<.*?>", "", text)
+    text = re.sub(r"&#8377;", "₹", text)
+    sign = -1 if "Debited from" in text else 1
+    date = amount = reference = bank_reference = narration = payee = status = None
+    if match := re.search(r"(?P<month>\w+) (?P<day>\d+), (?P<year>\d{4})", text):
+        date = dateparse(f"{match['year']}-{month_to_number(match['month'])}-{match['day']}").date()
+    if match := re.findall(r"(Txn. ID\s*:\s*)(\w+)", text):
+        reference = match[0][1].strip()
+    if match := re.findall(r"(Bank Ref. No.\s*: \s*)(\w*)", text):
+        bank_reference = match[0][1].strip()
+    if match := re.search(r"₹ *(?P<amount>(\d+,)*\d+(.\d{2})?)", text):
+        amount = sign * data.D(match["amount"])
+    accounts = tuple(re.findall(r"(\w+XXXX+\d+)", text))
+    if match := re.findall(r"(Message\s*:\s*)((\w+ {1,2})*)", text):
+        narration = match[0][1].strip()
+    if match := re.findall(r"(Paid to|Received from)\s*((\w+ {1,2})*)", text):
+        payee = match[0][1].strip()
+    if match := re.search(r"(Txn. status\s*:\s*)(\w*)", text):
+        status = match.group(2)
+    return date, amount, accounts, reference, bank_reference, narration, payee, status
+
+
+@pytest.mark.parametrize('text', EMAILS)
+def test_same_fields_as_per_field_search(text):
+    assert tuple(parse_email_text(text)) == old_fields(text)
+
+
+def test_date_after_payee():
+    email = parse_email_text(EMAILS[2])
+    assert str(email.date) == '2024-01-05'
+    assert email.payee == 'Ramesh Kumar Jan'
+    assert email.amount == data.D('-300')
+    # the txn id runs into the status label once the tags are removed
+    assert email.status == 'Successful'
@@ -0,0 +1,100 @@
+import ast
+import warnings
+from pathlib import Path
+import pytest
+from beancount.ingest.cache import _FileMemo
+import beancount_importers_india
+from beancount_importers_india.utils import routing
+
+PACKAGE = Path(beancount_importers_india.__file__).parent
+
+
+def defined_classes(module:str) -> set[str]:
+    # parsed rather than imported, so the check doesn't need every importer's dependencies
+    parts = module.split('.')[1:]
+    path = PACKAGE.joinpath(*parts).with_suffix('.py')
+    if not path.exists():
+        path = PACKAGE.joinpath(*parts, '__init__.py')
+    with warnings.catch_warnings():
+        # escape sequences of the importers' regexes
+        warnings.simplefilter('ignore', DeprecationWarning)
+        tree = ast.parse(path.read_text())
+    return {node.name for node in tree.body if isinstance(node, ast.ClassDef)}
+
+
+@pytest.mark.parametrize('name', sorted(set(routing.IMPORTER_FILE_KINDS) | routing.WHOLE_DOCUMENT_IMPORTERS))
+def test_importer_names_resolve_to_classes(name):
+    module, _, cls = name.rpartition('.')
+    assert cls in defined_classes(module)
+
+
+class CsvImporter:
+    def __init__(self, lines_to_grep=None):
+        self.lines_to_grep = lines_to_grep
+
+
+class PdfImporter(CsvImporter):
+    pass
+
+
+class WholeDocumentImporter(CsvImporter):
+    pass
+
+
+class OtherPackageImporter:
+    lines_to_grep = ['XXXX9999']
+
+
+@pytest.fixture(autouse=True)
+def registered(monkeypatch):
+    kinds = dict(routing.IMPORTER_FILE_KINDS)
+    for cls, kind in [(CsvImporter, 'csv'), (PdfImporter, 'pdf'), (WholeDocumentImporter, 'pdf')]:
+        kinds[f'{__name__}.{cls.__qualname__}'] = {kind}
+    monkeypatch.setattr(routing, 'IMPORTER_FILE_KINDS', kinds)
+    monkeypatch.setattr(routing, 'WHOLE_DOCUMENT_IMPORTERS', {f'{__name__}.WholeDocumentImporter'})
+
+
+def candidates(importers, path):
+    return routing.Router(importers).candidates(_FileMemo(str(path)))
+
+
+def test_text_files_read_whole(tmp_path):
+    path = tmp_path/'statement.csv'
+    path.write_text('Account statement of\nXXXXXXXX0056\n')
+    matching, absent, without_needles = CsvImporter(['XXXXXXXX 0056']), CsvImporter(['XXXX9999']), CsvImporter()
+    other_package, other_kind = OtherPackageImporter(), PdfImporter(['XXXXXXXX0056'])
+    importers = [matching, absent, without_needles, other_package, other_kind]
+    # needles are matched ignoring whitespace. importers of unknown kind are kept
+    assert candidates(importers, path) == [matching, without_needles, other_package]
+
+
+def test_needles_past_the_head_of_a_text_file(tmp_path):
+    path = tmp_path/'statement.csv'
+    path.write_text('x,y\n' * routing.HEAD_SIZE + 'XXXXXXXX0056\n')
+    absent = CsvImporter(['XXXXXXXX0056'])
+    assert candidates([absent], path) == [absent]
+
+
+def test_pdf_first_page(tmp_path, monkeypatch):
+    path = tmp_path/'statement.pdf'
+    path.write_bytes(b'%PDF-1.4')
+    monkeypatch.setattr(routing.Router, '_first_page_text', lambda self, file, password: routing._normalize('HDFC Bank Credit Card Statement'))
+    matching, absent = PdfImporter(['HDFC Bank']), PdfImporter(['ICICI Bank'])
+    # its needles may be on a later page
+    whole_document = WholeDocumentImporter(['Contract Note'])
+    assert candidates([matching, absent, whole_document], path) == [matching, whole_document]
+
+
+def test_routed_identify(tmp_path):
+    path = tmp_path/'statement.csv'
+    path.write_text('XXXXXXXX0056')
+
+    class Identifying(CsvImporter):
+        def identify(self, file):
+            return True
+    routing.IMPORTER_FILE_KINDS[f'{__name__}.{Identifying.__qualname__}'] = {'csv'}
+    matching, absent = routing.routed([Identifying(['0056']), Identifying(['9999'])])
+    file = _FileMemo(str(path))
+    assert matching.identify(file) and not absent.identify(file)
+    # the wrapper forwards the importer's attributes
+    assert absent.lines_to_grep == ['9999']
@@ -0,0 +1,72 @@
+import dataclasses
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import pytest
+from pricehist.price import Price
+from beancount_importers_india.sources import yahoo_quantized
+from beancount_importers_india.sources.yahoo_quantized import PriceJob, PriceStore, Source
+
+
+class FakeYahoo:
+    """Stands in for pricehist's Yahoo source, with a price for every day and a log of the ranges requested"""
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, series):
+        start, end = date.fromisoformat(series.start), date.fromisoformat(series.end)
+        self.requests.append((series.base, start, end))
+        days = (end - start).days + 1
+        prices = [Price((start + timedelta(days=i)).isoformat(), Decimal('120.0999')) for i in range(days)]
+        return dataclasses.replace(series, prices=prices)
+
+
+@pytest.fixture
+def fake():
+    return FakeYahoo()
+
+
+@pytest.fixture
+def source(tmp_path, fake):
+    yield Source(store=PriceStore(tmp_path/'prices.sqlite3'), fetch_series=fake)
+    yahoo_quantized._prefetched.clear()
+
+
+def at(day:date) -> datetime:
+    return datetime.combine(day, datetime.min.time())
+
+
+def test_only_missing_days_are_downloaded(source, fake):
+    day = date(2024, 1, 10)
+    price = source.get_historical_price('RELIANCE.BO', at(day))
+    assert price.price == Decimal('120.10')
+    # the miss is widened to a year back and up to yesterday
+    assert fake.requests == [('RELIANCE.BO', day - timedelta(days=365), date.today() - timedelta(days=1))]
+
+    # covered days are served from the store
+    source.get_prices_series('RELIANCE.BO', at(date(2023, 6, 1)), at(date(2024, 3, 1)))
+    assert len(fake.requests) == 1
+
+    # an earlier range only downloads the days before the covered ones
+    earlier = date(2022, 12, 1)
+    source.get_historical_price('RELIANCE.BO', at(earlier))
+    assert fake.requests[1] == ('RELIANCE.BO', earlier - timedelta(days=365), day - timedelta(days=366))
+    assert source.store.missing('RELIANCE.BO', earlier, day) == []
+
+
+def test_missing_ranges():
+    store = PriceStore.__new__(PriceStore)
+    store.coverage = lambda ticker: [(date(2024, 1, 5), date(2024, 1, 10)), (date(2024, 1, 20), date(2024, 1, 25))]
+    assert store.missing('X', date(2024, 1, 1), date(2024, 1, 31)) == [
+        (date(2024, 1, 1), date(2024, 1, 4)), (date(2024, 1, 11), date(2024, 1, 19)), (date(2024, 1, 26), date(2024, 1, 31)),
+    ]
+    assert store.missing('X', date(2024, 1, 6), date(2024, 1, 9)) == []
+
+
+def test_prefetch_serves_bean_price_from_memory(source, fake):
+    start, end = date(2024, 2, 1), date(2024, 2, 10)
+    errors = source.prefetch([PriceJob('TCS.BO', start, end, Decimal('0.05')), PriceJob('INFY.BO', start, end)])
+    assert errors == {}
+    assert sorted(r[0] for r in fake.requests) == ['INFY.BO', 'TCS.BO']
+    prices = source.get_prices_series('TCS.BO', at(start), at(end))
+    assert len(prices) == 10 and prices[0].price == Decimal('120.10')
+    assert len(fake.requests) == 2